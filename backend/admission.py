@@ -0,0 +1,315 @@
+"""
+全局准入控制 (load shedding)
+
+在请求进入端点之前检查两项全局上限:
+- 进行中的代理请求数
+- 进行中请求已接收的上游响应字节数 (按实际读取的字节数计，分块传输的响应同样计入；
+  响应体读完关闭后即归还，只统计仍在传输中的响应，批量请求中已完成的条目不会一直占用字节预算)
+
+超出上限的请求只做短暂排队，排队已满或等待超时立即返回 503 + Retry-After，而不是无限堆积。
+请求按端点分为四个优先级: chat > test > models > batch。低优先级只能使用部分容量，
+名额释放时也优先唤醒高优先级的等待者，因此高峰期先被拒绝的是离线批量任务、/models 刷新与 /test 探测。
+
+环境变量:
+    ADMISSION_MAX_INFLIGHT        - 最大进行中请求数 (默认 256，0 表示不限制)
+    ADMISSION_MAX_UPSTREAM_BYTES  - 进行中上游响应字节数上限 (默认 64MB，0 表示不限制)
+    ADMISSION_QUEUE_TIMEOUT       - 超出上限时的最长排队时间，秒 (默认 0.5)
+    ADMISSION_MAX_QUEUE           - 最大排队数 (默认 128)
+    ADMISSION_RETRY_AFTER         - 503 响应的 Retry-After，秒 (默认 1)
+    ADMISSION_TEST_SHARE          - test 优先级可使用的容量比例 (默认 0.8)
+    ADMISSION_MODELS_SHARE        - models 优先级可使用的容量比例 (默认 0.5)
+    ADMISSION_BATCH_SHARE         - batch 优先级 (/chat/batch) 可使用的容量比例 (默认 0.25)
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from metrics import registry
+from serialization import FastJSONResponse
+from timing import record_span
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "256"))
+ADMISSION_MAX_UPSTREAM_BYTES = int(os.getenv("ADMISSION_MAX_UPSTREAM_BYTES", str(64 * 1024 * 1024)))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0.5"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# 优先级 (数值越小越优先) 及各自可使用的容量比例
+PRIORITIES = {"chat": 0, "test": 1, "models": 2, "batch": 3}
+ADMISSION_SHARES = {
+    "chat": 1.0,
+    "test": float(os.getenv("ADMISSION_TEST_SHARE", "0.8")),
+    "models": float(os.getenv("ADMISSION_MODELS_SHARE", "0.5")),
+    "batch": float(os.getenv("ADMISSION_BATCH_SHARE", "0.25")),
+}
+
+ADMISSIONS = registry.counter(
+    "proxy_admission_total", "准入决策 (decision: admitted / queued / shed_queue_full / shed_timeout / shed_preempted)", ("priority", "decision"))
+INFLIGHT = registry.gauge("proxy_admission_inflight", "进行中的代理请求数", ("priority",))
+INFLIGHT_BYTES = registry.gauge("proxy_admission_inflight_bytes", "进行中请求持有的上游响应字节数")
+QUEUE_DEPTH = registry.gauge("proxy_admission_queue_depth", "等待准入的请求数", ("priority",))
+QUEUE_WAIT = registry.histogram("proxy_admission_wait_seconds", "等待准入的时间 (含最终被拒绝的请求)", ("priority",))
+
+
+class Shed(Exception):
+    """请求被拒绝 (reason: queue_full / timeout / preempted)"""
+    error_class = "shed"
+
+    def __init__(self, reason: str):
+        super().__init__(f"服务繁忙，请稍后重试 ({reason})")
+        self.reason = reason
+
+
+@dataclass
+class Ticket:
+    """一个已准入请求占用的名额及其持有的上游字节数"""
+    priority: str
+    bytes: int = 0
+    released: bool = False   # 释放后不再计入字节 (复制了请求上下文的后台任务可能比请求活得更久)
+
+
+_current: ContextVar[Optional[Ticket]] = ContextVar("admission_ticket", default=None)
+
+
+# ============================================================================
+# 准入控制器
+# ============================================================================
+
+class AdmissionController:
+    """全局进行中请求数 / 上游字节数上限 + 按优先级排队"""
+
+    def __init__(
+        self,
+        max_inflight: int = ADMISSION_MAX_INFLIGHT,
+        max_bytes: int = ADMISSION_MAX_UPSTREAM_BYTES,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        shares: Optional[Dict[str, float]] = None,
+    ):
+        self.max_inflight = max_inflight
+        self.max_bytes = max_bytes
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.shares = shares or ADMISSION_SHARES
+        self.inflight: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self.bytes = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, str]] = []
+        self._seq = itertools.count()
+        self.decisions: Dict[str, int] = {}
+
+    def capacity(self, priority: str) -> float:
+        """该优先级可使用的进行中请求数上限"""
+        if self.max_inflight <= 0:
+            return math.inf
+        return max(1, int(self.max_inflight * self.shares.get(priority, 1.0)))
+
+    def _fits(self, priority: str) -> bool:
+        if self.max_bytes > 0 and self.bytes >= self.max_bytes:
+            return False
+        return sum(self.inflight.values()) < self.capacity(priority)
+
+    def _take(self, priority: str) -> Ticket:
+        self.inflight[priority] += 1
+        INFLIGHT.set(self.inflight[priority], priority=priority)
+        return Ticket(priority)
+
+    def _decide(self, priority: str, decision: str) -> None:
+        self.decisions[decision] = self.decisions.get(decision, 0) + 1
+        ADMISSIONS.inc(priority=priority, decision=decision)
+
+    async def acquire(self, priority: str) -> Ticket:
+        """获取准入名额；被拒绝时抛出 Shed"""
+        rank = PRIORITIES[priority]
+        # 已有同级或更高优先级的等待者时不插队
+        if self._fits(priority) and not any(w[0] <= rank for w in self._waiters):
+            self._decide(priority, "admitted")
+            return self._take(priority)
+        if self.queue_timeout <= 0 or (len(self._waiters) >= self.max_queue and not self._preempt(rank)):
+            self._decide(priority, "shed_queue_full")
+            raise Shed("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (rank, next(self._seq), future, priority)
+        heapq.heappush(self._waiters, entry)
+        self._update_queue_depth()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            # 超时与分配名额 / 被抢占同时发生时以后者为准
+            if not future.done():
+                future.cancel()
+                self._decide(priority, "shed_timeout")
+                raise Shed("timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release(future.result())
+            future.cancel()
+            raise
+        finally:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            self._update_queue_depth()
+            QUEUE_WAIT.observe(time.monotonic() - start, priority=priority)
+        # 被抢占时抛出 Shed (已记为 shed_preempted)，每个请求只记录一个决策
+        ticket = future.result()
+        self._decide(priority, "queued")
+        return ticket
+
+    @asynccontextmanager
+    async def admitted(self, priority: str) -> AsyncIterator[Ticket]:
+        """在准入名额内执行 (供不经过 HTTP 中间件的 WebSocket 请求使用)；被拒绝时抛出 Shed"""
+        ticket = await self.acquire(priority)
+        token = _current.set(ticket)
+        try:
+            yield ticket
+        finally:
+            _current.reset(token)
+            self.release(ticket)
+
+    def _preempt(self, rank: int) -> bool:
+        """队列已满时拒绝最晚到达的最低优先级等待者，为更高优先级的请求腾出位置"""
+        victim = max((w for w in self._waiters if not w[2].done()), key=lambda w: (w[0], w[1]), default=None)
+        if victim is None or victim[0] <= rank:
+            return False
+        self._waiters.remove(victim)
+        heapq.heapify(self._waiters)
+        self._decide(victim[3], "shed_preempted")
+        victim[2].set_exception(Shed("preempted"))
+        return True
+
+    def release(self, ticket: Ticket) -> None:
+        ticket.released = True
+        self.inflight[ticket.priority] = max(0, self.inflight[ticket.priority] - 1)
+        INFLIGHT.set(self.inflight[ticket.priority], priority=ticket.priority)
+        self.bytes = max(0, self.bytes - ticket.bytes)
+        INFLIGHT_BYTES.set(self.bytes)
+        ticket.bytes = 0
+        self._wake()
+
+    def _wake(self) -> None:
+        # 按优先级 + FIFO 唤醒；队首放不下时后面的低优先级 (容量比例更小) 也放不下
+        while self._waiters and self._fits(self._waiters[0][3]):
+            _, _, future, priority = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            future.set_result(self._take(priority))
+        self._update_queue_depth()
+
+    def _update_queue_depth(self) -> None:
+        depth = {p: 0 for p in PRIORITIES}
+        for _, _, future, priority in self._waiters:
+            if not future.done():
+                depth[priority] += 1
+        for priority, n in depth.items():
+            QUEUE_DEPTH.set(n, priority=priority)
+
+    def charge(self, ticket: Ticket, size: int) -> None:
+        """把 size 字节计入 ticket (已释放的名额忽略，避免字节数只增不减)"""
+        if ticket.released:
+            return
+        ticket.bytes += size
+        self.bytes += size
+        INFLIGHT_BYTES.set(self.bytes)
+
+    def discharge(self, ticket: Ticket, size: int) -> None:
+        """响应体关闭后从 ticket 中扣除其 size 字节 (名额已释放时已整体归还)"""
+        size = min(size, ticket.bytes)
+        if ticket.released or size <= 0:
+            return
+        ticket.bytes -= size
+        self.bytes = max(0, self.bytes - size)
+        INFLIGHT_BYTES.set(self.bytes)
+        self._wake()
+
+    async def on_response(self, response: httpx.Response) -> None:
+        """httpx 响应钩子: 包装响应体，读取时把实际字节数计入当前请求的名额"""
+        ticket = _current.get()
+        if ticket is None or ticket.released:
+            return
+        response.stream = _CountingStream(response.stream, self, ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_inflight": self.max_inflight,
+            "max_upstream_bytes": self.max_bytes,
+            "inflight": dict(self.inflight),
+            "inflight_bytes": self.bytes,
+            "queue_depth": sum(1 for w in self._waiters if not w[2].done()),
+            "decisions": dict(self.decisions),
+        }
+
+
+class _CountingStream(httpx.AsyncByteStream):
+    """透传上游响应体，并把读取到的字节数计入请求名额 (关闭时归还)"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, controller: AdmissionController, ticket: Ticket):
+        self._stream = stream
+        self._controller = controller
+        self._ticket = ticket
+        self._charged = 0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._controller.charge(self._ticket, len(chunk))
+            self._charged += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        charged, self._charged = self._charged, 0
+        self._controller.discharge(self._ticket, charged)
+        await self._stream.aclose()
+
+
+# ============================================================================
+# ASGI 中间件
+# ============================================================================
+
+class AdmissionMiddleware:
+    """按路径确定优先级并执行准入控制；名额一直占用到响应 (含流式响应) 发送完毕"""
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController, routes: Dict[str, str]):
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        priority = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if priority is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            ticket = await self.controller.acquire(priority)
+        except Shed as e:
+            record_span("admission", start, decision=e.reason)
+            response = FastJSONResponse(
+                {"success": False, "message": str(e)},
+                status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+        record_span("admission", start)
+        token = _current.set(ticket)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            self.controller.release(ticket)
@@ -0,0 +1,43 @@
+"""
+批量任务并发执行
+
+以全局并发上限 + 每个 key (通常为上游 origin) 的并发上限运行一组任务，
+并按完成顺序逐个产出结果，供批量端点以流式方式返回。
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Sequence, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def run_bounded(
+    items: Sequence[T],
+    worker: Callable[[int, T], Awaitable[R]],
+    key: Callable[[T], str],
+    concurrency: int,
+    per_key_concurrency: int,
+) -> AsyncIterator[R]:
+    """
+    并发执行 worker(index, item)，按完成顺序产出结果
+
+    worker 应自行捕获异常并转换为结果；迭代提前结束 (如客户端断开) 时取消剩余任务。
+    """
+    global_sem = asyncio.Semaphore(max(1, concurrency))
+    key_sems: Dict[str, asyncio.Semaphore] = {}
+
+    async def run(index: int, item: T) -> R:
+        sem = key_sems.setdefault(key(item), asyncio.Semaphore(max(1, per_key_concurrency)))
+        # 先占用 key 的名额再占全局名额，避免排队等待同一 origin 时占着全局槽位
+        async with sem:
+            async with global_sem:
+                return await worker(index, item)
+
+    tasks = [asyncio.ensure_future(run(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+代理压测工具
+
+以固定目标 RPS (开环) 向代理的 /chat /test /models 发请求，统计吞吐、
+延迟与代理自身开销 (p50/p95/p99) 以及代理进程内存。
+
+代理开销 = 代理端到端延迟 - Mock 上游注入的延迟:
+    /chat            逐请求精确扣除 (raw_response.mock_latency_ms)
+    /test, /models   扣除 Mock 上游在压测期间的总注入延迟按请求数均摊后的值 (GET /_stats)，
+                     因此 /models 命中代理缓存时开销会接近代理的纯处理时间
+
+使用方法 (在 backend 目录下):
+    # 自动拉起 Mock 上游与代理，全部在本机离线运行
+    python bench/loadgen.py --spawn --rps 200 --duration 30
+
+    # 压测已经在运行的代理
+    python bench/loadgen.py --proxy http://127.0.0.1:8000 --upstream http://127.0.0.1:9000 --proxy-pid 12345
+
+    # 指定端点与格式配比
+    python bench/loadgen.py --spawn --mix chat=6,test=2,models=2 --formats openai,anthropic
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BASE_PATHS = {
+    "openai": "/openai/v1",
+    "anthropic": "/anthropic/v1",
+    "gemini": "/gemini/v1beta",
+    "cohere": "/cohere/v2",
+}
+
+
+# ============================================================================
+# 统计
+# ============================================================================
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def read_rss_kb(pid: Optional[int]) -> Dict[str, int]:
+    """读取 /proc/<pid>/status 中的 VmRSS / VmHWM (KB)"""
+    path = f"/proc/{pid or 'self'}/status"
+    result = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    result[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return result
+
+
+class Results:
+    def __init__(self):
+        self.latency_ms: Dict[str, List[float]] = {}
+        self.upstream_ms: Dict[str, List[Optional[float]]] = {}
+        self.errors: Dict[str, int] = {}
+        self.dropped = 0
+
+    def add(self, endpoint: str, latency_ms: float, upstream_ms: Optional[float], ok: bool) -> None:
+        self.latency_ms.setdefault(endpoint, []).append(latency_ms)
+        self.upstream_ms.setdefault(endpoint, []).append(upstream_ms)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self, elapsed: float, mean_upstream_ms: Dict[str, float]) -> Dict[str, Any]:
+        endpoints = {}
+        total = 0
+        for endpoint, latencies in self.latency_ms.items():
+            total += len(latencies)
+            overhead = [
+                lat - (up if up is not None else mean_upstream_ms.get(endpoint, 0.0))
+                for lat, up in zip(latencies, self.upstream_ms[endpoint])
+            ]
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(latencies) / elapsed, 1),
+                "latency_ms": {f"p{p}": round(percentile(latencies, p), 2) for p in (50, 95, 99)},
+                "overhead_ms": {f"p{p}": round(percentile(overhead, p), 2) for p in (50, 95, 99)},
+            }
+        return {"elapsed_s": round(elapsed, 2), "completed": total, "throughput_rps": round(total / elapsed, 1),
+                "dropped": self.dropped, "endpoints": endpoints}
+
+
+# ============================================================================
+# 压测
+# ============================================================================
+
+def build_request(endpoint: str, fmt: str, upstream: str) -> Dict[str, Any]:
+    body: Dict[str, Any] = {
+        "provider_id": f"mock-{fmt}",
+        "api_key": "sk-bench",
+        "model": "mock-model",
+        "base_url": upstream + BASE_PATHS[fmt],
+        "api_format": fmt,
+    }
+    if endpoint == "/chat":
+        body["messages"] = [{"role": "user", "content": "Say something"}]
+        body["raw_fields"] = ["mock_latency_ms"]
+    if endpoint == "/models":
+        body.pop("model")
+    return body
+
+
+async def one(client: httpx.AsyncClient, proxy: str, endpoint: str, body: Dict[str, Any], results: Results) -> None:
+    start = time.perf_counter()
+    upstream_ms = None
+    ok = False
+    try:
+        response = await client.post(proxy + endpoint, json=body)
+        data = response.json()
+        ok = response.status_code == 200 and bool(data.get("success"))
+        if endpoint == "/chat" and ok:
+            upstream_ms = (data.get("raw_response") or {}).get("mock_latency_ms")
+    except Exception:
+        pass
+    results.add(endpoint, (time.perf_counter() - start) * 1000, upstream_ms, ok)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mix: List[str] = []
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        mix.extend([f"/{name.strip()}"] * int(weight or 1))
+    formats = [f.strip() for f in args.formats.split(",")]
+
+    results = Results()
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # 预热: 建立连接、填充模型缓存
+        for fmt in formats:
+            await one(client, args.proxy, "/models", build_request("/models", fmt, args.upstream), Results())
+
+        mock_before = await fetch_mock_totals(client, args.upstream)
+        total = int(args.rps * args.duration)
+        inflight: set = set()
+        rss_before = read_rss_kb(args.proxy_pid)
+        started = time.perf_counter()
+        for i in range(total):
+            # 开环调度: 按计划时间发出请求，不等待前一个完成
+            delay = started + i / args.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(inflight) >= args.max_inflight:
+                results.dropped += 1
+                continue
+            endpoint = random.choice(mix)
+            task = asyncio.ensure_future(one(client, args.proxy, endpoint, build_request(endpoint, random.choice(formats), args.upstream), results))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.gather(*inflight)
+        elapsed = time.perf_counter() - started
+
+        mock_after = await fetch_mock_totals(client, args.upstream)
+
+    # 压测期间 Mock 上游的注入延迟总和，按代理请求数均摊 (/chat 已逐请求扣除，从 chat 路由总和中减掉)
+    spent = {k: mock_after.get(k, 0.0) - mock_before.get(k, 0.0) for k in ("chat", "models")}
+    exact_chat = sum(u for u in results.upstream_ms.get("/chat", []) if u is not None)
+    mean_upstream: Dict[str, float] = {}
+    if results.latency_ms.get("/test"):
+        mean_upstream["/test"] = max(0.0, spent["chat"] - exact_chat) / len(results.latency_ms["/test"])
+    if results.latency_ms.get("/models"):
+        mean_upstream["/models"] = spent["models"] / len(results.latency_ms["/models"])
+
+    report = results.report(elapsed, mean_upstream)
+    report["proxy_memory_kb"] = {"before": rss_before, "after": read_rss_kb(args.proxy_pid)}
+    return report
+
+
+async def fetch_mock_totals(client: httpx.AsyncClient, upstream: str) -> Dict[str, float]:
+    """Mock 上游各类路由 (chat / models) 的累计注入延迟 (毫秒)"""
+    try:
+        stats = (await client.get(upstream + "/_stats")).json()
+    except Exception:
+        return {}
+    totals: Dict[str, float] = {}
+    for route, n in stats.get("requests", {}).items():
+        kind = route.rsplit(":", 1)[-1]
+        totals[kind] = totals.get(kind, 0.0) + stats["mean_latency_ms"][route] * n
+    return totals
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n⏱  {report['elapsed_s']}s  完成 {report['completed']}  吞吐 {report['throughput_rps']} rps  丢弃 {report['dropped']}")
+    print(f"{'endpoint':<10}{'reqs':>7}{'err':>6}{'rps':>8}  {'lat p50/p95/p99 (ms)':>26}  {'overhead p50/p95/p99 (ms)':>28}")
+    for endpoint, r in sorted(report["endpoints"].items()):
+        lat = "/".join(str(r["latency_ms"][k]) for k in ("p50", "p95", "p99"))
+        ovh = "/".join(str(r["overhead_ms"][k]) for k in ("p50", "p95", "p99"))
+        print(f"{endpoint:<10}{r['requests']:>7}{r['errors']:>6}{r['throughput_rps']:>8}  {lat:>26}  {ovh:>28}")
+    mem = report["proxy_memory_kb"]
+    print(f"🧠 代理内存 RSS: {mem['before'].get('VmRSS', '?')} KB -> {mem['after'].get('VmRSS', '?')} KB (峰值 {mem['after'].get('VmHWM', '?')} KB)")
+
+
+# ============================================================================
+# 进程管理
+# ============================================================================
+
+async def wait_ready(url: str, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} 未就绪")
+
+
+def spawn(args: argparse.Namespace) -> List[subprocess.Popen]:
+    """启动 Mock 上游与代理子进程"""
+    mock_cmd = [sys.executable, os.path.join(BACKEND_DIR, "bench", "mock_upstream.py"),
+                "--port", str(args.upstream_port), "--latency", args.latency, "--body-size", str(args.body_size),
+                "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate)]
+    proxy_cmd = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.proxy_port), "--log-level", "warning"]
+    env = dict(os.environ)
+    if args.no_models_cache:
+        env.update(MODELS_CACHE_TTL="0", MODELS_CACHE_STALE_TTL="0")
+    procs = [subprocess.Popen(mock_cmd, cwd=BACKEND_DIR), subprocess.Popen(proxy_cmd, cwd=BACKEND_DIR, env=env)]
+    args.upstream = f"http://127.0.0.1:{args.upstream_port}"
+    args.proxy = f"http://127.0.0.1:{args.proxy_port}"
+    args.proxy_pid = procs[1].pid
+    return procs
+
+
+async def main(args: argparse.Namespace) -> None:
+    procs: List[subprocess.Popen] = spawn(args) if args.spawn else []
+    try:
+        await wait_ready(args.upstream + "/_stats")
+        await wait_ready(args.proxy + "/")
+        report = await run(args)
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"✅ 已保存到 {args.json}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="代理压测工具")
+    parser.add_argument("--proxy", default="http://127.0.0.1:8000")
+    parser.add_argument("--upstream", default="http://127.0.0.1:9000", help="Mock 上游地址")
+    parser.add_argument("--proxy-pid", type=int, default=None, help="代理进程 PID (用于读取内存)")
+    parser.add_argument("--spawn", action="store_true", help="自动启动 Mock 上游与代理")
+    parser.add_argument("--proxy-port", type=int, default=18000)
+    parser.add_argument("--upstream-port", type=int, default=19000)
+    parser.add_argument("--rps", type=float, default=100.0, help="目标请求速率")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长 (秒)")
+    parser.add_argument("--max-inflight", type=int, default=512, help="最大并发请求数，超出则计为丢弃")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--mix", default="chat=6,test=2,models=2", help="端点配比")
+    parser.add_argument("--formats", default="openai,anthropic,gemini,cohere")
+    parser.add_argument("--json", default=None, help="将报告写入 JSON 文件")
+    # 以下参数仅在 --spawn 时传给 Mock 上游 / 代理
+    parser.add_argument("--latency", default="fixed:50")
+    parser.add_argument("--body-size", type=int, default=1024)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--no-models-cache", action="store_true", help="关闭代理的模型列表缓存")
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(main(build_parser().parse_args()))
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+多格式 Mock 上游
+
+本地模拟 STRATEGY_REGISTRY 中四种格式 (openai / anthropic / gemini / cohere) 的
+聊天与模型列表接口，用于离线压测代理本身的开销。
+
+路由 (base_url 取值):
+    http://127.0.0.1:9000/openai/v1      - POST /chat/completions, GET /models
+    http://127.0.0.1:9000/anthropic/v1   - POST /messages, GET /models
+    http://127.0.0.1:9000/gemini/v1beta  - POST /models/{model}:generateContent | :streamGenerateContent, GET /models
+    http://127.0.0.1:9000/cohere/v2      - POST /chat, GET /models
+    GET /_stats                          - 已注入的延迟 / 错误统计
+
+每个 JSON 响应体都带 mock_latency_ms 字段，记录本次注入的延迟，压测时用于扣除上游耗时。
+
+使用方法:
+    python bench/mock_upstream.py --port 9000 --latency lognormal:120:0.5 --body-size 2048
+    python bench/mock_upstream.py --latency uniform:20:200 --error-rate 0.01 --rate-limit-rate 0.02
+
+延迟分布 (毫秒):
+    fixed:<ms> | uniform:<min>:<max> | normal:<mean>:<stddev> | lognormal:<median>:<sigma>
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+# ============================================================================
+# 配置
+# ============================================================================
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """解析延迟分布描述，返回采样函数 (毫秒)"""
+    kind, *args = spec.split(":")
+    nums = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: nums[0]
+    if kind == "uniform":
+        return lambda: random.uniform(nums[0], nums[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(nums[0], nums[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(nums[0]), nums[1])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class MockConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency = parse_latency(args.latency)
+        self.body_size = args.body_size
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.retry_after = args.retry_after
+        self.stream_chunks = args.stream_chunks
+        self.chunk_delay_ms = args.chunk_delay_ms
+        self.models = args.models
+
+
+class MockStats:
+    def __init__(self):
+        self.requests: Dict[str, int] = {}
+        self.latency_sum_ms: Dict[str, float] = {}
+        self.errors = 0
+        self.rate_limited = 0
+
+    def record(self, route: str, latency_ms: float) -> None:
+        self.requests[route] = self.requests.get(route, 0) + 1
+        self.latency_sum_ms[route] = self.latency_sum_ms.get(route, 0.0) + latency_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "mean_latency_ms": {r: self.latency_sum_ms[r] / n for r, n in self.requests.items() if n},
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+        }
+
+
+# ============================================================================
+# 各格式响应体
+# ============================================================================
+
+def _text(size: int) -> str:
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do".split()
+    out: List[str] = []
+    length = 0
+    while length < size:
+        w = random.choice(words)
+        out.append(w)
+        length += len(w) + 1
+    return " ".join(out)[:size]
+
+
+def chat_body(fmt: str, model: str, text: str) -> Dict[str, Any]:
+    usage_in, usage_out = 12, max(1, len(text) // 4)
+    if fmt == "openai":
+        return {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": usage_in, "completion_tokens": usage_out, "total_tokens": usage_in + usage_out},
+        }
+    if fmt == "anthropic":
+        return {
+            "id": "msg_mock", "type": "message", "role": "assistant", "model": model,
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn",
+            "usage": {"input_tokens": usage_in, "output_tokens": usage_out},
+        }
+    if fmt == "gemini":
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": usage_in, "candidatesTokenCount": usage_out, "totalTokenCount": usage_in + usage_out},
+            "modelVersion": model,
+        }
+    return {
+        "id": "cohere-mock", "finish_reason": "COMPLETE",
+        "message": {"role": "assistant", "content": [{"type": "text", "text": text}]},
+        "usage": {"billed_units": {"input_tokens": usage_in, "output_tokens": usage_out}},
+    }
+
+
+def stream_events(fmt: str, model: str, chunks: List[str]) -> List[Dict[str, Any]]:
+    usage_in, usage_out = 12, sum(max(1, len(c) // 4) for c in chunks)
+    if fmt == "openai":
+        events = [{"model": model, "choices": [{"index": 0, "delta": {"content": c}}]} for c in chunks]
+        events.append({"model": model, "choices": [], "usage": {"prompt_tokens": usage_in, "completion_tokens": usage_out, "total_tokens": usage_in + usage_out}})
+        return events
+    if fmt == "anthropic":
+        return (
+            [{"type": "message_start", "message": {"model": model, "usage": {"input_tokens": usage_in}}}]
+            + [{"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": c}} for c in chunks]
+            + [{"type": "message_delta", "usage": {"output_tokens": usage_out}}, {"type": "message_stop"}]
+        )
+    if fmt == "gemini":
+        events = [{"candidates": [{"content": {"role": "model", "parts": [{"text": c}]}}]} for c in chunks]
+        events[-1]["usageMetadata"] = {"promptTokenCount": usage_in, "candidatesTokenCount": usage_out, "totalTokenCount": usage_in + usage_out}
+        return events
+    return (
+        [{"type": "content-delta", "index": 0, "delta": {"message": {"content": {"text": c}}}} for c in chunks]
+        + [{"type": "message-end", "delta": {"usage": {"billed_units": {"input_tokens": usage_in, "output_tokens": usage_out}}}}]
+    )
+
+
+def models_body(fmt: str, count: int) -> Dict[str, Any]:
+    if fmt == "gemini":
+        return {"models": [{"name": f"models/mock-{i}", "displayName": f"Mock {i}"} for i in range(count)]}
+    if fmt == "cohere":
+        return {"models": [{"name": f"mock-{i}"} for i in range(count)]}
+    return {"data": [{"id": f"mock-{i}", "created": 1_700_000_000 + i, "object": "model"} for i in range(count)]}
+
+
+# ============================================================================
+# 应用
+# ============================================================================
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock Upstream")
+    stats = MockStats()
+
+    async def inject(route: str):
+        """注入延迟与错误；返回 (延迟毫秒, 错误响应或 None)"""
+        latency_ms = config.latency()
+        stats.record(route, latency_ms)
+        await asyncio.sleep(latency_ms / 1000)
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            stats.rate_limited += 1
+            return latency_ms, JSONResponse({"error": {"message": "rate limited (mock)"}}, status_code=429,
+                                            headers={"Retry-After": str(config.retry_after)})
+        if roll < config.rate_limit_rate + config.error_rate:
+            stats.errors += 1
+            return latency_ms, JSONResponse({"error": {"message": "internal error (mock)"}}, status_code=500)
+        return latency_ms, None
+
+    async def sse(fmt: str, model: str) -> AsyncIterator[bytes]:
+        chunk_size = max(1, config.body_size // max(1, config.stream_chunks))
+        chunks = [_text(chunk_size) for _ in range(config.stream_chunks)]
+        for event in stream_events(fmt, model, chunks):
+            yield f"data: {json.dumps(event)}\n\n".encode()
+            if config.chunk_delay_ms:
+                await asyncio.sleep(config.chunk_delay_ms / 1000)
+        if fmt == "openai":
+            yield b"data: [DONE]\n\n"
+
+    async def chat(fmt: str, model: str, stream: bool) -> Response:
+        latency_ms, error = await inject(f"{fmt}:{'stream' if stream else 'chat'}")
+        if error is not None:
+            return error
+        if stream:
+            return StreamingResponse(sse(fmt, model), media_type="text/event-stream")
+        body = chat_body(fmt, model, _text(config.body_size))
+        body["mock_latency_ms"] = latency_ms
+        return JSONResponse(body)
+
+    async def models(fmt: str) -> Response:
+        latency_ms, error = await inject(f"{fmt}:models")
+        if error is not None:
+            return error
+        body = models_body(fmt, config.models)
+        body["mock_latency_ms"] = latency_ms
+        return JSONResponse(body)
+
+    @app.post("/openai/v1/chat/completions")
+    async def openai_chat(request: Request):
+        payload = await request.json()
+        return await chat("openai", payload.get("model", ""), bool(payload.get("stream")))
+
+    @app.post("/anthropic/v1/messages")
+    async def anthropic_chat(request: Request):
+        payload = await request.json()
+        return await chat("anthropic", payload.get("model", ""), bool(payload.get("stream")))
+
+    @app.post("/gemini/v1beta/models/{target}")
+    async def gemini_chat(target: str):
+        model, _, action = target.partition(":")
+        return await chat("gemini", model, action == "streamGenerateContent")
+
+    @app.post("/cohere/v2/chat")
+    async def cohere_chat(request: Request):
+        payload = await request.json()
+        return await chat("cohere", payload.get("model", ""), bool(payload.get("stream")))
+
+    @app.get("/openai/v1/models")
+    async def openai_models():
+        return await models("openai")
+
+    @app.get("/anthropic/v1/models")
+    async def anthropic_models():
+        return await models("anthropic")
+
+    @app.get("/gemini/v1beta/models")
+    async def gemini_models():
+        return await models("gemini")
+
+    @app.get("/cohere/v2/models")
+    async def cohere_models():
+        return await models("cohere")
+
+    @app.get("/_stats")
+    async def mock_stats():
+        return stats.snapshot()
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="多格式 Mock 上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="fixed:50", help="延迟分布，如 fixed:50 / uniform:20:200 / lognormal:120:0.5")
+    parser.add_argument("--body-size", type=int, default=1024, help="回复文本长度 (字符)")
+    parser.add_argument("--models", type=int, default=200, help="模型列表条目数")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="流式响应的分片数")
+    parser.add_argument("--chunk-delay-ms", type=float, default=10.0, help="流式分片间隔 (毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 响应的 Retry-After (秒)")
+    return parser
+
+
+if __name__ == "__main__":
+    import uvicorn
+    args = build_parser().parse_args()
+    print(f"🧪 Mock Upstream @ http://{args.host}:{args.port}  latency={args.latency}")
+    uvicorn.run(create_app(MockConfig(args)), host=args.host, port=args.port, log_level="warning")
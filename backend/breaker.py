@@ -0,0 +1,231 @@
+"""
+按 (api_format, 上游 origin) 的熔断器
+
+closed    - 正常放行，记录最近 BREAKER_WINDOW 次调用的结果
+open      - 窗口内失败率 (错误或慢调用) 超过阈值后打开，期间请求立即失败，不再等待连接超时
+half_open - 打开 BREAKER_OPEN_SECONDS 秒后放行少量试探请求: 全部成功则关闭，任一失败则重新打开
+
+只有说明上游不可用的错误才计为失败 (5xx / 超时 / 网络错误)；4xx (凭据错误、由限流器处理的 429 等) 说明上游可达，按成功计。
+慢调用只按上游首字节时间 (发出请求到收到响应头) 判断，由连接池的 httpx 请求 / 响应钩子记录:
+长回复与 SSE 流的总时长取决于输出长度，不说明上游异常。
+已发出请求但直到截止时间仍未收到响应头而被取消的调用同样计为失败；对冲落败等提前取消不计入。
+
+环境变量:
+    BREAKER_WINDOW            - 统计窗口内的调用次数 (默认 20)
+    BREAKER_MIN_CALLS         - 窗口内至少有这么多次调用才会打开 (默认 5)
+    BREAKER_ERROR_RATE        - 失败率阈值 (默认 0.5)
+    BREAKER_SLOW_CALL         - 首字节耗时超过此值的调用计为失败，秒 (默认 30)
+    BREAKER_OPEN_SECONDS      - 打开状态持续时间，秒 (默认 30)
+    BREAKER_HALF_OPEN_PROBES  - 半开状态下的试探请求数 (默认 1)
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from deadline import DeadlineExceeded
+from metrics import registry
+from pool import origin_of
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "30"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_CLOCK_SLACK = 0.01   # 事件循环按时钟精度提前触发定时器，判断截止时间是否已到时留出余量
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = registry.gauge("proxy_breaker_state", "熔断器状态 (0 closed / 1 half_open / 2 open)", ("api_format", "origin"))
+TRANSITIONS = registry.counter("proxy_breaker_transitions_total", "熔断器状态切换次数", ("api_format", "origin", "state"))
+REJECTIONS = registry.counter("proxy_breaker_rejections_total", "熔断期间被直接拒绝的请求", ("api_format", "origin"))
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发往上游"""
+    error_class = "circuit_open"
+
+
+def is_breaker_failure(e: BaseException) -> bool:
+    """是否说明上游不可用: 5xx / 超时 / 网络错误"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, (httpx.TimeoutException, httpx.TransportError))
+
+
+@dataclass
+class _Call:
+    """guard 内的一次调用: 由 httpx 钩子记录发出请求与收到响应头的时间"""
+    sent: Optional[float] = None
+    first_byte: Optional[float] = None
+
+    def ttfb(self) -> Optional[float]:
+        if self.sent is None or self.first_byte is None:
+            return None
+        return self.first_byte - self.sent
+
+
+_current: ContextVar[Optional[_Call]] = ContextVar("breaker_call", default=None)
+
+
+# ============================================================================
+# 单个熔断器
+# ============================================================================
+
+class CircuitBreaker:
+    """closed / open / half_open 三态熔断器"""
+
+    def __init__(self, api_format: str, origin: str):
+        self.api_format = api_format
+        self.origin = origin
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=BREAKER_WINDOW)  # True 表示失败
+        self._probes = 0        # 半开状态下进行中的试探请求
+        self._probe_ok = 0      # 半开状态下已成功的试探请求
+        self.rejected = 0
+        BREAKER_STATE.set(0, api_format=api_format, origin=origin)
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._outcomes.clear()
+        self._probes = 0
+        self._probe_ok = 0
+        BREAKER_STATE.set(_STATE_VALUES[state], api_format=self.api_format, origin=self.origin)
+        TRANSITIONS.inc(api_format=self.api_format, origin=self.origin, state=state)
+
+    def retry_in(self) -> float:
+        """距离允许试探请求的剩余秒数"""
+        return max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic())
+
+    def before_call(self) -> None:
+        """放行或拒绝一次调用 (拒绝时抛出 CircuitOpenError)"""
+        if self.state == OPEN and self.retry_in() <= 0:
+            self._transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and self._probes + self._probe_ok < BREAKER_HALF_OPEN_PROBES:
+            self._probes += 1
+            return
+        self.rejected += 1
+        REJECTIONS.inc(api_format=self.api_format, origin=self.origin)
+        wait = self.retry_in()
+        hint = f"，{math.ceil(wait)}秒后重试" if wait > 0 else "，正在试探恢复"
+        raise CircuitOpenError(f"上游 {self.origin} 连续失败，已熔断{hint}")
+
+    def after_call(self, ttfb: Optional[float], failed: Optional[bool]) -> None:
+        """
+        记录一次调用结果 (ttfb 为上游首字节耗时，未收到响应头时为 None)
+
+        failed 为 None 表示结果不能说明上游状态 (被取消 / 本地错误)，只归还试探名额
+        """
+        if failed is not None and ttfb is not None and ttfb > BREAKER_SLOW_CALL:
+            failed = True
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._transition(OPEN)
+            elif failed is False:
+                self._probe_ok += 1
+                if self._probe_ok >= BREAKER_HALF_OPEN_PROBES:
+                    self._transition(CLOSED)
+            return
+        if self.state != CLOSED or failed is None:
+            return
+        self._outcomes.append(failed)
+        if len(self._outcomes) >= BREAKER_MIN_CALLS and self.error_rate() >= BREAKER_ERROR_RATE:
+            self._transition(OPEN)
+
+    def error_rate(self) -> float:
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"state": self.state, "error_rate": round(self.error_rate(), 3), "rejected": self.rejected}
+        if self.state == OPEN:
+            stats["retry_in_ms"] = int(self.retry_in() * 1000)
+        return stats
+
+
+# ============================================================================
+# 注册表
+# ============================================================================
+
+class BreakerRegistry:
+    """所有 (api_format, origin) 的熔断器"""
+
+    def __init__(self):
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, api_format: str, url: str) -> CircuitBreaker:
+        key = (api_format, origin_of(url))
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(*key)
+        return breaker
+
+    def forget(self, origin: str) -> None:
+        """连接池关闭 origin 的客户端时丢弃其熔断器 (打开中的保留，熔断期间仍需快速失败)"""
+        for key in [k for k, b in self._breakers.items() if k[1] == origin and b.state != OPEN]:
+            del self._breakers[key]
+
+    @asynccontextmanager
+    async def guard(self, api_format: str, url: str, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        在熔断器保护下执行一次上游调用 (熔断中时立即抛出 CircuitOpenError)
+
+        deadline 为调用的绝对截止时间 (monotonic)，用于区分截止时间到达的取消与对冲落败等提前取消。
+        """
+        breaker = self.get(api_format, url)
+        breaker.before_call()
+        call = _Call()
+        _current.set(call)
+        try:
+            yield
+        except httpx.HTTPError as e:
+            # 4xx 说明上游可达，按成功计；本地错误 (限流排队、解析失败等) 不计入
+            breaker.after_call(call.ttfb(), is_breaker_failure(e))
+            raise
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # 已发出请求、到截止时间仍无响应头: 与上游超时等价
+            expired = deadline is not None and time.monotonic() >= deadline - _CLOCK_SLACK
+            breaker.after_call(None, True if expired and call.sent is not None and call.first_byte is None else None)
+            raise
+        except BaseException:
+            breaker.after_call(call.ttfb(), None)
+            raise
+        else:
+            breaker.after_call(call.ttfb(), False)
+        finally:
+            _current.set(None)
+
+    async def on_request(self, request: httpx.Request) -> None:
+        """httpx 请求钩子: 记录当前调用发出请求的时间 (限流重试时保留第一次)"""
+        call = _current.get()
+        if call is not None and call.sent is None:
+            call.sent = time.monotonic()
+
+    async def on_response(self, response: httpx.Response) -> None:
+        """httpx 响应钩子: 记录当前调用收到响应头的时间"""
+        call = _current.get()
+        if call is not None and call.first_byte is None:
+            call.first_byte = time.monotonic()
+
+    def states(self) -> Dict[str, Any]:
+        return {f"{api_format} {origin}": b.stats() for (api_format, origin), b in self._breakers.items()}
@@ -0,0 +1,49 @@
+"""
+内置 provider 元数据
+
+唯一来源是前端的 packages/core/src/providers.ts。后端单独部署时没有 packages/ 目录，
+因此把其中的 PROVIDERS 提取为同目录下的 builtin_providers.json 随后端一起发布，
+prewarm.py 与 scripts/fetch_models.py 都从这里读取 baseUrl / apiFormat，不再各自手抄。
+
+修改 providers.ts 后重新生成 (tests/test_prewarm.py 会检查两者是否一致):
+    python backend/builtin_providers.py
+
+只依赖标准库 (scripts/fetch_models.py 单独运行时也会导入)。
+"""
+
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+PROVIDERS_TS = Path(__file__).resolve().parent.parent / "packages" / "core" / "src" / "providers.ts"
+PROVIDERS_JSON = Path(__file__).resolve().with_name("builtin_providers.json")
+
+_ENTRY = re.compile(r"\[PROVIDER_ID\.(\w+)\]:\s*\{(.*?)\n\s*\},", re.S)
+_STRING_FIELD = re.compile(r"^\s*(name|baseUrl|apiFormat):\s*'([^']*)',?\s*$", re.M)
+_BOOL_FIELD = re.compile(r"^\s*(needsApiKey|supportsModelsApi):\s*(true|false),?\s*$", re.M)
+
+
+def parse_providers_ts(text: str) -> Dict[str, Dict[str, Any]]:
+    """从 providers.ts 源码中提取 provider id -> {name, baseUrl, apiFormat, needsApiKey, supportsModelsApi}"""
+    id_block = text.split("export const PROVIDER_ID = {", 1)[1].split("}", 1)[0]
+    ids = dict(re.findall(r"(\w+):\s*'([^']+)'", id_block))
+    providers: Dict[str, Dict[str, Any]] = {}
+    for constant, body in _ENTRY.findall(text.split("export const PROVIDERS", 1)[1]):
+        entry: Dict[str, Any] = dict(_STRING_FIELD.findall(body))
+        entry.update((key, value == "true") for key, value in _BOOL_FIELD.findall(body))
+        providers[ids[constant]] = entry
+    return providers
+
+
+@lru_cache(maxsize=1)
+def load_builtin_providers() -> Dict[str, Dict[str, Any]]:
+    """读取生成的 builtin_providers.json"""
+    return json.loads(PROVIDERS_JSON.read_text(encoding="utf-8"))
+
+
+if __name__ == "__main__":
+    providers = parse_providers_ts(PROVIDERS_TS.read_text(encoding="utf-8"))
+    PROVIDERS_JSON.write_text(json.dumps(providers, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    print(f"已写入 {PROVIDERS_JSON} ({len(providers)} 个 provider)")
@@ -0,0 +1,214 @@
+"""
+模型列表缓存
+
+进程内 LRU 缓存，key 为 (api_format, base_url, api_key 哈希)：
+- 新鲜期 (TTL) 内直接返回缓存
+- 过期但仍在 stale 窗口内时返回旧值，并在后台重新拉取 (stale-while-revalidate)
+- 同一 key 的并发未命中合并为一次上游请求 (single-flight)
+- 启用跨 worker 共享状态时，未命中先读其他 worker 写入的共享缓存，多个 worker 的并发未命中通过锁键只拉取一次
+  (锁键的过期时间不短于拉取的截止时间，释放时只删除自己持有的锁)
+
+环境变量:
+    MODELS_CACHE_TTL          - 新鲜期，秒 (默认 300)
+    MODELS_CACHE_STALE_TTL    - 过期后仍可返回旧值的时长，秒 (默认 3600)
+    MODELS_CACHE_MAX_ENTRIES  - 最大条目数，超出按 LRU 淘汰 (默认 256)
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "300"))
+MODELS_CACHE_STALE_TTL = float(os.getenv("MODELS_CACHE_STALE_TTL", "3600"))
+MODELS_CACHE_MAX_ENTRIES = int(os.getenv("MODELS_CACHE_MAX_ENTRIES", "256"))
+
+SHARED_FETCH_WAIT = 30.0   # 其他 worker 正在拉取同一 key 时最多等待的时间 (秒)，也是锁键过期时间的下限
+SHARED_POLL_INTERVAL = 0.1
+
+CacheKey = Tuple[str, str, str]
+Fetcher = Callable[[], Awaitable[List[Dict[str, Any]]]]
+
+
+def cache_key(api_format: str, base_url: str, api_key: Optional[str]) -> CacheKey:
+    """构建缓存 key，api_key 只保留哈希，避免明文驻留内存"""
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    return (api_format, base_url.rstrip("/"), key_hash)
+
+
+async def _quietly(aw: Awaitable[Any]) -> None:
+    """执行共享后端写操作，失败只记录日志 (不影响已拉取到的结果)"""
+    try:
+        await aw
+    except Exception as e:
+        logger.warning("写入共享模型列表缓存失败: %s", e)
+
+
+@dataclass
+class _Entry:
+    value: List[Dict[str, Any]]
+    fetched_at: float
+
+
+# ============================================================================
+# 缓存实现
+# ============================================================================
+
+class ModelListCache:
+    """带 TTL / stale-while-revalidate / single-flight 的 LRU 缓存"""
+
+    def __init__(
+        self,
+        ttl: float = MODELS_CACHE_TTL,
+        stale_ttl: float = MODELS_CACHE_STALE_TTL,
+        max_entries: int = MODELS_CACHE_MAX_ENTRIES,
+        shared: Optional[SharedState] = None,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._inflight: Dict[CacheKey, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+        self.shared = shared if shared is not None and shared.enabled else None
+        self.shared_hits = 0
+
+    async def get_or_fetch(self, key: CacheKey, fetch: Fetcher, fetch_timeout: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        读取缓存；未命中时调用 fetch 拉取并写入缓存 (失败结果不缓存)
+
+        fetch_timeout 为 fetch 的截止时间 (秒)，跨 worker 的锁键至少保持这么久，慢速拉取期间不会被其他 worker 抢走。
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._revalidate(key, fetch, fetch_timeout)
+                return entry.value
+            del self._entries[key]
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start_refresh(key, fetch, fetch_timeout)
+        else:
+            self.coalesced += 1
+        # shield: 单个调用方被取消时不影响共享的上游请求
+        return await asyncio.shield(task)
+
+    def fresh_for(self, key: CacheKey) -> float:
+        """缓存条目剩余的新鲜期 (秒)，用于生成 Cache-Control max-age"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        return max(0.0, self.ttl - (time.monotonic() - entry.fetched_at))
+
+    def invalidate(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "refresh_errors": self.refresh_errors,
+            "shared_hits": self.shared_hits,
+            "inflight": len(self._inflight),
+        }
+
+    # ------------------------------------------------------------------------
+
+    def _start_refresh(self, key: CacheKey, fetch: Fetcher, fetch_timeout: float) -> asyncio.Task:
+        task = asyncio.ensure_future(self._refresh(key, fetch, fetch_timeout))
+        # 所有等待方都已取消时由这里取走异常，避免 "exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return task
+
+    def _revalidate(self, key: CacheKey, fetch: Fetcher, fetch_timeout: float) -> None:
+        """后台刷新，已有进行中的请求时不重复发起"""
+        if key in self._inflight:
+            return
+        task = self._start_refresh(key, fetch, fetch_timeout)
+        task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            logger.warning("模型列表后台刷新失败: %s", task.exception())
+
+    async def _refresh(self, key: CacheKey, fetch: Fetcher, fetch_timeout: float) -> List[Dict[str, Any]]:
+        try:
+            if self.shared is None:
+                value, age = await fetch(), 0.0
+            else:
+                value, age = await self._fetch_shared(key, fetch, fetch_timeout)
+            self._store(key, value, age)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fetch_shared(self, key: CacheKey, fetch: Fetcher, fetch_timeout: float) -> Tuple[List[Dict[str, Any]], float]:
+        """先读共享缓存；仍未命中时只有拿到锁的 worker 拉取上游，其余 worker 等待其写入的结果"""
+        name = "models:" + "|".join(key)
+        token: Optional[str] = None
+        give_up = time.monotonic() + SHARED_FETCH_WAIT
+        try:
+            while True:
+                entry = await self.shared.get_json(name)
+                if entry is not None and time.time() - entry["fetched_at"] < self.ttl:
+                    self.shared_hits += 1
+                    return entry["value"], max(0.0, time.time() - entry["fetched_at"])
+                token = await self.shared.try_lock(name + ":lock", max(SHARED_FETCH_WAIT, fetch_timeout))
+                if token is not None or time.monotonic() >= give_up:
+                    break
+                await asyncio.sleep(SHARED_POLL_INTERVAL)
+        except Exception as e:
+            # 共享后端不可用时退回到只用本进程缓存
+            logger.warning("读取共享模型列表缓存失败: %s", e)
+            return await fetch(), 0.0
+
+        try:
+            value = await fetch()
+            # 先写入结果再释放锁，等待中的 worker 才不会在锁释放后重复拉取
+            await _quietly(self.shared.set_json(name, {"value": value, "fetched_at": time.time()}, self.ttl + self.stale_ttl))
+            return value, 0.0
+        finally:
+            if token is not None:
+                await _quietly(self.shared.unlock(name + ":lock", token))
+
+    def _store(self, key: CacheKey, value: List[Dict[str, Any]], age: float = 0.0) -> None:
+        self._entries[key] = _Entry(value=value, fetched_at=time.monotonic() - age)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
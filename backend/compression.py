@@ -0,0 +1,134 @@
+"""
+响应压缩
+
+按 Accept-Encoding 协商 brotli (需安装 brotli) 或 gzip，只压缩超过阈值的完整 JSON 响应
+(包括带 raw_response 的大 ChatResponse)；SSE / NDJSON 等流式响应保持原样，避免缓冲增量帧。
+不小于 UPSTREAM_DECODE_THREAD_BYTES (与上游响应体解码相同的阈值) 的响应体在线程池中压缩，
+避免数 MB 的模型列表压缩期间阻塞事件循环。
+
+环境变量:
+    COMPRESSION_MIN_SIZE       - 压缩阈值，字节 (默认 1024)
+    COMPRESSION_GZIP_LEVEL     - gzip 压缩级别 (默认 6)
+    COMPRESSION_BROTLI_QUALITY - brotli 压缩质量 (默认 4，兼顾速度)
+"""
+
+import asyncio
+import gzip
+import os
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from strategies import UPSTREAM_DECODE_THREAD_BYTES
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# 流式响应不压缩
+_STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """从 Accept-Encoding 中选择编码: br (可用时) 优先，其次 gzip"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    candidates: List[str] = (["br"] if brotli is not None else []) + ["gzip"]
+    wildcard = accepted.get("*", 0.0)
+    best = max(candidates, key=lambda c: accepted.get(c, wildcard), default=None)
+    return best if best and accepted.get(best, wildcard) > 0 else None
+
+
+def response_encoding(accept_encoding: str, size: int, minimum_size: int = COMPRESSION_MIN_SIZE) -> Optional[str]:
+    """size 字节的完整 JSON 响应体会被压缩成的编码 (不压缩时为 None)"""
+    return negotiate(accept_encoding) if size >= minimum_size else None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """强 ETag 对应具体的字节表示，压缩后加上编码后缀 (弱 ETag 不变)"""
+    if not etag.endswith('"') or etag.startswith("W/"):
+        return etag
+    return etag[:-1] + f'-{"br" if encoding == "br" else "gzip"}"'
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    """压缩响应体；大响应体在线程池中执行 (gzip / brotli 压缩时释放 GIL)"""
+    if len(body) >= UPSTREAM_DECODE_THREAD_BYTES:
+        return await asyncio.to_thread(compress, body, encoding)
+    return compress(body, encoding)
+
+
+class CompressionMiddleware:
+    """对超过阈值的完整响应体进行 gzip / brotli 压缩"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or headers.get("content-type", "").startswith(_STREAMING_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            if start is not None:
+                initial, start = start, None
+                body = message.get("body", b"")
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    # 分块发送的响应或小响应原样转发
+                    passthrough = True
+                    await send(initial)
+                    await send(message)
+                    return
+                compressed = await compress_async(body, encoding)
+                headers = MutableHeaders(raw=initial["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(compressed))
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag:
+                    headers["ETag"] = encoded_etag(etag, encoding)
+                await send(initial)
+                await send({"type": "http.response.body", "body": compressed, "more_body": False})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
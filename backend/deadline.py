@@ -0,0 +1,94 @@
+"""
+请求截止时间与客户端断开检测
+
+把客户端传入的 connect / read / total 预算 (或服务端默认值) 转换为一个绝对截止时间，
+排队、重试、对冲与上游请求本身都从同一个预算中扣除。
+客户端断开连接时取消仍在进行的上游请求，不再为无人接收的响应占用连接、消耗 token。
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+from starlette.requests import Request
+
+from models import RequestTimeout
+
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """请求在截止时间前未完成"""
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应返回前断开了连接"""
+
+
+@dataclass
+class Deadline:
+    """绝对截止时间 (monotonic) + 单次连接 / 读取超时"""
+    at: float
+    total: float
+    connect: Optional[float] = None
+    read: Optional[float] = None
+
+    @classmethod
+    def from_request(cls, timeout: Optional[RequestTimeout], default_total: float) -> "Deadline":
+        total = timeout.total if timeout is not None and timeout.total else default_total
+        return cls(
+            at=time.monotonic() + total,
+            total=total,
+            connect=timeout.connect if timeout is not None else None,
+            read=timeout.read if timeout is not None else None,
+        )
+
+    def remaining(self) -> float:
+        return self.at - time.monotonic()
+
+    def child(self, budget: float) -> "Deadline":
+        """从剩余预算中切出最多 budget 秒的子截止时间 (如多候选路由中的单次尝试)"""
+        now = time.monotonic()
+        at = min(self.at, now + budget)
+        return Deadline(at=at, total=max(0.0, at - now), connect=self.connect, read=self.read)
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        """按剩余预算生成本次上游请求的超时 (排队 / 重试已消耗的时间不再可用)"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"请求超过截止时间 ({self.total:g}秒)")
+        return httpx.Timeout(
+            remaining,
+            connect=min(self.connect, remaining) if self.connect else remaining,
+            read=min(self.read, remaining) if self.read else remaining,
+        )
+
+
+async def _wait_disconnect(request: Request) -> None:
+    # 请求体已被 FastAPI 读完，此后 receive() 只会在客户端断开时返回 http.disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, aw: Awaitable[T]) -> T:
+    """等待 aw 完成；客户端先断开时取消 aw 并抛出 ClientDisconnected"""
+    task = asyncio.ensure_future(aw)
+    watcher = asyncio.ensure_future(_wait_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        # 等待上游请求真正退出，及时释放连接与并发名额
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnected("客户端已断开连接")
+    return task.result()
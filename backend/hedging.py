@@ -0,0 +1,148 @@
+"""
+幂等上游请求的对冲 (hedged requests)
+
+第一次请求在"该 origin 近期延迟的第 P 百分位"之内没有返回时，再发出第二次相同请求，
+取先成功的结果并取消另一个。用于 /test 探测与 /models 拉取这类幂等调用，削减偶发长尾卡顿。
+
+对冲请求受预算限制: 每个普通请求积累 HEDGE_BUDGET 个令牌，发一次对冲消耗 1 个，
+因此额外的上游流量不会超过 HEDGE_BUDGET 比例。
+
+环境变量:
+    HEDGE_ENABLED      - 设为 1 时默认开启对冲 (请求体中的 hedge 字段可覆盖)
+    HEDGE_PERCENTILE   - 触发对冲的延迟百分位 (默认 95)
+    HEDGE_BUDGET       - 对冲请求占比上限 (默认 0.05，即最多多发 5%)
+    HEDGE_MIN_SAMPLES  - 样本数少于此值时不对冲 (默认 20)
+    HEDGE_MIN_DELAY    - 对冲延迟下限，秒 (默认 0.05)
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from metrics import registry
+from pool import origin_of
+
+T = TypeVar("T")
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_WINDOW = 200          # 每个 origin 保留的延迟样本数
+HEDGE_MAX_TOKENS = 10.0     # 令牌上限，避免长时间空闲后集中对冲
+
+HEDGES = registry.counter("proxy_hedges_total", "对冲请求次数 (result: won 对冲请求胜出 / lost 原请求胜出)", ("kind", "origin", "result"))
+
+
+class Hedger:
+    """按 (kind, origin) 统计延迟并执行对冲"""
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        budget: float = HEDGE_BUDGET,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        min_delay: float = HEDGE_MIN_DELAY,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples: Dict[str, Deque[float]] = {}
+        self._tokens = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def delay(self, key: str) -> Optional[float]:
+        """该 key 的对冲触发延迟；样本不足时返回 None (不对冲)"""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def _record(self, key: str, latency: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=HEDGE_WINDOW)
+        samples.append(latency)
+
+    async def run(self, kind: str, url: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """执行 fn，超过对冲延迟仍未返回时并发再执行一次，返回先成功的结果"""
+        origin = origin_of(url)
+        key = f"{kind} {origin}"
+        self.requests += 1
+        self._tokens = min(HEDGE_MAX_TOKENS, self._tokens + self.budget)
+
+        start = time.monotonic()
+        primary = asyncio.ensure_future(fn())
+        try:
+            delay = self.delay(key)
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return await self._race(kind, key, origin, primary, fn, start)
+                    self.budget_exhausted += 1
+            result = await primary
+        except asyncio.CancelledError:
+            primary.cancel()
+            await asyncio.gather(primary, return_exceptions=True)
+            raise
+        self._record(key, time.monotonic() - start)
+        return result
+
+    async def _race(self, kind: str, key: str, origin: str, primary: "asyncio.Future[T]", fn: Callable[[], Awaitable[T]], start: float) -> T:
+        self.hedged += 1
+        hedge_start = time.monotonic()
+        hedge = asyncio.ensure_future(fn())
+        pending = {primary, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [t for t in done if not t.cancelled() and t.exception() is None]
+                if not winners:
+                    # 一方失败时继续等待另一方；两者都失败则抛出错误
+                    if pending:
+                        continue
+                    return next(iter(done)).result()
+                task = winners[0]
+                won = task is hedge
+                if won:
+                    self.hedge_wins += 1
+                HEDGES.inc(kind=kind, origin=origin, result="won" if won else "lost")
+                self._record(key, time.monotonic() - (hedge_start if won else start))
+                return task.result()
+        finally:
+            # 等待落败方真正结束 (熔断器 guard / 限流名额的清理在返回前完成，也不会留下未取回的异常)
+            losers = [task for task in (primary, hedge) if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    def forget(self, origin: str) -> None:
+        """连接池关闭 origin 的客户端时丢弃其延迟样本"""
+        for key in [k for k in self._samples if k.endswith(" " + origin)]:
+            del self._samples[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget_exhausted,
+            "budget": self.budget,
+            "delays_ms": {k: int(d * 1000) for k in self._samples if (d := self.delay(k)) is not None},
+        }
@@ -0,0 +1,69 @@
+"""
+HTTP 缓存语义
+
+为可缓存的代理响应 (/, /models) 生成强 ETag (响应体的哈希)，处理 If-None-Match -> 304，
+并按服务端缓存的剩余新鲜期生成 Cache-Control。
+
+304 没有响应体，压缩中间件不会改写它的 ETag: 这里按同样的协商规则 (Accept-Encoding + 响应体大小)
+给 304 加上对应 200 响应会带的编码后缀，客户端保存的验证器与 304 中的 ETag 保持一致。
+
+/models 是 POST 端点: 这里的 304 是客户端与代理之间的约定 (客户端带上次的 ETag 重新提交同一请求体)，
+浏览器 / 中间缓存不会自动缓存 POST 响应。
+"""
+
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from compression import encoded_etag, response_encoding
+from serialization import dumps
+
+# 压缩中间件给 ETag 加的编码后缀 (比较时忽略)
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _normalize(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix + '"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中 (弱比较，忽略压缩编码后缀)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(_normalize(tag) == etag for tag in if_none_match.split(","))
+
+
+def cache_control(max_age: float, stale_while_revalidate: Optional[float] = None) -> str:
+    """响应中包含凭据相关的内容，只允许客户端私有缓存"""
+    value = f"private, max-age={int(max_age)}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={int(stale_while_revalidate)}"
+    return value
+
+
+def conditional_response(request: Request, content: Any, cache_control_value: str = "no-cache") -> Response:
+    """编码 content 并附加 ETag / Cache-Control；客户端已持有相同内容时返回 304"""
+    body = dumps(content)
+    etag = strong_etag(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control_value}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        encoding = response_encoding(request.headers.get("accept-encoding", ""), len(body))
+        if encoding is not None:
+            headers["ETag"] = encoded_etag(etag, encoding)
+            headers["Vary"] = "Accept-Encoding"
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
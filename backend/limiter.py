@@ -0,0 +1,414 @@
+"""
+按上游 origin 的自适应并发限制
+
+每个 origin 维护一个 AIMD 并发上限:
+- 请求成功且延迟未明显升高时缓慢增加 (每个"窗口"约 +1)
+- 遇到 503 / 超时时减半；超时只有在请求已运行超过正常延迟 (最小延迟 × LIMITER_LATENCY_TOLERANCE) 时才算拥塞，
+  客户端自己设置的过短截止时间不影响其他用户
+- 超出上限的请求进入 FIFO 队列等待，而不是立即失败；等待超过截止时间才报错
+- 限流额度按 API Key 计算，429 与 Retry-After / 限流响应头只暂停同一 (origin, API Key 哈希) 的请求，
+  不影响其他用户的请求，也不降低 origin 的并发上限
+- 多 worker 共享状态时 (shared_state.py)，Retry-After 暂停在 worker 之间传播；各 worker 发布自己学到的并发上限，
+  取所有 worker 的最小值 (再与本 worker 的上限取小) 作为 origin 的总预算，按存活 worker 数均分，
+  所有 worker 的并发之和不超过 max(总预算, worker 数) (每个 worker 至少保留 1 个名额)
+
+环境变量:
+    LIMITER_INITIAL            - 初始并发上限 (默认 8)
+    LIMITER_MIN / LIMITER_MAX  - 并发上限范围 (默认 1 / 64)
+    LIMITER_QUEUE_TIMEOUT      - 排队 + 重试的总截止时间，秒 (默认 30)
+    LIMITER_MAX_QUEUE          - 每个 origin 的最大排队数 (默认 256)
+    LIMITER_MAX_RETRIES        - 429 / 503 后在截止时间内的最大重试次数 (默认 2)
+    LIMITER_LATENCY_TOLERANCE  - 延迟超过最小延迟多少倍视为拥塞 (默认 3)
+"""
+
+import asyncio
+import email.utils
+import hashlib
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from metrics import registry, record_phase
+from timing import record_span
+from pool import origin_of
+from shared_state import SharedState
+
+T = TypeVar("T")
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+LIMITER_INITIAL = float(os.getenv("LIMITER_INITIAL", "8"))
+LIMITER_MIN = float(os.getenv("LIMITER_MIN", "1"))
+LIMITER_MAX = float(os.getenv("LIMITER_MAX", "64"))
+LIMITER_QUEUE_TIMEOUT = float(os.getenv("LIMITER_QUEUE_TIMEOUT", "30"))
+LIMITER_MAX_QUEUE = int(os.getenv("LIMITER_MAX_QUEUE", "256"))
+LIMITER_MAX_RETRIES = int(os.getenv("LIMITER_MAX_RETRIES", "2"))
+LIMITER_LATENCY_TOLERANCE = float(os.getenv("LIMITER_LATENCY_TOLERANCE", "3"))
+
+OVERLOAD_STATUS = (429, 503)
+
+QUEUE_DEPTH = registry.gauge("proxy_limiter_queue_depth", "等待上游并发名额的请求数", ("origin",))
+CONCURRENCY_LIMIT = registry.gauge("proxy_limiter_limit", "当前学习到的上游并发上限", ("origin",))
+QUEUE_WAIT = registry.histogram("proxy_limiter_wait_seconds", "等待上游并发名额的时间", ("origin",))
+OVERLOADS = registry.counter("proxy_limiter_overloads_total", "上游过载 / 限流信号 (429 / 503 / 超时)", ("origin", "reason"))
+
+
+class LimiterError(Exception):
+    """限流排队失败 (队列已满 / 排队超时)"""
+
+    def __init__(self, message: str, error_class: str):
+        super().__init__(message)
+        self.error_class = error_class
+
+
+# ============================================================================
+# 限流响应头解析
+# ============================================================================
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """解析 "1s" / "6m0s" / "250ms" 形式的时长"""
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """解析重置时间: 秒数 / 时长 / RFC3339 时间戳 / HTTP 日期，返回距离现在的秒数"""
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    duration = _parse_duration(value)
+    if duration is not None and value[0].isdigit() and "-" not in value:
+        return duration
+    try:
+        return max(0.0, datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() - time.time())
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    """从 Retry-After 及各厂商限流头中推断需要暂停的秒数"""
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        return _parse_reset(headers["retry-after"])
+    # 剩余额度为 0 时按重置时间暂停 (OpenAI x-ratelimit-*, Anthropic anthropic-ratelimit-*)
+    for kind in ("requests", "tokens"):
+        for remaining_name, reset_name in (
+            (f"x-ratelimit-remaining-{kind}", f"x-ratelimit-reset-{kind}"),
+            (f"anthropic-ratelimit-{kind}-remaining", f"anthropic-ratelimit-{kind}-reset"),
+        ):
+            reset = headers.get(reset_name)
+            if headers.get(remaining_name) == "0" and reset:
+                return _parse_reset(reset)
+    return None
+
+
+def key_scope(api_key: str) -> str:
+    """API Key 的短哈希，用于区分各用户的限流暂停 (不保存原始 Key)"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else ""
+
+
+def request_key_scope(request: httpx.Request) -> str:
+    """从上游请求中取出各策略携带的凭据，计算 key_scope"""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return key_scope(authorization[len("bearer "):])
+    for name in ("x-api-key", "x-goog-api-key"):
+        if name in request.headers:
+            return key_scope(request.headers[name])
+    # Gemini 通过查询参数传递 Key
+    return key_scope(request.url.params.get("key", ""))
+
+
+# ============================================================================
+# 单个 origin 的限制器
+# ============================================================================
+
+class OriginLimiter:
+    """AIMD 并发限制 + FIFO 等待队列"""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.limit = LIMITER_INITIAL
+        self.inflight = 0
+        self.blocked: Dict[str, float] = {}     # key_scope -> 暂停截止时间 (monotonic)
+        self.published: Dict[str, float] = {}   # 已发布到共享状态的暂停截止时间
+        self.share = 1.0             # 本 worker 可使用的并发预算比例 (1 / 存活 worker 数)
+        self.shared_limit: Optional[float] = None   # 所有 worker 发布的并发上限的最小值 (未共享时为 None)
+        self.min_latency: Optional[float] = None
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+        self.queued_total = 0
+        self.rejected = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        CONCURRENCY_LIMIT.set(self.limit, origin=origin)
+
+    def total_limit(self) -> float:
+        """origin 的总并发预算: 本 worker 的上限 (立即生效) 与其他 worker 上次同步的上限取小"""
+        return self.limit if self.shared_limit is None else min(self.limit, self.shared_limit)
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < max(1, int(self.total_limit() * self.share))
+
+    def is_blocked(self, key: str = "") -> bool:
+        return self.blocked.get(key, 0.0) > time.monotonic()
+
+    def is_congestion_timeout(self, elapsed: float) -> bool:
+        """超时前已运行的时间是否超过正常延迟 (否则是调用方给的截止时间太短，不代表上游拥塞)"""
+        return self.min_latency is not None and elapsed >= self.min_latency * LIMITER_LATENCY_TOLERANCE
+
+    async def acquire(self, deadline: float, key: str = "") -> None:
+        """获取一个并发名额，必要时排队直到 deadline (monotonic 时间)；key 为 key_scope"""
+        # 排在前面的只有被暂停的其他 Key 时不必等待
+        if self._has_capacity() and not self.is_blocked(key) and all(self.is_blocked(k) for k, _ in self._waiters):
+            self.inflight += 1
+            return
+        if len(self._waiters) >= LIMITER_MAX_QUEUE:
+            self.rejected += 1
+            raise LimiterError(f"上游 {self.origin} 排队已满", "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (key, future)
+        self._waiters.append(entry)
+        self.queued_total += 1
+        QUEUE_DEPTH.set(len(self._waiters), origin=self.origin)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - start))
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # 超时与分配名额同时发生: 名额已计入 inflight，直接使用
+                pass
+            else:
+                future.cancel()
+                self.rejected += 1
+                raise LimiterError(f"上游 {self.origin} 限流排队超时", "queue_timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(None)
+            future.cancel()
+            raise
+        finally:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            QUEUE_DEPTH.set(len(self._waiters), origin=self.origin)
+            waited = time.monotonic() - start
+            self.wait_sum += waited
+            self.wait_max = max(self.wait_max, waited)
+            QUEUE_WAIT.observe(waited, origin=self.origin)
+            record_phase("queue_wait", waited)
+            record_span("queue", time.perf_counter() - waited, origin=self.origin)
+
+    def release(self, latency: Optional[float], overload: bool = False) -> None:
+        """
+        归还名额并调整上限
+
+        latency 为 None 表示结果不可用于判断拥塞 (如 4xx 错误、被取消)
+        """
+        self.inflight = max(0, self.inflight - 1)
+        if overload:
+            self.limit = max(LIMITER_MIN, self.limit / 2)
+        elif latency is not None:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            else:
+                # 缓慢抬升基线，避免一次极快的响应永久压低阈值
+                self.min_latency += (latency - self.min_latency) * 0.01
+            if latency > self.min_latency * LIMITER_LATENCY_TOLERANCE:
+                self.limit = max(LIMITER_MIN, self.limit * 0.9)
+            else:
+                self.limit = min(LIMITER_MAX, self.limit + 1 / self.limit)
+        CONCURRENCY_LIMIT.set(self.limit, origin=self.origin)
+        self._wake()
+
+    def block_for(self, seconds: float, key: str = "") -> None:
+        """暂停该 API Key 向 origin 发请求 seconds 秒 (Retry-After)"""
+        until = time.monotonic() + seconds
+        if until <= self.blocked.get(key, 0.0):
+            return
+        self.blocked[key] = until
+        asyncio.get_running_loop().call_later(seconds, self._wake)
+
+    def _wake(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, until in self.blocked.items() if until <= now]:
+            del self.blocked[key]
+            self.published.pop(key, None)
+        # 按 FIFO 顺序放行，跳过仍在暂停中的 Key
+        waiting: Deque[Tuple[str, asyncio.Future]] = deque()
+        while self._waiters:
+            key, future = self._waiters.popleft()
+            if future.done():
+                continue
+            if self._has_capacity() and key not in self.blocked:
+                self.inflight += 1
+                future.set_result(None)
+            else:
+                waiting.append((key, future))
+        self._waiters = waiting
+        QUEUE_DEPTH.set(len(self._waiters), origin=self.origin)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "share": round(self.share, 3),
+            "shared_limit": round(self.shared_limit, 2) if self.shared_limit is not None else None,
+            "inflight": self.inflight,
+            "queue_depth": len(self._waiters),
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "wait_avg_ms": int(self.wait_sum / self.queued_total * 1000) if self.queued_total else 0,
+            "wait_max_ms": int(self.wait_max * 1000),
+            "blocked_keys": sum(1 for key in self.blocked if self.is_blocked(key)),
+            "blocked_for_ms": max([0] + [int((until - time.monotonic()) * 1000) for until in self.blocked.values()]),
+        }
+
+
+# ============================================================================
+# 注册表
+# ============================================================================
+
+class LimiterRegistry:
+    """所有 origin 的限制器"""
+
+    def __init__(self, shared: Optional[SharedState] = None):
+        self._limiters: Dict[str, OriginLimiter] = {}
+        self.shared = shared
+        if shared is not None:
+            shared.on_sync(self._sync_shared)
+
+    def get(self, url: str) -> OriginLimiter:
+        origin = origin_of(url)
+        limiter = self._limiters.get(origin)
+        if limiter is None:
+            limiter = self._limiters[origin] = OriginLimiter(origin)
+        return limiter
+
+    def forget(self, origin: str) -> None:
+        """连接池关闭 origin 的客户端时丢弃其限制器 (仍有进行中 / 排队 / 暂停中的请求时保留)"""
+        limiter = self._limiters.get(origin)
+        if limiter is not None and not limiter.inflight and not limiter._waiters and not any(
+                limiter.is_blocked(key) for key in limiter.blocked):
+            del self._limiters[origin]
+
+    async def on_response(self, response: httpx.Response) -> None:
+        """httpx 响应钩子: 根据限流响应头提前暂停 origin (成功响应也可能提示额度耗尽)"""
+        wait = retry_after_seconds(response.headers)
+        if wait:
+            self.get(str(response.request.url)).block_for(wait, request_key_scope(response.request))
+
+    async def call(self, url: str, fn: Callable[[], Awaitable[T]], deadline: Optional[float] = None, key: str = "") -> T:
+        """
+        在 origin 的并发限制下执行 fn (key 为调用方 API Key 的 key_scope)
+
+        429 / 503 时按 Retry-After 暂停该 Key 并在截止时间内重新排队重试，其余错误直接抛出。
+        """
+        limiter = self.get(url)
+        deadline = deadline or time.monotonic() + LIMITER_QUEUE_TIMEOUT
+        attempt = 0
+        while True:
+            await limiter.acquire(deadline, key)
+            start = time.monotonic()
+            try:
+                result = await fn()
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if status not in OVERLOAD_STATUS:
+                    limiter.release(None)
+                    raise
+                OVERLOADS.inc(origin=limiter.origin, reason=str(status))
+                # 429 是该 Key 的额度用尽，只有 503 说明 origin 本身过载
+                limiter.release(None, overload=status == 503)
+                wait = retry_after_seconds(e.response.headers) or 1.0
+                limiter.block_for(wait, key)
+                if attempt >= LIMITER_MAX_RETRIES or time.monotonic() + wait >= deadline:
+                    raise
+                attempt += 1
+                continue
+            except httpx.TimeoutException:
+                overload = limiter.is_congestion_timeout(time.monotonic() - start)
+                if overload:
+                    OVERLOADS.inc(origin=limiter.origin, reason="timeout")
+                limiter.release(None, overload=overload)
+                raise
+            except BaseException:
+                limiter.release(None)
+                raise
+            limiter.release(time.monotonic() - start)
+            return result
+
+    @asynccontextmanager
+    async def slot(self, url: str, deadline: Optional[float] = None, key: str = "") -> AsyncIterator[None]:
+        """占用一个并发名额 (用于流式请求，不做重试)"""
+        limiter = self.get(url)
+        await limiter.acquire(deadline or time.monotonic() + LIMITER_QUEUE_TIMEOUT, key)
+        try:
+            yield
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if status in OVERLOAD_STATUS:
+                OVERLOADS.inc(origin=limiter.origin, reason=str(status))
+            limiter.release(None, overload=status == 503)
+            raise
+        except BaseException:
+            limiter.release(None)
+            raise
+        else:
+            # 流式请求的总耗时与输出长度相关，不作为拥塞信号
+            limiter.release(None)
+
+    async def _sync_shared(self) -> None:
+        """发布本 worker 收到的 Retry-After 暂停与学到的并发上限，采用其他 worker 发布的暂停，并按存活 worker 数均分总预算"""
+        now, wall = time.monotonic(), time.time()
+        for origin, limiter in list(self._limiters.items()):
+            for key, until in list(limiter.blocked.items()):
+                remaining = until - now
+                if remaining > 0 and limiter.published.get(key) != until:
+                    await self.shared.set_json(f"limiter:block:{origin}#{key}", wall + remaining, remaining)
+                    limiter.published[key] = until
+        for name, until in (await self.shared.scan_json("limiter:block:")).items():
+            origin, _, key = name.rpartition("#")
+            limiter = self.get(origin)
+            if until - wall > 0:
+                limiter.block_for(until - wall, key)
+                limiter.published[key] = limiter.blocked[key]
+        # 各 worker 独立学到的上限不同，各取 1/N 之和可能超过最小的上限: 统一以最小值为总预算
+        await self.shared.set_json("limiter:limits:" + self.shared.worker_id,
+                                   {origin: limiter.limit for origin, limiter in self._limiters.items()}, self.shared.sync_interval * 3)
+        agreed: Dict[str, float] = {}
+        for limits in (await self.shared.scan_json("limiter:limits:")).values():
+            for origin, limit in limits.items():
+                agreed[origin] = min(limit, agreed.get(origin, limit))
+        share = 1 / self.shared.workers
+        for origin, limiter in self._limiters.items():
+            shared_limit = agreed.get(origin)
+            if limiter.share != share or limiter.shared_limit != shared_limit:
+                limiter.share = share
+                limiter.shared_limit = shared_limit
+                limiter._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {origin: limiter.stats() for origin, limiter in self._limiters.items()}
@@ -0,0 +1,63 @@
+"""
+事件循环延迟监控
+
+所有请求共用一个事件循环，任何一段同步代码 (大 JSON 解码、序列化、阻塞 IO) 执行期间其他请求都无法推进。
+后台任务每 LOOP_LAG_INTERVAL 秒 sleep 一次，实际醒来时间超出预期的部分即为事件循环被占用的时间，
+以直方图 proxy_event_loop_lag_seconds 导出，可用来验证把重活移出事件循环的效果。
+
+环境变量:
+    LOOP_LAG_INTERVAL  - 采样间隔，秒 (默认 0.25，0 表示关闭)
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from metrics import registry
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+
+LOOP_LAG = registry.histogram(
+    "proxy_event_loop_lag_seconds", "事件循环延迟 (定时器实际触发时间与预期之差)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_LAG_LAST = registry.gauge("proxy_event_loop_lag_last_seconds", "最近一次采样的事件循环延迟")
+
+
+class LoopLagMonitor:
+    """后台采样事件循环延迟"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.last = 0.0
+        self.max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.samples += 1
+            self.last = lag
+            self.max = max(self.max, lag)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "samples": self.samples,
+            "last_ms": round(self.last * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
@@ -0,0 +1,359 @@
+"""
+Prometheus 风格指标
+
+无第三方依赖的最小实现 (Counter / Gauge / Histogram + 文本格式导出)，
+以及按请求收集各阶段耗时的 RequestTracker。
+
+用法:
+    with track("/chat", api_format, base_url) as t:
+        ...                       # 策略内部通过 record_phase() 上报 TTFB / 字节数 / 解析耗时
+        t.fail(classify_error(e)) # 请求失败时标记结果
+
+标签值 api_format / origin 来自客户端请求，为避免任意 base_url 撑大指标基数 (与内存):
+- api_format 不是已注册的策略时记为 other
+- origin 只记录最先出现的 METRICS_MAX_ORIGINS 个，其余记为 other
+- 每个指标最多 METRICS_MAX_SERIES 个标签组合，超出后新的组合全部计入 other
+
+环境变量:
+    METRICS_MAX_ORIGINS  - 按 origin 区分的最大 origin 数 (默认 100)
+    METRICS_MAX_SERIES   - 单个指标的最大标签组合数 (默认 2000)
+"""
+
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pool import origin_of
+
+LabelValues = Tuple[str, ...]
+
+METRICS_MAX_ORIGINS = int(os.getenv("METRICS_MAX_ORIGINS", "100"))
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "2000"))
+
+OTHER = "other"
+
+# 默认分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# ============================================================================
+# 指标类型
+# ============================================================================
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        if key not in self._values and len(self._values) >= METRICS_MAX_SERIES:
+            return (OTHER,) * len(key)
+        return key
+
+    def render(self, peers: Optional[Dict[str, list]] = None, worker: str = "", retired: Optional[list] = None) -> List[str]:
+        """
+        导出本指标；peers 为其他 worker 的快照 (worker id -> snapshot())，非空时合并输出
+
+        retired 为已退出 worker 的最后快照之和，计入 counter / histogram，使汇总值不因 worker 退出而回退
+        """
+        with self._lock:
+            values = dict(self._values)
+        labelnames = self.labelnames
+        if peers or retired:
+            values, labelnames = self._merge(values, {**(peers or {}), "": retired or []}, worker)
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples(values, labelnames)
+
+    def snapshot(self) -> list:
+        """可 JSON 序列化的当前值，用于跨 worker 汇总"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def _merge(self, values: dict, peers: Dict[str, list], worker: str) -> Tuple[dict, Tuple[str, ...]]:
+        # 默认各 worker 的值相加 (counter / histogram)
+        for samples in peers.values():
+            for key, value in samples:
+                values[tuple(key)] = self._add(values.get(tuple(key)), value)
+        return values, self.labelnames
+
+    @abstractmethod
+    def _add(self, current: Any, value: Any) -> Any:
+        """合并另一个 worker 的同标签值"""
+        pass
+
+    @abstractmethod
+    def _samples(self, values: dict, labelnames: Sequence[str]) -> List[str]:
+        """导出样本行"""
+        pass
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _add(self, current: Optional[float], value: float) -> float:
+        return (current or 0.0) + value
+
+    def _samples(self, values: dict, labelnames: Sequence[str]) -> List[str]:
+        return [f"{self.name}{_format_labels(labelnames, k)} {_format_value(v)}" for k, v in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """可增可减 / 可直接设置的瞬时值"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def _merge(self, values: dict, peers: Dict[str, list], worker: str) -> Tuple[dict, Tuple[str, ...]]:
+        # 瞬时值相加没有意义 (如熔断器状态)，按 worker 标签分别输出；已退出的 worker ("") 不输出
+        merged = {key + (worker,): value for key, value in values.items()}
+        for peer, samples in peers.items():
+            if not peer:
+                continue
+            for key, value in samples:
+                merged[tuple(key) + (peer,)] = value
+        return merged, self.labelnames + ("worker",)
+
+
+class Histogram(_Metric):
+    """累积分桶直方图"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (各桶计数, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def _add(self, current: Optional[tuple], value: list) -> tuple:
+        counts, total, count = value
+        if current is None:
+            return (list(counts), total, count)
+        return ([a + b for a, b in zip(current[0], counts)], current[1] + total, current[2] + count)
+
+    def _samples(self, values: dict, labelnames: Sequence[str]) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self.worker = ""                              # 本进程的 worker id (启用共享状态时设置)
+        self.peers: Dict[str, Dict[str, list]] = {}   # 其他 worker 的快照: worker id -> {指标名: snapshot()}
+        self.retired: Dict[str, list] = {}            # 已退出 worker 的最后快照之和 (只含 counter / histogram)
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, list]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def merge_snapshots(self, base: Dict[str, list], other: Dict[str, list]) -> Dict[str, list]:
+        """把快照 other 中的 counter / histogram 值加到 base 上 (gauge 为瞬时值，不累积)"""
+        merged = dict(base)
+        for name, samples in other.items():
+            metric = self._metrics.get(name)
+            if metric is None or isinstance(metric, Gauge):
+                continue
+            values = {tuple(key): value for key, value in merged.get(name, [])}
+            for key, value in samples:
+                values[tuple(key)] = metric._add(values.get(tuple(key)), value)
+            merged[name] = [[list(key), value] for key, value in values.items()]
+        return merged
+
+    def render(self) -> str:
+        """导出 Prometheus 文本格式 (0.0.4)，有其他 worker 的快照时输出所有 worker 的汇总"""
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            peers = {worker: snapshot.get(name, []) for worker, snapshot in self.peers.items()}
+            lines.extend(metric.render(peers, self.worker, self.retired.get(name)))
+        return "\n".join(lines) + "\n"
+
+
+# ============================================================================
+# 代理指标
+# ============================================================================
+
+registry = Registry()
+
+_LABELS = ("endpoint", "api_format", "origin")
+
+REQUEST_DURATION = registry.histogram(
+    "proxy_request_duration_seconds", "代理请求总耗时", _LABELS + ("outcome",))
+UPSTREAM_TTFB = registry.histogram(
+    "proxy_upstream_ttfb_seconds", "上游首字节时间 (发出请求到收到响应头)", _LABELS)
+UPSTREAM_BYTES = registry.histogram(
+    "proxy_upstream_response_bytes", "上游响应体大小", _LABELS, buckets=BYTES_BUCKETS)
+PARSE_DURATION = registry.histogram(
+    "proxy_parse_duration_seconds", "parse_response / parse_models_response 耗时", _LABELS,
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+TOKENS = registry.counter(
+    "proxy_tokens_total", "上游返回的 token 用量", ("api_format", "origin", "kind"))
+UPSTREAM_ERRORS = registry.counter(
+    "proxy_upstream_errors_total", "上游错误 (按 classify_error 分类)", _LABELS + ("error_class", "status"))
+
+
+_seen_origins: set = set()
+_seen_origins_lock = threading.Lock()
+
+
+def origin_label(base_url: str) -> str:
+    """客户端传入的 base_url 对应的 origin 标签 (数量有上限)"""
+    try:
+        origin = origin_of(base_url)
+    except ValueError:
+        return "invalid"
+    with _seen_origins_lock:
+        if origin in _seen_origins:
+            return origin
+        if len(_seen_origins) >= METRICS_MAX_ORIGINS:
+            return OTHER
+        _seen_origins.add(origin)
+        return origin
+
+
+def api_format_label(api_format: str) -> str:
+    # 延迟导入: strategies 导入了本模块
+    from strategies import STRATEGY_REGISTRY
+    return api_format if api_format in STRATEGY_REGISTRY else OTHER
+
+
+class RequestTracker:
+    """单个代理请求的指标收集器"""
+
+    def __init__(self, endpoint: str, api_format: str, base_url: str):
+        self.labels = {"endpoint": endpoint, "api_format": api_format_label(api_format), "origin": origin_label(base_url)}
+        self.phases: Dict[str, float] = {}
+        self.outcome = "ok"
+        self.status = ""
+        self.usage: Optional[Dict[str, int]] = None
+
+    def fail(self, error_class: str, status: Optional[int] = None) -> None:
+        self.outcome = error_class
+        self.status = str(status or "")
+
+    def record_usage(self, usage: Optional[Dict[str, int]]) -> None:
+        self.usage = usage
+
+    def finish(self, duration: float) -> None:
+        REQUEST_DURATION.observe(duration, outcome=self.outcome, **self.labels)
+        if "upstream_ttfb" in self.phases:
+            UPSTREAM_TTFB.observe(self.phases["upstream_ttfb"], **self.labels)
+        if "upstream_bytes" in self.phases:
+            UPSTREAM_BYTES.observe(self.phases["upstream_bytes"], **self.labels)
+        if "parse" in self.phases:
+            PARSE_DURATION.observe(self.phases["parse"], **self.labels)
+        if self.outcome != "ok":
+            UPSTREAM_ERRORS.inc(error_class=self.outcome, status=self.status, **self.labels)
+        if self.usage:
+            for kind in ("prompt", "completion"):
+                TOKENS.inc(self.usage.get(f"{kind}_tokens", 0), api_format=self.labels["api_format"],
+                           origin=self.labels["origin"], kind=kind)
+
+
+_current: ContextVar[Optional[RequestTracker]] = ContextVar("request_tracker", default=None)
+
+
+@contextmanager
+def track(endpoint: str, api_format: str, base_url: str) -> Iterator[RequestTracker]:
+    """在当前上下文中收集一个代理请求的指标，退出时写入注册表"""
+    tracker = RequestTracker(endpoint, api_format, base_url)
+    token = _current.set(tracker)
+    start = time.perf_counter()
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+        tracker.finish(time.perf_counter() - start)
+
+
+# 只保留第一次上报值的阶段: 对冲与 429 重试的多次上游尝试共用同一个 tracker，
+# 它们的首字节时间不能相加，以最先收到响应头的尝试为准；字节数、排队与解析耗时按累计计
+FIRST_VALUE_PHASES = frozenset({"upstream_ttfb"})
+
+
+def record_phase(name: str, value: float) -> None:
+    """向当前请求上报阶段耗时 / 数值 (不在 track() 中时忽略)"""
+    tracker = _current.get()
+    if tracker is None:
+        return
+    if name in FIRST_VALUE_PHASES:
+        tracker.phases.setdefault(name, value)
+    else:
+        tracker.phases[name] = tracker.phases.get(name, 0.0) + value
@@ -0,0 +1,204 @@
+"""
+跨 provider 的统一模型索引
+
+合并各 provider 的 parse_models_response 结果 (由 /models 拉取时写入)，支持:
+- 按 id / name 的前缀、子串、模糊 (子序列) 搜索，按匹配程度排序
+- 按 provider、创建时间过滤
+- 游标分页: 游标记录上一页最后一项的排序键，索引在翻页期间增量变化也不会重复或跳过未变化的条目
+
+provider 的列表变化时只对新增 / 删除 / 改名的模型做增量更新，不重建整个索引。
+/models 每次返回列表 (含缓存命中) 都会写入索引；与上次写入的是同一个列表对象 (同一缓存条目) 时只刷新 LRU 顺序。
+
+租户隔离: 模型列表随 API Key 变化 (微调模型、私有部署等)，provider_id 又由客户端任意指定，
+因此索引按 (index_scope, provider_id) 分区，index_scope 为 base_url + API Key 的哈希。
+/models 只写入自己凭据对应的分区，搜索时也只能看到请求中给出的凭据对应的分区。
+
+分区数有上限: 凭据与 provider_id 都由客户端提供，最多保留 MODEL_INDEX_MAX_CATALOGS 个分区，
+超出时淘汰最久未写入 / 搜索的分区。搜索只遍历请求可见的分区，不扫描整个索引。
+
+环境变量:
+    MODEL_INDEX_MAX_CATALOGS  - 最多保留的 (index_scope, provider_id) 分区数 (默认 1024)
+"""
+
+import base64
+import bisect
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SortKey = Tuple[int, str, str, str]          # (-created, provider_id, model_id, scope)
+ResultKey = Tuple[int, int, str, str, str]   # (匹配等级, -created, provider_id, model_id, scope)
+Catalog = Tuple[str, str]                    # (scope, provider_id)
+
+MATCH_EXACT, MATCH_PREFIX, MATCH_SUBSTRING, MATCH_FUZZY = 0, 1, 2, 3
+
+MODEL_INDEX_MAX_CATALOGS = int(os.getenv("MODEL_INDEX_MAX_CATALOGS", "1024"))
+
+
+def index_scope(base_url: str, api_key: str) -> str:
+    """模型列表所属的分区: base_url + API Key 的哈希 (不保存 Key 本身)"""
+    return hashlib.sha256(f"{base_url.rstrip('/')}\n{api_key}".encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class IndexedModel:
+    scope: str
+    provider_id: str
+    id: str
+    name: str
+    created: int
+    id_lower: str
+    name_lower: str
+
+    @property
+    def sort_key(self) -> SortKey:
+        return (-self.created, self.provider_id, self.id, self.scope)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "created": self.created, "provider_id": self.provider_id}
+
+
+def _as_timestamp(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _is_subsequence(query: str, text: str) -> bool:
+    it = iter(text)
+    return all(ch in it for ch in query)
+
+
+def match_rank(model: IndexedModel, query: str) -> Optional[int]:
+    """匹配等级 (越小越好)，不匹配时返回 None"""
+    if not query:
+        return MATCH_EXACT
+    if query in (model.id_lower, model.name_lower):
+        return MATCH_EXACT
+    if model.id_lower.startswith(query) or model.name_lower.startswith(query) or model.id_lower.split("/")[-1].startswith(query):
+        return MATCH_PREFIX
+    if query in model.id_lower or query in model.name_lower:
+        return MATCH_SUBSTRING
+    if _is_subsequence(query, model.id_lower) or _is_subsequence(query, model.name_lower):
+        return MATCH_FUZZY
+    return None
+
+
+def encode_cursor(key: ResultKey) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> ResultKey:
+    try:
+        rank, created, provider_id, model_id, scope = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (int(rank), int(created), str(provider_id), str(model_id), str(scope))
+    except (ValueError, TypeError):
+        raise ValueError("cursor 无效") from None
+
+
+class ModelIndex:
+    """所有 provider 模型的合并索引 (按 (scope, provider_id) 分区，分区数按 LRU 限制)"""
+
+    def __init__(self, max_catalogs: int = MODEL_INDEX_MAX_CATALOGS):
+        self.max_catalogs = max_catalogs
+        self._catalogs: "OrderedDict[Catalog, Dict[str, IndexedModel]]" = OrderedDict()
+        self._sources: Dict[Catalog, List[Dict[str, Any]]] = {}   # 各分区上次写入的列表对象
+        self.updates = 0
+        self.evictions = 0
+
+    def update(self, scope: str, provider_id: str, models: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """用 provider 在 scope 下的最新列表增量更新索引，返回新增 / 删除 / 变更数"""
+        catalog = (scope, provider_id)
+        if catalog in self._catalogs and self._sources.get(catalog) is models:
+            self._catalogs.move_to_end(catalog)
+            return {"added": 0, "removed": 0, "changed": 0}
+        current = self._catalogs.setdefault(catalog, {})
+        self._catalogs.move_to_end(catalog)
+        incoming: Dict[str, Dict[str, Any]] = {}
+        for m in models:
+            if isinstance(m, dict) and m.get("id"):
+                incoming[str(m["id"])] = m
+
+        removed = [model_id for model_id in current if model_id not in incoming]
+        for model_id in removed:
+            del current[model_id]
+
+        added = changed = 0
+        for model_id, m in incoming.items():
+            name = str(m.get("name") or model_id)
+            created = _as_timestamp(m.get("created"))
+            existing = current.get(model_id)
+            if existing is not None:
+                if existing.name == name and existing.created == created:
+                    continue
+                changed += 1
+            else:
+                added += 1
+            current[model_id] = IndexedModel(scope, provider_id, model_id, name, created, model_id.lower(), name.lower())
+
+        self._sources.pop(catalog, None)
+        if not current:
+            del self._catalogs[catalog]
+        elif isinstance(models, list):
+            self._sources[catalog] = models
+        while len(self._catalogs) > self.max_catalogs:
+            evicted, _ = self._catalogs.popitem(last=False)
+            self._sources.pop(evicted, None)
+            self.evictions += 1
+        self.updates += 1
+        return {"added": added, "removed": len(removed), "changed": changed}
+
+    def search(
+        self,
+        catalogs: Iterable[Catalog],
+        query: str = "",
+        providers: Optional[List[str]] = None,
+        created_after: Optional[int] = None,
+        created_before: Optional[int] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+        """只在 catalogs 给出的 (scope, provider_id) 分区中搜索，返回 (当前页, 下一页游标, 匹配总数)"""
+        query = query.strip().lower()
+        provider_set = set(providers) if providers else None
+        after = decode_cursor(cursor) if cursor else None
+
+        matches: List[Tuple[ResultKey, IndexedModel]] = []
+        for catalog in dict.fromkeys(catalogs):
+            entries = self._catalogs.get(catalog)
+            if entries is None or (provider_set is not None and catalog[1] not in provider_set):
+                continue
+            self._catalogs.move_to_end(catalog)
+            for entry in entries.values():
+                if created_after is not None and entry.created < created_after:
+                    continue
+                if created_before is not None and entry.created >= created_before:
+                    continue
+                rank = match_rank(entry, query)
+                if rank is not None:
+                    # 无查询词时所有条目等级相同，按创建时间倒序
+                    matches.append(((rank,) + entry.sort_key, entry))
+
+        matches.sort(key=lambda m: m[0])
+        total = len(matches)
+        start = bisect.bisect_right([m[0] for m in matches], after) if after is not None else 0
+        page = matches[start:start + limit]
+        next_cursor = encode_cursor(page[-1][0]) if page and start + limit < total else None
+        return [entry.to_dict() for _, entry in page], next_cursor, total
+
+    def stats(self) -> Dict[str, Any]:
+        providers: Dict[str, int] = {}
+        for (_, provider_id), models in self._catalogs.items():
+            providers[provider_id] = providers.get(provider_id, 0) + len(models)
+        return {
+            "models": sum(len(models) for models in self._catalogs.values()),
+            "catalogs": len(self._catalogs),
+            "max_catalogs": self.max_catalogs,
+            "evictions": self.evictions,
+            "providers": providers,
+            "updates": self.updates,
+        }
@@ -0,0 +1,119 @@
+"""
+模型列表请求的构建与解析 (只依赖标准库)
+
+ChatStrategy 的 build_models_request / parse_models_response / next_models_request 委托到这里；
+scripts/fetch_models.py 也直接导入本模块，单独运行脚本时不需要安装 FastAPI 等后端依赖。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+MODELS_MAX_PAGES = 20   # 分页模型列表最多跟随的页数，防止上游返回循环的分页令牌
+
+ModelsRequest = Tuple[str, Dict[str, str]]   # (endpoint, headers)
+
+
+# ============================================================================
+# OpenAI 兼容格式 (默认)
+# ============================================================================
+
+def openai_models_request(base_url: str, api_key: str) -> ModelsRequest:
+    return (
+        f"{base_url}/models",
+        {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    )
+
+
+def parse_openai_models(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    解析 {"data": [{"id", "name"?, "created"?}]}
+
+    Returns:
+        [{"id": "...", "name": "...", "created": ...}, ...]
+    """
+    models = []
+    for m in data.get("data", []):
+        model_id = m.get("id")
+        if model_id:
+            # 优先取 name，取不到则将 id 格式化作为 name
+            name = m.get("name") or m.get("display_name") or model_id.split("/")[-1].replace("-", " ").replace("_", " ").title()
+            models.append({
+                "id": model_id,
+                "name": name,
+                "created": m.get("created", 0)  # 保留创建时间用于排序
+            })
+    return models
+
+
+# ============================================================================
+# Anthropic
+# ============================================================================
+
+def anthropic_models_request(base_url: str, api_key: str) -> ModelsRequest:
+    # 默认每页 20 个，limit 取上限 1000
+    return (f"{base_url}/models?limit=1000",
+            {"x-api-key": api_key, "anthropic-version": "2023-06-01", "Content-Type": "application/json"})
+
+
+def anthropic_next_models_request(base_url: str, api_key: str, data: Dict[str, Any]) -> Optional[ModelsRequest]:
+    # 还有下一页时 has_more 为 true，以本页的 last_id 作为 after_id 继续
+    last_id = data.get("last_id")
+    if not data.get("has_more") or not last_id:
+        return None
+    endpoint, headers = anthropic_models_request(base_url, api_key)
+    return (f"{endpoint}&after_id={quote(last_id, safe='')}", headers)
+
+
+# ============================================================================
+# Gemini
+# ============================================================================
+
+def gemini_models_request(base_url: str, api_key: str) -> ModelsRequest:
+    # Gemini 使用 URL 参数鉴权；pageSize 取上限 1000，多数情况下一页即可取完
+    return (f"{base_url}/models?key={api_key}&pageSize=1000", {})
+
+
+def parse_gemini_models(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Gemini 返回 {"models": [{"name": "models/gemini-...", "displayName": ...}]}
+    models = []
+    for m in data.get("models", []):
+        model_id = (m.get("name") or "").removeprefix("models/")
+        if model_id:
+            models.append({"id": model_id, "name": m.get("displayName") or model_id, "created": 0})
+    return models
+
+
+def gemini_next_models_request(base_url: str, api_key: str, data: Dict[str, Any]) -> Optional[ModelsRequest]:
+    # 还有下一页时响应带 nextPageToken
+    token = data.get("nextPageToken")
+    if not token:
+        return None
+    endpoint, headers = gemini_models_request(base_url, api_key)
+    return (f"{endpoint}&pageToken={quote(token, safe='')}", headers)
+
+
+# ============================================================================
+# 按 api_format 分派
+# ============================================================================
+
+def build_models_request(api_format: str, base_url: str, api_key: str) -> ModelsRequest:
+    if api_format == "anthropic":
+        return anthropic_models_request(base_url, api_key)
+    if api_format == "gemini":
+        return gemini_models_request(base_url, api_key)
+    return openai_models_request(base_url, api_key)
+
+
+def parse_models_response(api_format: str, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if api_format == "gemini":
+        return parse_gemini_models(data)
+    return parse_openai_models(data)
+
+
+def next_models_request(api_format: str, base_url: str, api_key: str, data: Dict[str, Any]) -> Optional[ModelsRequest]:
+    """分页的模型列表: 根据当前页响应构建下一页的请求，没有下一页时返回 None (Anthropic / Gemini 分页)"""
+    if api_format == "anthropic":
+        return anthropic_next_models_request(base_url, api_key, data)
+    if api_format == "gemini":
+        return gemini_next_models_request(base_url, api_key, data)
+    return None
@@ -2,15 +2,29 @@
 数据模型定义 (Pydantic)
 """
 
-from dataclasses import dataclass
-from typing import Optional, Dict, Any, List
-from pydantic import BaseModel
+from dataclasses import dataclass, field
+from typing import ClassVar, FrozenSet, Literal, Optional, Dict, Any, List
+from pydantic import BaseModel, Field
+
+
+# /chat 响应缓存模式: use | bypass (不读不写) | refresh (不读，写入新结果)
+CacheMode = Literal["use", "bypass", "refresh"]
+
+# /chat/route 路由模式: latency (按 EWMA 评分) | ordered (按顺序) | weighted (按权重随机)
+RoutingMode = Literal["ordered", "weighted", "latency"]
 
 
 # ============================================================================
 # 请求模型
 # ============================================================================
 
+class RequestTimeout(BaseModel):
+    """单个请求的超时预算 (秒)，未设置的项使用服务端默认值"""
+    connect: Optional[float] = Field(None, gt=0, le=3600, allow_inf_nan=False)  # 建立上游连接
+    read: Optional[float] = Field(None, gt=0, le=3600, allow_inf_nan=False)     # 两次读取之间的最长间隔
+    total: Optional[float] = Field(None, gt=0, le=3600, allow_inf_nan=False)    # 整个请求 (含排队、重试、对冲) 的截止时间
+
+
 class ChatRequest(BaseModel):
     """聊天/测试请求体"""
     provider_id: str
@@ -20,6 +34,82 @@ class ChatRequest(BaseModel):
     api_format: str = "openai"
     messages: Optional[List[Dict[str, str]]] = None
     max_tokens: Optional[int] = None
+    include_raw: bool = True                # 是否在 ChatResponse 中返回上游原始响应
+    raw_fields: Optional[List[str]] = None  # 只保留 raw_response 的这些顶层字段
+    hedge: Optional[bool] = None            # /test 是否启用对冲请求 (None 时使用服务端默认)
+    cache: CacheMode = "use"                # /chat 响应缓存模式
+    timeout: Optional[RequestTimeout] = None  # 替代服务端默认超时
+
+
+class BatchTestRequest(BaseModel):
+    """批量连通性测试请求体"""
+    probes: List[ChatRequest]
+    concurrency: Optional[int] = Field(None, ge=1, le=1024)             # 全局并发上限
+    per_origin_concurrency: Optional[int] = Field(None, ge=1, le=1024)  # 每个上游 origin 的并发上限
+    timeout: Optional[float] = Field(None, gt=0, le=3600, allow_inf_nan=False)  # 单个探测的截止时间 (秒)
+
+
+class BatchChatItem(ChatRequest):
+    """批量聊天中的一项 (id 由调用方指定，原样返回便于关联结果)"""
+    id: Optional[str] = None
+    include_raw: bool = False
+
+
+class BatchChatOptions(BaseModel):
+    """批量聊天选项 (JSON 请求体中的字段，JSONL 上传时为查询参数)"""
+    concurrency: Optional[int] = Field(None, ge=1, le=1024)             # 全局并发上限
+    per_origin_concurrency: Optional[int] = Field(None, ge=1, le=1024)  # 每个上游 origin 的并发上限
+    timeout: Optional[float] = Field(None, gt=0, le=3600, allow_inf_nan=False)  # 单项默认截止时间 (秒)，单项的 timeout 可覆盖
+
+
+class BatchChatRequest(BatchChatOptions):
+    """批量聊天请求体 (也可以 JSONL 上传，每行一个 BatchChatItem)"""
+    items: List[BatchChatItem]
+
+
+class ChatCandidate(BaseModel):
+    """路由候选 (一组 provider / model / 凭据)"""
+    provider_id: str
+    api_key: str
+    model: str
+    base_url: str
+    api_format: str = "openai"
+    weight: float = 1.0
+
+
+class RoutedChatRequest(BaseModel):
+    """多候选路由聊天请求体"""
+    candidates: List[ChatCandidate]
+    messages: List[Dict[str, str]]
+    max_tokens: Optional[int] = None
+    routing: RoutingMode = "latency"
+    max_attempts: Optional[int] = None      # 最多尝试的候选数 (默认全部)
+    include_raw: bool = True
+    raw_fields: Optional[List[str]] = None
+    timeout: Optional[RequestTimeout] = None  # 所有候选共享同一个截止时间
+    attempt_timeout: Optional[float] = None   # 单个候选的超时上限 (秒)，默认为剩余预算的一半，最后一个候选可用全部剩余预算
+
+
+class CreateSessionRequest(BaseModel):
+    """创建会话请求体 (上游配置只在创建时发送一次)"""
+    provider_id: str
+    api_key: str
+    model: str
+    base_url: str
+    api_format: str = "openai"
+    max_tokens: Optional[int] = None
+    messages: Optional[List[Dict[str, str]]] = None  # 初始消息 (如 system 提示)
+    token_budget: Optional[int] = None               # 发往上游的历史 token 预算 (None 时使用服务端默认，0 不截断)
+
+
+class SessionChatRequest(BaseModel):
+    """会话聊天请求体: 只发送本轮新增的消息"""
+    session_id: str
+    messages: List[Dict[str, str]]
+    max_tokens: Optional[int] = None        # 覆盖会话的 max_tokens
+    include_raw: bool = True
+    raw_fields: Optional[List[str]] = None
+    timeout: Optional[RequestTimeout] = None
 
 
 class FetchModelsRequest(BaseModel):
@@ -28,6 +118,26 @@ class FetchModelsRequest(BaseModel):
     api_key: Optional[str] = None
     base_url: str
     api_format: str = "openai"
+    hedge: Optional[bool] = None            # 是否启用对冲请求 (None 时使用服务端默认)
+    timeout: Optional[RequestTimeout] = None  # 替代服务端默认超时
+
+
+class ModelSource(BaseModel):
+    """搜索范围: 与 /models 请求相同的 provider_id / base_url / 凭据"""
+    provider_id: str
+    base_url: str
+    api_key: Optional[str] = None
+
+
+class ModelSearchRequest(BaseModel):
+    """统一模型索引搜索请求体"""
+    sources: List[ModelSource] = []            # 只搜索用这些凭据拉取过的模型列表
+    query: str = ""                            # 匹配 id / name: 前缀、子串或模糊 (子序列)
+    providers: Optional[List[str]] = None      # 只返回这些 provider_id 的模型
+    created_after: Optional[int] = None        # created >= 该时间戳
+    created_before: Optional[int] = None       # created < 该时间戳
+    limit: int = 50
+    cursor: Optional[str] = None               # 上一页返回的 next_cursor
 
 
 # ============================================================================
@@ -41,6 +151,48 @@ class TestConnectionResponse(BaseModel):
     message: str
 
 
+class BatchProbeResult(BaseModel):
+    """批量测试中单个探测的结果 (NDJSON 一行)"""
+    index: int
+    provider_id: str
+    model: str
+    success: bool
+    latency_ms: int
+    status_code: Optional[int] = None
+    error_class: Optional[str] = None
+    message: str
+
+
+class BatchChatResult(BaseModel):
+    """批量聊天中单项的结果 (NDJSON 一行，按完成顺序)"""
+    type: str = "result"
+    index: int
+    id: Optional[str] = None
+    provider_id: Optional[str] = None
+    model: Optional[str] = None
+    success: bool
+    content: Optional[str] = None
+    usage: Optional[Dict[str, int]] = None
+    latency_ms: int = 0
+    status_code: Optional[int] = None
+    error_class: Optional[str] = None
+    message: Optional[str] = None
+    raw_response: Optional[Dict[str, Any]] = None
+    cached: bool = False
+
+
+class BatchChatSummary(BaseModel):
+    """批量聊天的汇总 (NDJSON 最后一行)"""
+    type: str = "summary"
+    total: int
+    succeeded: int
+    failed: int
+    cached: int
+    usage: Dict[str, int]
+    error_classes: Dict[str, int]
+    latency_ms: int
+
+
 class ChatResponse(BaseModel):
     """聊天响应体 - 标准化格式"""
     success: bool
@@ -50,6 +202,21 @@ class ChatResponse(BaseModel):
     latency_ms: int = 0
     raw_response: Optional[Dict[str, Any]] = None
     message: Optional[str] = None
+    served_by: Optional[Dict[str, Any]] = None  # /chat/route: 实际提供服务的候选及尝试次数
+    cached: bool = False                        # 是否来自响应缓存
+    cache_lookup_ms: Optional[float] = None     # 缓存查找耗时
+    session: Optional[Dict[str, Any]] = None    # /sessions/chat: 会话 id、历史消息数、本轮截断的消息数
+
+    # 只由部分端点填写的字段，未显式设置时不出现在响应中 (见 serialization.respond)
+    OPTIONAL_FIELDS: ClassVar[FrozenSet[str]] = frozenset({"served_by", "cached", "cache_lookup_ms", "session"})
+
+
+class SessionResponse(BaseModel):
+    """会话创建 / 删除响应体"""
+    success: bool
+    session_id: Optional[str] = None
+    message_count: int = 0
+    message: Optional[str] = None
 
 
 class FetchModelsResponse(BaseModel):
@@ -59,6 +226,15 @@ class FetchModelsResponse(BaseModel):
     message: Optional[str] = None
 
 
+class ModelSearchResponse(BaseModel):
+    """统一模型索引搜索响应体"""
+    success: bool
+    models: List[Dict[str, Any]]               # [{"id", "name", "created", "provider_id"}]
+    total: int = 0                             # 匹配总数
+    next_cursor: Optional[str] = None          # 没有下一页时为 None
+    message: Optional[str] = None
+
+
 # ============================================================================
 # 内部数据类
 # ============================================================================
@@ -70,3 +246,10 @@ class ChatResult:
     content: str
     model: str
     usage: Dict[str, int]
+
+
+@dataclass
+class StreamState:
+    """流式解析状态 (在一次流式响应的多个事件间累积)"""
+    model: str
+    usage: Dict[str, int] = field(default_factory=lambda: {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
@@ -0,0 +1,151 @@
+"""
+WebSocket 多路复用
+
+一个 WebSocket 连接上并发处理多个请求，每条消息都带客户端指定的请求 id:
+
+    客户端 -> 服务端
+        {"id": "r1", "type": "chat", "request": {...ChatRequest}}   流式聊天
+        {"id": "r2", "type": "test", "request": {...ChatRequest}}   连通性测试
+        {"id": "r1", "type": "cancel"}                              取消进行中的请求
+
+    服务端 -> 客户端 (每个请求以恰好一个终止帧结束: usage / result / error / cancelled)
+        {"id": "r1", "type": "delta", "content": "..."}
+        {"id": "r1", "type": "usage", "model", "usage", "latency_ms", "ttft_ms"}
+        {"id": "r2", "type": "result", "success", "latency_ms", "message"}
+        {"id": "r1", "type": "error", "message", "error_class"}
+        {"id": "r1", "type": "cancelled"}
+
+背压: 所有请求的输出帧 (包括终止帧) 进入一个有界队列，由单个写协程按顺序发送；客户端读得慢时队列写满，
+产出帧的请求在 send() 处等待，进而暂停读取上游流，而不是在内存中无限堆积。
+协议错误 (无法解析的消息、二进制帧、重复 id 等) 不属于任何进行中的请求，由读取循环直接回复，
+与写协程共用发送锁，不会与其他帧交错发送。
+
+环境变量:
+    WS_MAX_INFLIGHT  - 每个连接同时进行的请求数上限 (默认 32)
+    WS_SEND_QUEUE    - 每个连接的待发送帧队列长度 (默认 64)
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from metrics import registry
+from serialization import dumps
+
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "32"))
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "64"))
+
+Frame = Dict[str, Any]
+Send = Callable[[Frame], Awaitable[None]]
+Handler = Callable[[Dict[str, Any], Send], Awaitable[None]]
+
+WS_CONNECTIONS = registry.gauge("proxy_ws_connections", "当前 WebSocket 连接数")
+WS_REQUESTS = registry.counter("proxy_ws_requests_total", "WebSocket 多路复用请求 (outcome: ok / error / cancelled / rejected)", ("type", "outcome"))
+
+
+class Multiplexer:
+    """单个 WebSocket 连接上的请求分发、取消与有界发送队列"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        handlers: Dict[str, Handler],
+        describe_error: Callable[[Exception], Frame],
+        max_inflight: int = WS_MAX_INFLIGHT,
+        queue_size: int = WS_SEND_QUEUE,
+    ):
+        self.websocket = websocket
+        self.handlers = handlers
+        self.describe_error = describe_error
+        self.max_inflight = max_inflight
+        self._queue: "asyncio.Queue[Frame]" = asyncio.Queue(maxsize=queue_size)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()   # WebSocket 不支持并发 send
+        self._closing = False
+
+    async def serve(self) -> None:
+        """读取客户端消息直到连接关闭，关闭时取消所有进行中的请求"""
+        writer = asyncio.ensure_future(self._write_loop())
+        WS_CONNECTIONS.inc()
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None:
+                    await self._reply({"id": None, "type": "error", "message": "只支持文本帧 (JSON)"})
+                    continue
+                await self._dispatch(text)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._closing = True
+            WS_CONNECTIONS.dec()
+            for task in list(self._tasks.values()):
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            writer.cancel()
+
+    async def _write_loop(self) -> None:
+        while True:
+            frame = await self._queue.get()
+            await self._send(frame)
+
+    async def _send(self, frame: Frame) -> None:
+        async with self._send_lock:
+            await self.websocket.send_text(dumps(frame).decode("utf-8"))
+
+    async def _reply(self, frame: Frame) -> None:
+        # 协议错误直接回复，不排在其他请求的队列帧之后，避免阻塞读取循环
+        await self._send(frame)
+
+    async def _dispatch(self, text: str) -> None:
+        try:
+            message = json.loads(text)
+            request_id = str(message["id"])
+            kind = message["type"]
+        except (ValueError, KeyError, TypeError):
+            await self._reply({"id": None, "type": "error", "message": "消息需为包含 id 与 type 的 JSON"})
+            return
+
+        if kind == "cancel":
+            task = self._tasks.get(request_id)
+            if task is not None:
+                task.cancel()
+            return
+
+        handler = self.handlers.get(kind)
+        if handler is None:
+            await self._reply({"id": request_id, "type": "error", "message": f"不支持的请求类型: {kind}"})
+            return
+        if request_id in self._tasks:
+            await self._reply({"id": request_id, "type": "error", "message": "该 id 的请求仍在进行中"})
+            return
+        if len(self._tasks) >= self.max_inflight:
+            WS_REQUESTS.inc(type=kind, outcome="rejected")
+            await self._reply({"id": request_id, "type": "error", "message": f"同一连接最多 {self.max_inflight} 个进行中的请求"})
+            return
+
+        task = asyncio.ensure_future(self._run(request_id, kind, handler, message.get("request") or {}))
+        self._tasks[request_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(request_id, None))
+
+    async def _run(self, request_id: str, kind: str, handler: Handler, payload: Dict[str, Any]) -> None:
+        async def send(frame: Frame) -> None:
+            await self._queue.put({"id": request_id, **frame})
+
+        try:
+            await handler(payload, send)
+            WS_REQUESTS.inc(type=kind, outcome="ok")
+        except asyncio.CancelledError:
+            WS_REQUESTS.inc(type=kind, outcome="cancelled")
+            if not self._closing:
+                # 终止帧排在该请求已入队的增量帧之后
+                await self._queue.put({"id": request_id, "type": "cancelled"})
+        except Exception as e:
+            WS_REQUESTS.inc(type=kind, outcome="error")
+            await self._queue.put({"id": request_id, "type": "error", **self.describe_error(e)})
@@ -0,0 +1,226 @@
+"""
+上游 HTTP 连接池
+
+按上游 origin (scheme://host:port) 复用长连接的 httpx.AsyncClient，
+避免每个 /chat /test /models 请求都重新进行 DNS + TCP + TLS 握手。
+
+环境变量:
+    POOL_MAX_CONNECTIONS   - 每个 origin 的最大连接数 (默认 20)
+    POOL_MAX_KEEPALIVE     - 每个 origin 保留的空闲长连接数 (默认 10)
+    POOL_KEEPALIVE_EXPIRY  - 空闲长连接的过期时间，秒 (默认 30)
+    POOL_HTTP2             - 设为 1 启用 HTTP/2 多路复用 (需安装 h2)
+    POOL_MAX_ORIGINS       - 最多保留的 origin 客户端数，超出时关闭最久未使用的空闲客户端 (默认 256)
+    POOL_IDLE_TTL          - origin 客户端闲置超过此时间后关闭，秒 (默认 300)
+
+origin 来自客户端提交的 base_url，客户端数必须有上限: 被关闭的 origin 通过 on_evict 回调
+通知熔断器、限流器、对冲与路由统计等按 origin 保存状态的组件一并清理。
+需要跨 await 持有客户端时 (排队、熔断半开等待、对冲延迟期间) 用 borrow() 借出，借出中的客户端不会被关闭。
+"""
+
+import asyncio
+import logging
+import os
+import ssl
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+POOL_MAX_CONNECTIONS = int(os.getenv("POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("POOL_MAX_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("POOL_KEEPALIVE_EXPIRY", "30"))
+POOL_HTTP2 = os.getenv("POOL_HTTP2", "0") == "1"
+POOL_MAX_ORIGINS = int(os.getenv("POOL_MAX_ORIGINS", "256"))
+POOL_IDLE_TTL = float(os.getenv("POOL_IDLE_TTL", "300"))
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def origin_of(url: str) -> str:
+    """提取 URL 的 origin (scheme://host:port)，作为连接池的 key"""
+    parts = urlsplit(url)
+    scheme = (parts.scheme or "https").lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port or _DEFAULT_PORTS.get(scheme, 443)
+    return f"{scheme}://{host}:{port}"
+
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def shared_ssl_context() -> ssl.SSLContext:
+    """
+    所有客户端共用的 SSL 上下文 (首次使用时创建)
+
+    每个 AsyncClient 默认各自加载一遍 CA 证书包 (数十毫秒，且在事件循环中同步执行)，
+    共用后只在第一次创建客户端或启动预热时加载一次。
+    """
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+def _no_cookies() -> CookieJar:
+    """
+    不保存任何 Cookie 的 cookie jar
+
+    同一 origin 的客户端被所有用户 (各自的 API Key) 共用，若保留上游的 Set-Cookie，
+    一个用户的会话 Cookie 会随其他用户的请求发出。
+    """
+    return CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# ============================================================================
+# 连接池
+# ============================================================================
+
+class ClientPool:
+    """按 origin 分组的长生命周期 AsyncClient 池"""
+
+    def __init__(
+        self,
+        max_connections: int = POOL_MAX_CONNECTIONS,
+        max_keepalive: int = POOL_MAX_KEEPALIVE,
+        keepalive_expiry: float = POOL_KEEPALIVE_EXPIRY,
+        http2: bool = POOL_HTTP2,
+        event_hooks: Optional[Dict[str, List[Callable]]] = None,
+        max_origins: int = POOL_MAX_ORIGINS,
+        idle_ttl: float = POOL_IDLE_TTL,
+    ):
+        if http2 and not _http2_available():
+            logger.warning("POOL_HTTP2=1 但未安装 h2，回退到 HTTP/1.1 (pip install httpx[http2])")
+            http2 = False
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.event_hooks = event_hooks or {}
+        self.max_origins = max_origins
+        self.idle_ttl = idle_ttl
+        # origin -> (客户端, 最近使用时间 monotonic)，按最近使用顺序排列 (LRU 在前)
+        self._clients: "OrderedDict[str, Tuple[httpx.AsyncClient, float]]" = OrderedDict()
+        self._borrowers: Dict[str, int] = {}   # origin -> 借出中的次数
+        self._evict_listeners: List[Callable[[str], None]] = []
+        self._closing: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def on_evict(self, listener: Callable[[str], None]) -> None:
+        """注册 origin 客户端被关闭时的回调 (参数为 origin)"""
+        self._evict_listeners.append(listener)
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        """获取 url 所属 origin 的共享客户端，不存在则创建"""
+        origin = origin_of(url)
+        now = time.monotonic()
+        entry = self._clients.get(origin)
+        if entry is not None and not entry[0].is_closed:
+            self.hits += 1
+            self._clients[origin] = (entry[0], now)
+            self._clients.move_to_end(origin)
+            return entry[0]
+        self.misses += 1
+        # 超时由调用方按请求传入，这里不设置客户端级默认值
+        client = httpx.AsyncClient(limits=self.limits, http2=self.http2, timeout=None, event_hooks=self.event_hooks,
+                                   verify=shared_ssl_context(), cookies=_no_cookies())
+        self._clients[origin] = (client, now)
+        self._clients.move_to_end(origin)
+        self._evict(now)
+        return client
+
+    @contextmanager
+    def borrow(self, url: str) -> Iterator[httpx.AsyncClient]:
+        """获取 url 所属 origin 的共享客户端，并在 with 块内标记为借出 (不会被淘汰关闭)"""
+        origin = origin_of(url)
+        self._borrowers[origin] = self._borrowers.get(origin, 0) + 1
+        try:
+            client = self.get(url)
+            yield client
+        finally:
+            remaining = self._borrowers.pop(origin) - 1
+            if remaining:
+                self._borrowers[origin] = remaining
+            # 闲置时间从归还时算起
+            entry = self._clients.get(origin)
+            if entry is not None and entry[0] is client:
+                self._clients[origin] = (client, time.monotonic())
+
+    def _evict(self, now: float) -> None:
+        """关闭闲置超过 idle_ttl 的客户端，并在超出 max_origins 时按 LRU 关闭空闲客户端 (借出中或仍有活跃连接的跳过)"""
+        over = len(self._clients) - self.max_origins
+        for origin, (client, used) in list(self._clients.items())[:-1]:
+            if now - used < self.idle_ttl and over <= 0:
+                break
+            if self._borrowers.get(origin) or any(not c.is_idle() for c in _connections_of(client)):
+                continue
+            del self._clients[origin]
+            over -= 1
+            self.evicted += 1
+            self._close_later(client)
+            for listener in self._evict_listeners:
+                listener(origin)
+
+    def _close_later(self, client: httpx.AsyncClient) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(client.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def aclose(self) -> None:
+        """关闭所有客户端 (应用关闭时调用)"""
+        clients, self._clients = [client for client, _ in self._clients.values()], OrderedDict()
+        for client in clients:
+            await client.aclose()
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池统计: 命中/未命中次数及每个 origin 的连接数"""
+        origins = {}
+        for origin, (client, _) in self._clients.items():
+            connections = _connections_of(client)
+            origins[origin] = {
+                "open": len(connections),
+                "idle": sum(1 for c in connections if c.is_idle()),
+            }
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "max_origins": self.max_origins,
+            "http2": self.http2,
+            "max_connections_per_origin": self.limits.max_connections,
+            "max_keepalive_per_origin": self.limits.max_keepalive_connections,
+            "origins": origins,
+        }
+
+
+def _connections_of(client: httpx.AsyncClient) -> list:
+    """读取底层 httpcore 连接池中的连接列表 (httpx 未公开该接口)"""
+    pool: Optional[Any] = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", None) or [])
@@ -0,0 +1,174 @@
+"""
+启动预热
+
+部署或重启后的第一个请求要为每个上游付出 DNS + TCP + TLS 的建连开销。启动时在后台:
+- 读取 provider 配置 (与 ai-providers.example.json 相同的格式: mode / include / exclude / custom.baseUrl)
+- 预先解析每个上游 origin 的域名 (同时让系统解析缓存变热，并尽早暴露解析失败)
+- 向每个 origin 并发发送 HEAD 请求，在连接池中留下若干条空闲长连接
+
+预热在后台进行，不阻塞启动；/readyz 在预热完成 (无论各上游是否可达) 之前返回 503，
+/healthz 只反映进程存活。上游不可达不影响就绪状态，否则一个 provider 故障会让所有实例都无法就绪。
+
+空闲长连接在 POOL_KEEPALIVE_EXPIRY 秒后过期，需要持续保温时可设置 PREWARM_INTERVAL 定期重新预热。
+
+环境变量:
+    PREWARM_CONFIG       - provider 配置文件路径 (默认为空，不预热)
+    PREWARM_CONNECTIONS  - 每个 origin 预先建立的长连接数 (默认 2)
+    PREWARM_TIMEOUT      - 单个 origin 的预热超时，秒 (默认 5)
+    PREWARM_INTERVAL     - 定期重新预热的间隔，秒 (默认 0，只在启动时预热一次)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from builtin_providers import load_builtin_providers
+from pool import ClientPool, origin_of, shared_ssl_context
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+PREWARM_CONFIG = os.getenv("PREWARM_CONFIG", "")
+PREWARM_CONNECTIONS = int(os.getenv("PREWARM_CONNECTIONS", "2"))
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "5"))
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "0"))
+
+# 内置 provider 的 baseUrl (由 packages/core/src/providers.ts 生成，见 builtin_providers.py)
+BUILTIN_BASE_URLS = {provider_id: entry["baseUrl"] for provider_id, entry in load_builtin_providers().items()}
+
+
+def load_provider_config(path: str) -> Dict[str, str]:
+    """
+    按 ai-providers.json 的规则解析出 provider id -> baseUrl
+
+    mode 为 default 时包含内置 provider (再按 include / exclude 过滤)，custom 中的条目新增或覆盖同名 provider。
+    """
+    text = Path(path).read_text(encoding="utf-8").strip()
+    config = json.loads(text) if text else {}
+    providers: Dict[str, str] = {}
+    if config.get("mode", "default") == "default":
+        include, exclude = config.get("include") or [], config.get("exclude") or []
+        providers = {
+            provider_id: base_url for provider_id, base_url in BUILTIN_BASE_URLS.items()
+            if (not include or provider_id in include) and provider_id not in exclude
+        }
+    for provider_id, entry in (config.get("custom") or {}).items():
+        base_url = (entry.get("baseUrl") or "").strip()
+        if base_url:
+            providers[provider_id] = base_url
+        elif provider_id not in providers and provider_id in BUILTIN_BASE_URLS:
+            providers[provider_id] = BUILTIN_BASE_URLS[provider_id]
+    return providers
+
+
+# ============================================================================
+# 预热
+# ============================================================================
+
+class Prewarmer:
+    """后台预热连接池，并提供就绪状态"""
+
+    def __init__(
+        self,
+        pool: ClientPool,
+        config_path: str = PREWARM_CONFIG,
+        connections: int = PREWARM_CONNECTIONS,
+        timeout: float = PREWARM_TIMEOUT,
+        interval: float = PREWARM_INTERVAL,
+    ):
+        self.pool = pool
+        self.config_path = config_path
+        self.connections = connections
+        self.timeout = timeout
+        self.interval = interval
+        self.ready = False
+        self.error: Optional[str] = None
+        self.duration_ms: Optional[int] = None
+        self.origins: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        try:
+            await self.warm_all()
+        except Exception as e:
+            self.error = str(e)
+            logger.warning("连接预热失败: %s", e)
+        finally:
+            self.ready = True
+        while self.interval > 0:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.warm_all()
+            except Exception as e:
+                logger.warning("连接预热失败: %s", e)
+
+    async def warm_all(self) -> None:
+        start = time.perf_counter()
+        # 证书包加载与配置文件读取都是同步 IO，放到线程中避免阻塞事件循环
+        await asyncio.to_thread(shared_ssl_context)
+        if not self.config_path:
+            return
+        providers = await asyncio.to_thread(load_provider_config, self.config_path)
+        by_origin: Dict[str, List[str]] = {}
+        for provider_id, base_url in providers.items():
+            by_origin.setdefault(origin_of(base_url), []).append(provider_id)
+        await asyncio.gather(*(self.warm(origin, ids) for origin, ids in by_origin.items()))
+        self.duration_ms = int((time.perf_counter() - start) * 1000)
+
+    async def warm(self, origin: str, provider_ids: List[str]) -> None:
+        """解析 origin 的域名并建立 connections 条长连接"""
+        status: Dict[str, Any] = {"providers": provider_ids}
+        self.origins[origin] = status
+        parts = urlsplit(origin)
+        start = time.perf_counter()
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(parts.hostname, parts.port, type=socket.SOCK_STREAM),
+                timeout=self.timeout,
+            )
+            status["dns_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            status["addresses"] = sorted({info[4][0] for info in infos})
+        except (OSError, asyncio.TimeoutError) as e:
+            status["error"] = f"DNS 解析失败: {e or type(e).__name__}"
+            return
+
+        # 并发请求才会各自占用一条连接；响应 (HEAD 无响应体) 读完后连接以空闲状态留在池中
+        start = time.perf_counter()
+        with self.pool.borrow(origin) as client:
+            results = await asyncio.gather(
+                *(client.head(f"{origin}/", timeout=self.timeout) for _ in range(max(1, self.connections))),
+                return_exceptions=True,
+            )
+        status["connect_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        status["connections"] = sum(1 for r in results if isinstance(r, httpx.Response))
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            status["error"] = str(errors[0]) or type(errors[0]).__name__
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "config": self.config_path or None,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "origins": self.origins,
+        }
@@ -0,0 +1,286 @@
+"""
+聊天响应精确匹配缓存
+
+key 为 (api_format, 规范化的 base_url, model, api_key 哈希, 策略 build_payload 生成的请求体) 的规范化 JSON 哈希，
+因此只有字节级相同的请求才会命中。model 单独参与哈希，因为部分格式 (如 Gemini) 的模型只出现在 URL 中；
+base_url 保留路径，同一主机上不同路径前缀的网关互不共享缓存。两级存储:
+- 内存 LRU (条目数上限)
+- 本地 SQLite (TTL + 总字节数上限，按最近访问时间淘汰)，进程重启后仍然有效
+
+环境变量:
+    RESPONSE_CACHE_ENABLED         - 设为 1 开启 (默认关闭)
+    RESPONSE_CACHE_TTL             - 有效期，秒 (默认 86400)
+    RESPONSE_CACHE_MEMORY_ENTRIES  - 内存层条目数上限 (默认 512)
+    RESPONSE_CACHE_PATH            - SQLite 文件路径 (默认 response_cache.sqlite3，设为空字符串则只用内存层)
+    RESPONSE_CACHE_MAX_BYTES       - SQLite 层总大小上限，字节 (默认 256MB)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from models import ChatResult
+from pool import origin_of
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "512"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+def _normalize_base_url(base_url: str) -> str:
+    """origin (小写 host + 显式端口) + 去掉末尾斜杠的路径与查询参数"""
+    parts = urlsplit(base_url.strip())
+    normalized = origin_of(base_url) + parts.path.rstrip("/")
+    return f"{normalized}?{parts.query}" if parts.query else normalized
+
+
+def response_key(api_format: str, base_url: str, api_key: str, model: str, payload: Dict[str, Any]) -> str:
+    """请求的规范化哈希 (api_key 只参与哈希，不同凭据之间不共享缓存)"""
+    canonical = json.dumps(
+        {
+            "format": api_format,
+            "base_url": _normalize_base_url(base_url),
+            "model": model,
+            "key": hashlib.sha256(api_key.encode("utf-8")).hexdigest(),
+            "payload": payload,
+        },
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _encode(result: ChatResult) -> bytes:
+    return json.dumps(
+        {"content": result.content, "model": result.model, "usage": result.usage, "raw_response": result.raw_response},
+        ensure_ascii=False, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _decode(blob: bytes) -> ChatResult:
+    data = json.loads(blob)
+    return ChatResult(raw_response=data["raw_response"], content=data["content"], model=data["model"], usage=data["usage"])
+
+
+# ============================================================================
+# SQLite 层
+# ============================================================================
+
+class _DiskTier:
+    """
+    SQLite 存储 (所有操作在线程池中执行，避免阻塞事件循环)
+
+    多个 worker 可共用同一个文件: 总字节数保存在 response_bytes 表中，由触发器在写入 / 删除的同一事务内维护，
+    写入与淘汰在 BEGIN IMMEDIATE 事务中进行，各进程看到的大小与淘汰决策一致。
+
+    server 在导入时创建 ResponseCache，连接推迟到第一次访问 (在线程池中) 才建立。
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # 调用方持有 self._lock
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._create_schema(db)
+            self._db = db
+        return self._db
+
+    def _create_schema(self, db: sqlite3.Connection) -> None:
+        with self._transaction(db):
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            db.execute("CREATE TABLE IF NOT EXISTS response_bytes (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            # 旧版本创建的文件没有 response_bytes: 按现有条目初始化
+            db.execute("INSERT OR IGNORE INTO response_bytes (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+            db.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_bytes_insert AFTER INSERT ON responses"
+                " BEGIN UPDATE response_bytes SET total = total + NEW.size WHERE id = 0; END"
+            )
+            db.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_bytes_update AFTER UPDATE OF size ON responses"
+                " BEGIN UPDATE response_bytes SET total = total - OLD.size + NEW.size WHERE id = 0; END"
+            )
+            db.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_bytes_delete AFTER DELETE ON responses"
+                " BEGIN UPDATE response_bytes SET total = total - OLD.size WHERE id = 0; END"
+            )
+
+    @staticmethod
+    @contextmanager
+    def _transaction(db: sqlite3.Connection) -> Iterator[None]:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @staticmethod
+    def _total(db: sqlite3.Connection) -> int:
+        return db.execute("SELECT total FROM response_bytes WHERE id = 0").fetchone()[0]
+
+    @property
+    def bytes(self) -> int:
+        """所有共用该文件的进程写入的总字节数 (同步读取数据库，事件循环中应使用 put / purge_expired 的返回值)"""
+        with self._lock:
+            return self._total(self._connection())
+
+    def get(self, key: str, ttl: float) -> Optional[Tuple[bytes, float]]:
+        """返回 (value, created_at)，不存在或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            row = db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+
+    def put(self, key: str, value: bytes) -> int:
+        """写入并按总大小淘汰，返回写入后的总字节数"""
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            with self._transaction(db):
+                return self._put(db, key, value, now)
+
+    def _put(self, db: sqlite3.Connection, key: str, value: bytes, now: float) -> int:
+        # UPSERT 而不是 INSERT OR REPLACE: REPLACE 删除旧行时不触发 DELETE 触发器
+        db.execute(
+                "INSERT INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size,"
+            " created_at = excluded.created_at, accessed_at = excluded.accessed_at",
+            (key, value, len(value), now, now),
+        )
+        # 超出总大小时按最近访问时间淘汰最旧的条目
+        total = self._total(db)
+        while total > self.max_bytes:
+            rows = db.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            for k, size in rows:
+                db.execute("DELETE FROM responses WHERE key = ?", (k,))
+                total -= size
+                self.evictions += 1
+                if total <= self.max_bytes:
+                    break
+        return total
+
+    def purge_expired(self, ttl: float) -> int:
+        """删除过期条目，返回删除后的总字节数"""
+        with self._lock:
+            db = self._connection()
+            db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - ttl,))
+            return self._total(db)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# ============================================================================
+# 两级缓存
+# ============================================================================
+
+class ResponseCache:
+    """内存 LRU + SQLite 两级响应缓存"""
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+        path: Optional[str] = RESPONSE_CACHE_PATH,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+    ):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._disk = _DiskTier(path, max_bytes) if path else None
+        # SQLite 层的总字节数 (所有 worker)，在本进程每次写入 / 清理时于线程池中读取，stats() 不在事件循环中查询数据库
+        self._disk_bytes: Optional[int] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, key: str) -> Optional[ChatResult]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            blob, created_at = entry
+            if time.time() - created_at <= self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return _decode(blob)
+            del self._memory[key]
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key, self.ttl)
+            if row is not None:
+                self.disk_hits += 1
+                self._remember(key, *row)
+                return _decode(row[0])
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: ChatResult) -> None:
+        blob = _encode(result)
+        self._remember(key, blob, time.time())
+        self.stores += 1
+        if self._disk is not None:
+            self._disk_bytes = await asyncio.to_thread(self._disk.put, key, blob)
+
+    def _remember(self, key: str, blob: bytes, created_at: float) -> None:
+        self._memory[key] = (blob, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def purge_expired(self) -> None:
+        if self._disk is not None:
+            self._disk_bytes = await asyncio.to_thread(self._disk.purge_expired, self.ttl)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "ttl": self.ttl,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.memory_entries,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+        }
+        if self._disk is not None:
+            stats.update(disk_bytes=self._disk_bytes, disk_max_bytes=self._disk.max_bytes, disk_evictions=self._disk.evictions)
+        return stats
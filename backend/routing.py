@@ -0,0 +1,106 @@
+"""
+多候选延迟感知路由
+
+为每个候选 (api_format, base_url, model) 维护 EWMA 延迟与错误率，
+按评分 (或顺序 / 权重) 排出尝试顺序；候选超时、5xx、429 或网络错误时在同一请求内切换到下一个。
+
+环境变量:
+    ROUTING_EWMA_ALPHA     - EWMA 平滑系数 (默认 0.3)
+    ROUTING_ERROR_PENALTY  - 错误率惩罚系数: score = latency * (1 + penalty * error_rate) / weight (默认 10)
+"""
+
+import os
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from breaker import CircuitOpenError
+from limiter import LimiterError
+from models import ChatCandidate, RoutingMode
+from pool import origin_of
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+ROUTING_EWMA_ALPHA = float(os.getenv("ROUTING_EWMA_ALPHA", "0.3"))
+ROUTING_ERROR_PENALTY = float(os.getenv("ROUTING_ERROR_PENALTY", "10"))
+
+CandidateKey = Tuple[str, str, str]
+
+
+def candidate_key(c: ChatCandidate) -> CandidateKey:
+    return (c.api_format, c.base_url.rstrip("/"), c.model)
+
+
+def is_failover_error(e: Exception) -> bool:
+    """是否应切换到下一个候选: 超时 / 5xx / 429 / 网络错误 / 限流排队失败 / 熔断中"""
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(e, (httpx.TimeoutException, httpx.TransportError, LimiterError, CircuitOpenError, TimeoutError))
+
+
+@dataclass
+class CandidateStats:
+    latency: Optional[float] = None  # EWMA 延迟 (秒)
+    error_rate: float = 0.0          # EWMA 错误率
+    requests: int = 0
+    failures: int = 0
+
+
+class CandidateRouter:
+    """候选评分与排序"""
+
+    def __init__(self, alpha: float = ROUTING_EWMA_ALPHA, error_penalty: float = ROUTING_ERROR_PENALTY):
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self._stats: Dict[CandidateKey, CandidateStats] = {}
+
+    def score(self, c: ChatCandidate) -> float:
+        """评分越低越优先；没有样本的候选取 0 分，优先探索"""
+        stats = self._stats.get(candidate_key(c))
+        if stats is None or stats.latency is None:
+            return 0.0
+        return stats.latency * (1 + self.error_penalty * stats.error_rate) / max(c.weight, 1e-6)
+
+    def order(self, candidates: List[ChatCandidate], routing: RoutingMode) -> List[ChatCandidate]:
+        """按路由模式排出尝试顺序"""
+        if routing == "ordered":
+            return list(candidates)
+        if routing == "weighted":
+            # 加权随机排列 (Efraimidis-Spirakis)
+            return sorted(candidates, key=lambda c: random.random() ** (1 / max(c.weight, 1e-6)), reverse=True)
+        if routing == "latency":
+            return sorted(candidates, key=self.score)
+        raise ValueError(f"不支持的路由模式: {routing}。支持: latency, ordered, weighted")
+
+    def record(self, c: ChatCandidate, latency: float, ok: bool) -> None:
+        stats = self._stats.setdefault(candidate_key(c), CandidateStats())
+        stats.requests += 1
+        a = self.alpha
+        if ok:
+            stats.latency = latency if stats.latency is None else a * latency + (1 - a) * stats.latency
+        else:
+            stats.failures += 1
+            # 失败时延迟也计入 (超时本身就是很差的延迟)，但不低于当前估计
+            if stats.latency is None or latency > stats.latency:
+                stats.latency = latency if stats.latency is None else a * latency + (1 - a) * stats.latency
+        stats.error_rate = a * (0.0 if ok else 1.0) + (1 - a) * stats.error_rate
+
+    def forget(self, origin: str) -> None:
+        """连接池关闭 origin 的客户端时丢弃该 origin 下所有候选的统计"""
+        for key in [k for k in self._stats if origin_of(k[1]) == origin]:
+            del self._stats[key]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "api_format": k[0], "base_url": k[1], "model": k[2],
+                "ewma_latency_ms": int(s.latency * 1000) if s.latency is not None else None,
+                "error_rate": round(s.error_rate, 3), "requests": s.requests, "failures": s.failures,
+            }
+            for k, s in self._stats.items()
+        ]
@@ -0,0 +1,48 @@
+"""
+响应序列化快速通道
+
+代理响应 (尤其是带 raw_response 的 ChatResponse) 可能包含很大的任意嵌套 dict。
+FastAPI 默认会按 response_model 再校验一遍返回值并用标准库 json 编码，
+这里改为: 用 model_construct 构造 (跳过校验) + orjson 直接编码 (未安装时回退到标准库 json)。
+"""
+
+import json
+import time
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from timing import record_span
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """编码为 UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 orjson (可用时) 编码的 JSONResponse"""
+
+    def render(self, content: Any) -> bytes:
+        start = time.perf_counter()
+        body = dumps(content)
+        record_span("serialize", start, bytes=len(body))
+        return body
+
+
+def respond(model: BaseModel, status_code: int = 200) -> FastJSONResponse:
+    """直接返回 Response，绕过 FastAPI 对 response_model 的二次校验"""
+    # 响应模型均为扁平字段 (dict / list / 基本类型)，__dict__ 即可直接编码
+    content = dict(model.__dict__)
+    for name in getattr(model, "OPTIONAL_FIELDS", ()):
+        if name not in model.model_fields_set:
+            content.pop(name, None)
+    return FastJSONResponse(content, status_code=status_code)
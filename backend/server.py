@@ -6,8 +6,20 @@ FastAPI 代理服务，解决浏览器 CORS 限制。
 
 端点:
     /test   - 测试 AI Provider Model 连通性
+    /test/batch - 批量连通性测试 (NDJSON 流式返回)
     /chat   - 发送聊天请求
+    /chat/stream - 流式聊天 (SSE)
+    /chat/route  - 多候选延迟感知路由 + 故障切换
+    /chat/batch  - 批量聊天 (JSON 或 JSONL 上传，NDJSON 按完成顺序返回 + 用量汇总)
+    /ws     - WebSocket 多路复用 (一个连接上并发流式聊天 / 测试，按请求 id 取消)
+    /sessions    - 创建服务端会话 (DELETE /sessions/{id} 删除)
+    /sessions/chat - 会话聊天 (只发送新增消息)
     /models - 获取模型列表
+    /models/search - 跨 provider 模型搜索 (过滤 + 游标分页)
+    /stats  - 运行时统计 (连接池、缓存、准入控制、上游限流、对冲、事件循环延迟等)
+    /healthz - 存活检查
+    /readyz  - 就绪检查 (启动预热完成后才返回 200)
+    /metrics - Prometheus 指标
 
 启动:
     python server.py
@@ -15,43 +27,162 @@ FastAPI 代理服务，解决浏览器 CORS 限制。
     uvicorn server:app --reload --port 8000
 """
 
-from typing import Dict, List, Optional
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, TypeVar
+from fastapi import FastAPI, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import httpx
+import json
+from pydantic import ValidationError
 import time
 
 from models import (
-    ChatRequest, FetchModelsRequest,
-    TestConnectionResponse, ChatResponse, FetchModelsResponse,
+    ChatRequest, FetchModelsRequest, BatchTestRequest, RoutedChatRequest, CreateSessionRequest, SessionChatRequest, ModelSearchRequest,
+    BatchChatItem, BatchChatOptions, BatchChatRequest,
+    TestConnectionResponse, ChatResponse, FetchModelsResponse, BatchProbeResult, SessionResponse, ModelSearchResponse,
+    BatchChatResult, BatchChatSummary,
 )
-from strategies import get_strategy, STRATEGY_REGISTRY
+from strategies import get_strategy, STRATEGY_REGISTRY, BodyTooLarge
+from pool import ClientPool, origin_of
+from batch import run_bounded
+from metrics import registry, track, RequestTracker
+from serialization import respond, dumps, FastJSONResponse
+from limiter import LimiterRegistry, LimiterError, key_scope
+from hedging import Hedger, HEDGE_ENABLED
+from routing import CandidateRouter, is_failover_error
+from response_cache import ResponseCache, response_key, RESPONSE_CACHE_ENABLED
+from cache import ModelListCache, cache_key
+from breaker import BreakerRegistry, CircuitOpenError
+from model_index import ModelIndex, index_scope
+from sessions import SessionStore, SESSION_TOKEN_BUDGET
+from compression import CompressionMiddleware
+from http_cache import conditional_response, cache_control
+from admission import AdmissionController, AdmissionMiddleware, Shed
+from deadline import Deadline, DeadlineExceeded, ClientDisconnected, cancel_on_disconnect
+from multiplex import Multiplexer, Send
+from timing import TimingMiddleware
+from prewarm import Prewarmer
+from shared_state import SharedState
+from loop_lag import LoopLagMonitor
+
+T = TypeVar("T")
 
 # ============================================================================
 # 配置常量
 # ============================================================================
     
-TIMEOUT_CHAT = 100.0      # 聊天请求超时 (秒)
-TIMEOUT_MODELS = 60.0    # 模型列表请求超时 (秒)
+TIMEOUT_CHAT = 100.0      # 聊天请求默认超时 (秒)，请求体 timeout 可覆盖
+TIMEOUT_MODELS = 60.0    # 模型列表请求默认超时 (秒)，请求体 timeout 可覆盖
+ROUTE_ATTEMPT_SHARE = 0.5  # /chat/route 非最后一个候选默认最多使用剩余预算的比例，留给故障切换
+
+BATCH_MAX_PROBES = 200               # /test/batch 单次最多探测数
+BATCH_CONCURRENCY = 32               # /test/batch 默认全局并发
+BATCH_PER_ORIGIN_CONCURRENCY = 4     # /test/batch 默认每个 origin 并发
+BATCH_PROBE_TIMEOUT = 15.0           # /test/batch 默认单个探测截止时间 (秒)
+BATCH_MAX_ITEMS = 5000               # /chat/batch 单次最多条目数 (并发上限沿用 /test/batch 的默认值)
+JSONL_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
 
 # ============================================================================
 # FastAPI 应用
 # ============================================================================
 
-app = FastAPI(title="AI Provider Proxy", version="1.0.0")
+# 跨 worker 进程的共享状态 (STATE_BACKEND，默认进程内)
+shared_state = SharedState()
+
+# 按 origin 的自适应并发限制 (AIMD + Retry-After 感知排队)
+limiters = LimiterRegistry(shared=shared_state)
+
+# 按 (api_format, origin) 的熔断器
+breakers = BreakerRegistry()
+
+# 幂等请求 (/test, /models) 的对冲
+hedger = Hedger()
+
+# /chat/route 的候选评分 (EWMA 延迟 + 错误率)
+router = CandidateRouter()
+
+# /chat 响应精确匹配缓存 (RESPONSE_CACHE_ENABLED=1 时启用)
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
+# 全局准入控制 (进行中请求数 / 上游字节数上限，chat > test > models)
+admission = AdmissionController()
+
+# 上游连接池: 随应用生命周期创建与关闭，按 origin 复用长连接
+client_pool = ClientPool(event_hooks={"request": [breakers.on_request],
+                                      "response": [breakers.on_response, limiters.on_response, admission.on_response]})
+client_pool.on_evict(breakers.forget)
+client_pool.on_evict(limiters.forget)
+client_pool.on_evict(hedger.forget)
+client_pool.on_evict(router.forget)
+
+# 模型列表缓存 (TTL + stale-while-revalidate + single-flight)
+models_cache = ModelListCache(shared=shared_state)
+
+# 跨 provider 的统一模型索引 (/models 拉取时增量更新)
+model_index = ModelIndex()
+
+# 服务端会话 (客户端每轮只发送新增消息)
+sessions = SessionStore()
+
+# 启动预热 (按 provider 配置预解析 DNS、建立长连接)，决定 /readyz 状态
+prewarmer = Prewarmer(client_pool)
+
+# 事件循环延迟采样 (proxy_event_loop_lag_seconds)
+loop_lag = LoopLagMonitor()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if response_cache is not None:
+        await response_cache.purge_expired()
+    shared_state.start()
+    prewarmer.start()
+    loop_lag.start()
+    yield
+    await loop_lag.stop()
+    await prewarmer.stop()
+    await shared_state.stop()
+    await client_pool.aclose()
+    if response_cache is not None:
+        response_cache.close()
+
+
+app = FastAPI(title="AI Provider Proxy", version="1.0.0", lifespan=lifespan)
+
+# gzip / brotli 压缩 (最内层，准入控制拒绝的小响应不经过压缩)
+app.add_middleware(CompressionMiddleware)
+
+# 准入控制: 端点 -> 优先级
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    routes={
+        "/chat": "chat", "/chat/stream": "chat", "/chat/route": "chat", "/sessions/chat": "chat",
+        "/test": "test", "/test/batch": "test",
+        "/models": "models", "/models/search": "models",
+        "/chat/batch": "batch",
+    },
+)
 
 import os
 
 # CORS 配置: 从环境变量 CORS_ORIGINS 读取，逗号分隔，默认允许常用开发端口
+# (后添加的中间件在外层，准入控制返回的 503 同样带上 CORS 头)
 _default_origins = "http://localhost:5173,http://127.0.0.1:5173,http://localhost:5174,http://127.0.0.1:5174,http://localhost:3000,http://127.0.0.1:3000,https://tombcato.github.io"
-_cors_origins = os.getenv("CORS_ORIGINS", _default_origins).split(",")
+_cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", _default_origins).split(",")]
+
+# 单请求耗时分解 (Server-Timing + 可选追踪文件)，位于准入控制外层以计入准入排队时间
+app.add_middleware(TimingMiddleware, allow_origins=_cors_origins)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[o.strip() for o in _cors_origins],
+    allow_origins=_cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "ETag", "Server-Timing"],
 )
 
 
@@ -59,22 +190,131 @@ app.add_middleware(
 # 核心逻辑
 # ============================================================================
 
-async def send_chat_request(api_format: str, base_url: str, api_key: str, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int]):
-    """发送聊天请求"""
+async def with_deadline(aw: Awaitable[T], deadline: Deadline) -> T:
+    """在截止时间内等待 aw，超时则取消并抛出 DeadlineExceeded"""
+    try:
+        return await asyncio.wait_for(aw, timeout=max(0.0, deadline.remaining()))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"请求超过截止时间 ({deadline.total:g}秒)") from None
+
+
+async def send_chat_request(api_format: str, base_url: str, api_key: str, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int],
+                            hedge: bool = False, deadline: Optional[Deadline] = None):
+    """
+    发送聊天请求 (hedge 仅用于幂等的连通性探测)
+    
+    排队、429 重试与对冲都计入同一个 deadline，每次上游请求只使用剩余的预算。
+    """
     strategy = get_strategy(api_format)
-    async with httpx.AsyncClient(timeout=TIMEOUT_CHAT) as client:
-        return await strategy.execute(client, base_url, api_key, model, messages, max_tokens)
+    deadline = deadline or Deadline.from_request(None, TIMEOUT_CHAT)
+    # 排队、熔断半开等待与对冲延迟期间客户端一直借出，不会被连接池淘汰关闭
+    with client_pool.borrow(base_url) as client:
+        
+        async def attempt():
+            async with breakers.guard(api_format, base_url, deadline.at):
+                return await limiters.call(
+                    base_url,
+                    lambda: strategy.execute(client, base_url, api_key, model, messages, max_tokens, timeout=deadline.httpx_timeout()),
+                    deadline=deadline.at,
+                    key=key_scope(api_key),
+                )
+        
+        return await with_deadline(hedger.run("test", base_url, attempt) if hedge else attempt(), deadline)
+
+
+async def stream_chat_request(api_format: str, base_url: str, api_key: str, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int],
+                              deadline: Optional[Deadline] = None) -> AsyncIterator[Dict[str, Any]]:
+    """发送流式聊天请求，逐个产出标准化的增量帧"""
+    strategy = get_strategy(api_format)
+    deadline = deadline or Deadline.from_request(None, TIMEOUT_CHAT)
+    with client_pool.borrow(base_url) as client:
+        async with breakers.guard(api_format, base_url, deadline.at), limiters.slot(base_url, deadline.at, key_scope(api_key)):
+            async for frame in strategy.stream(client, base_url, api_key, model, messages, max_tokens, timeout=deadline.httpx_timeout()):
+                if deadline.remaining() <= 0:
+                    raise DeadlineExceeded(f"请求超过截止时间 ({deadline.total:g}秒)")
+                yield frame
+
+
+async def cached_chat_request(req: ChatRequest, request: Optional[Request] = None, default_timeout: float = TIMEOUT_CHAT) -> Tuple[Any, Optional[float]]:
+    """
+    按 req.cache 读写响应缓存并发送聊天请求
+    
+    返回 (结果, 缓存查找耗时 ms)；查找耗时为 None 表示结果来自上游。传入 request 时客户端断开会取消上游请求。
+    """
+    key = None
+    if response_cache is not None and req.cache != "bypass":
+        payload = get_strategy(req.api_format).build_payload(req.model, req.messages, req.max_tokens)
+        key = response_key(req.api_format, req.base_url, req.api_key, req.model, payload)
+        if req.cache == "use":
+            lookup_start = time.perf_counter()
+            cached = await response_cache.get(key)
+            if cached is not None:
+                return cached, round((time.perf_counter() - lookup_start) * 1000, 3)
+    
+    pending = send_chat_request(req.api_format, req.base_url, req.api_key, req.model, req.messages, req.max_tokens,
+                                deadline=Deadline.from_request(req.timeout, default_timeout))
+    result = await (cancel_on_disconnect(request, pending) if request is not None else pending)
+    if key is not None:
+        await response_cache.put(key, result)
+    return result, None
+
+
+def sse_event(frame: Dict[str, Any]) -> str:
+    """编码为一条 SSE 消息"""
+    return f"data: {json.dumps(frame, ensure_ascii=False)}\n\n"
+
+
+def select_raw(raw: Dict[str, Any], include_raw: bool, raw_fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """按请求选项裁剪 raw_response"""
+    if not include_raw:
+        return None
+    if raw_fields is not None:
+        return {k: raw[k] for k in raw_fields if k in raw}
+    return raw
 
 
 def format_error(e: Exception) -> str:
     """格式化错误信息"""
     if isinstance(e, httpx.HTTPStatusError):
         return f"HTTP {e.response.status_code}: {e.response.text[:500]}"
+    elif isinstance(e, httpx.ConnectTimeout):
+        return "连接上游超时"
     elif isinstance(e, httpx.TimeoutException):
-        return f"请求超时 ({int(TIMEOUT_CHAT)}秒)"
+        return "请求超时"
     return str(e)
 
 
+def classify_error(e: Exception) -> str:
+    """错误分类 (用于批量结果与统计)"""
+    if isinstance(e, (LimiterError, CircuitOpenError, Shed, BodyTooLarge)):
+        return e.error_class
+    if isinstance(e, httpx.HTTPStatusError):
+        return "http_error"
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError, DeadlineExceeded)):
+        return "timeout"
+    if isinstance(e, ClientDisconnected):
+        return "client_disconnected"
+    if isinstance(e, httpx.ConnectError):
+        return "connect_error"
+    if isinstance(e, httpx.TransportError):
+        return "network_error"
+    if isinstance(e, json.JSONDecodeError):
+        return "decode_error"
+    if isinstance(e, ValueError):
+        return "invalid_request"
+    return "error"
+
+
+def error_status(e: Exception) -> Optional[int]:
+    """上游 HTTP 错误的状态码"""
+    return e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+
+
+def mark_failed(tracker: RequestTracker, e: Exception) -> None:
+    """按错误分类标记请求指标"""
+    tracker.fail(classify_error(e), error_status(e))
+
+
 
 
 # ============================================================================
@@ -82,63 +322,520 @@ def format_error(e: Exception) -> str:
 # ============================================================================
 
 @app.get("/", tags=["Health"])
-async def root():
-    return {
+async def root(request: Request):
+    return conditional_response(request, {
         "status": "running",
         "supported_formats": list(STRATEGY_REGISTRY.keys()),
-        "endpoints": ["/test", "/chat", "/models"],
+        "endpoints": ["/test", "/test/batch", "/chat", "/chat/stream", "/chat/route", "/chat/batch", "/ws", "/sessions", "/sessions/chat",
+                      "/models", "/models/search", "/stats", "/metrics", "/healthz", "/readyz"],
+        "breakers": breakers.states(),
+    })
+
+
+@app.get("/healthz", tags=["Health"])
+async def healthz():
+    """存活检查: 进程能处理请求即返回 200"""
+    return {"status": "alive"}
+
+
+@app.get("/readyz", tags=["Health"])
+async def readyz():
+    """就绪检查: 启动预热完成前返回 503，避免滚动发布时流量打到冷实例"""
+    return FastJSONResponse({"status": "ready" if prewarmer.ready else "warming", "prewarm": prewarmer.stats()},
+                            status_code=200 if prewarmer.ready else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+async def metrics():
+    """Prometheus 指标 (文本格式)"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/stats", tags=["Health"])
+async def stats():
+    """运行时统计"""
+    return {
+        "pool": client_pool.stats(),
+        "models_cache": models_cache.stats(),
+        "admission": admission.stats(),
+        "limiter": limiters.stats(),
+        "hedging": hedger.stats(),
+        "routing": router.stats(),
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "sessions": sessions.stats(),
+        "model_index": model_index.stats(),
+        "prewarm": prewarmer.stats(),
+        "shared_state": shared_state.stats(),
+        "loop_lag": loop_lag.stats(),
     }
 
 
 @app.post("/test", response_model=TestConnectionResponse, tags=["Proxy"])
-async def test_connection(req: ChatRequest):
+async def test_connection(req: ChatRequest, request: Request):
     """测试连通性"""
     start = time.time()
-    try:
-        await send_chat_request(req.api_format, req.base_url, req.api_key, req.model, [{"role": "user", "content": "Hi"}], None)
-        return TestConnectionResponse(success=True, latency_ms=int((time.time() - start) * 1000), message="连接成功")
-    except Exception as e:
-        return TestConnectionResponse(success=False, latency_ms=0, message=format_error(e))
+    with track("/test", req.api_format, req.base_url) as tracker:
+        try:
+            await cancel_on_disconnect(request, send_chat_request(
+                req.api_format, req.base_url, req.api_key, req.model, [{"role": "user", "content": "Hi"}], None,
+                hedge=HEDGE_ENABLED if req.hedge is None else req.hedge,
+                deadline=Deadline.from_request(req.timeout, TIMEOUT_CHAT),
+            ))
+            return TestConnectionResponse(success=True, latency_ms=int((time.time() - start) * 1000), message="连接成功")
+        except Exception as e:
+            mark_failed(tracker, e)
+            return TestConnectionResponse(success=False, latency_ms=0, message=format_error(e))
+
+
+@app.post("/test/batch", tags=["Proxy"])
+async def test_batch(req: BatchTestRequest):
+    """
+    批量测试连通性
+    
+    所有探测并发执行 (受全局 / 每 origin 并发上限约束)，每个探测完成后立即以 NDJSON 一行返回，
+    总耗时约等于最慢的那个探测。
+    """
+    if len(req.probes) > BATCH_MAX_PROBES:
+        # 批量结果按 NDJSON 流式返回，整体拒绝时用 4xx 状态码区分，而不是返回另一种 200 响应体
+        return respond(TestConnectionResponse.model_construct(success=False, latency_ms=0, message=f"probes 最多 {BATCH_MAX_PROBES} 个"),
+                       status_code=413)
+    
+    concurrency = min(req.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    per_origin = min(req.per_origin_concurrency or BATCH_PER_ORIGIN_CONCURRENCY, concurrency)
+    probe_timeout = req.timeout or BATCH_PROBE_TIMEOUT
+    
+    async def probe(index: int, p: ChatRequest) -> BatchProbeResult:
+        start = time.time()
+        with track("/test/batch", p.api_format, p.base_url) as tracker:
+            try:
+                # 截止时间从探测真正开始执行时计算 (不含等待批量并发名额的时间)
+                await send_chat_request(p.api_format, p.base_url, p.api_key, p.model, [{"role": "user", "content": "Hi"}], None,
+                                        hedge=HEDGE_ENABLED if p.hedge is None else p.hedge,
+                                        deadline=Deadline.from_request(p.timeout, probe_timeout))
+                return BatchProbeResult(index=index, provider_id=p.provider_id, model=p.model, success=True,
+                                        latency_ms=int((time.time() - start) * 1000), status_code=200, message="连接成功")
+            except Exception as e:
+                mark_failed(tracker, e)
+                return BatchProbeResult(
+                    index=index, provider_id=p.provider_id, model=p.model, success=False,
+                    latency_ms=int((time.time() - start) * 1000),
+                    status_code=error_status(e),
+                    error_class=classify_error(e),
+                    message=format_error(e),
+                )
+    
+    async def lines():
+        async for result in run_bounded(req.probes, probe, lambda p: origin_of(p.base_url), concurrency, per_origin):
+            yield result.model_dump_json() + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.post("/chat", response_model=ChatResponse, tags=["Proxy"])
-async def chat(req: ChatRequest):
-    """发送聊天请求"""
+async def chat(req: ChatRequest, request: Request):
+    """发送聊天请求 (客户端断开时取消上游请求)"""
     if not req.messages:
-        return ChatResponse(success=False, message="messages 不能为空")
+        return respond(ChatResponse.model_construct(success=False, message="messages 不能为空"))
     
     start = time.time()
-    try:
-        result = await send_chat_request(req.api_format, req.base_url, req.api_key, req.model, req.messages, req.max_tokens)
-        return ChatResponse(
+    with track("/chat", req.api_format, req.base_url) as tracker:
+        try:
+            result, lookup_ms = await cached_chat_request(req, request)
+            if lookup_ms is None:
+                tracker.record_usage(result.usage)
+            return respond(ChatResponse.model_construct(
+                success=True, content=result.content, model=result.model, usage=result.usage,
+                latency_ms=int((time.time() - start) * 1000),
+                raw_response=select_raw(result.raw_response, req.include_raw, req.raw_fields),
+                **({"cached": True, "cache_lookup_ms": lookup_ms} if lookup_ms is not None else {}),
+            ))
+        except Exception as e:
+            mark_failed(tracker, e)
+            return respond(ChatResponse.model_construct(success=False, latency_ms=int((time.time() - start) * 1000), message=format_error(e)))
+
+
+@app.post("/chat/route", response_model=ChatResponse, tags=["Proxy"])
+async def chat_route(req: RoutedChatRequest, request: Request):
+    """
+    多候选路由聊天
+    
+    按 EWMA 延迟与错误率 (或顺序 / 权重) 选择候选；候选超时、5xx、429 时在本请求内切换到下一个，
+    served_by 中返回实际提供服务的候选。候选之间可以混用不同 api_format。
+    
+    所有候选共享 timeout 的总预算，每次尝试另有上限 (attempt_timeout，默认剩余预算的 ROUTE_ATTEMPT_SHARE)，
+    挂起的候选不会耗尽总预算；只有总预算用完时才停止切换。
+    """
+    if not req.messages:
+        return respond(ChatResponse.model_construct(success=False, message="messages 不能为空"))
+    if not req.candidates:
+        return respond(ChatResponse.model_construct(success=False, message="candidates 不能为空"))
+    
+    ordered = router.order(req.candidates, req.routing)
+    
+    start = time.time()
+    deadline = Deadline.from_request(req.timeout, TIMEOUT_CHAT)
+    errors: List[str] = []
+    attempts = ordered[:req.max_attempts or len(ordered)]
+    for attempt, c in enumerate(attempts, start=1):
+        if deadline.remaining() <= 0:
+            errors.append(f"请求超过截止时间 ({deadline.total:g}秒)")
+            break
+        attempt_start = time.monotonic()
+        last = attempt == len(attempts)
+        budget = req.attempt_timeout or (deadline.remaining() if last else deadline.remaining() * ROUTE_ATTEMPT_SHARE)
+        with track("/chat/route", c.api_format, c.base_url) as tracker:
+            try:
+                result = await cancel_on_disconnect(request, send_chat_request(
+                    c.api_format, c.base_url, c.api_key, c.model, req.messages, req.max_tokens, deadline=deadline.child(budget),
+                ))
+            except Exception as e:
+                mark_failed(tracker, e)
+                errors.append(f"[{c.provider_id}/{c.model}] {format_error(e)}")
+                if isinstance(e, ClientDisconnected):
+                    break
+                router.record(c, time.monotonic() - attempt_start, ok=False)
+                # 单次尝试超时 (总预算尚有剩余) 与上游超时一样切换到下一个候选
+                if is_failover_error(e) or isinstance(e, DeadlineExceeded):
+                    continue
+                break
+            tracker.record_usage(result.usage)
+        router.record(c, time.monotonic() - attempt_start, ok=True)
+        return respond(ChatResponse.model_construct(
             success=True, content=result.content, model=result.model, usage=result.usage,
-            latency_ms=int((time.time() - start) * 1000), raw_response=result.raw_response
-        )
-    except Exception as e:
-        return ChatResponse(success=False, latency_ms=int((time.time() - start) * 1000), message=format_error(e))
+            latency_ms=int((time.time() - start) * 1000),
+            raw_response=select_raw(result.raw_response, req.include_raw, req.raw_fields),
+            served_by={"provider_id": c.provider_id, "model": c.model, "base_url": c.base_url,
+                       "api_format": c.api_format, "attempts": attempt},
+        ))
+    
+    return respond(ChatResponse.model_construct(success=False, latency_ms=int((time.time() - start) * 1000), message="; ".join(errors)))
 
 
-@app.post("/models", response_model=FetchModelsResponse, tags=["Proxy"])
-async def fetch_models(req: FetchModelsRequest):
-    """获取模型列表"""
-    try:
-        strategy = get_strategy(req.api_format)
-        if not strategy.supports_models_api:
-            return FetchModelsResponse(success=False, models=[], message=f"{req.api_format} 不支持动态获取模型列表")
+@app.post("/chat/stream", tags=["Proxy"])
+async def chat_stream(req: ChatRequest):
+    """
+    流式聊天 (Server-Sent Events)
+    
+    帧格式: delta {"content"} ... -> usage {"model", "usage", "latency_ms", "ttft_ms"}；出错时为 error {"message"}
+    客户端断开时 StreamingResponse 会取消生成器，上游流随之关闭。
+    """
+    async def events():
+        if not req.messages:
+            yield sse_event({"type": "error", "message": "messages 不能为空"})
+            return
         
-        async with httpx.AsyncClient(timeout=TIMEOUT_MODELS) as client:
-            models = await strategy.fetch_models(client, req.base_url, req.api_key or "")
+        start = time.time()
+        ttft_ms = None
+        with track("/chat/stream", req.api_format, req.base_url) as tracker:
+            try:
+                async for frame in stream_chat_request(req.api_format, req.base_url, req.api_key, req.model, req.messages, req.max_tokens,
+                                                       deadline=Deadline.from_request(req.timeout, TIMEOUT_CHAT)):
+                    if frame["type"] == "delta" and ttft_ms is None:
+                        ttft_ms = int((time.time() - start) * 1000)
+                    if frame["type"] == "usage":
+                        tracker.record_usage(frame["usage"])
+                        frame = {**frame, "latency_ms": int((time.time() - start) * 1000), "ttft_ms": ttft_ms}
+                    yield sse_event(frame)
+            except Exception as e:
+                mark_failed(tracker, e)
+                yield sse_event({"type": "error", "message": format_error(e)})
+    
+    # 关闭反向代理 (nginx) 缓冲，保证增量帧即时下发
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def parse_batch_items(body: bytes, content_type: str, query: Dict[str, str]) -> Tuple[List[Any], BatchChatOptions]:
+    """
+    解析 /chat/batch 请求体，返回 (条目, 批量选项)
+    
+    JSON 请求体与 JSONL 的查询参数使用同一套选项校验 (BatchChatOptions)，查询参数覆盖请求体中的值。
+    JSONL 中无法解析的行不会使整个批量失败，而是作为该行的错误 (ValueError) 返回。
+    """
+    option_names = BatchChatOptions.model_fields.keys()
+    overrides = BatchChatOptions.model_validate({name: value for name, value in query.items() if name in option_names})
+    if content_type.split(";")[0].strip().lower() not in JSONL_MEDIA_TYPES:
+        req = BatchChatRequest.model_validate_json(body)
+        options = BatchChatOptions.model_validate(req.model_dump(include=set(option_names)))
+        return req.items, options.model_copy(update=overrides.model_dump(exclude_unset=True))
+    
+    items: List[Any] = []
+    for line_no, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            items.append(BatchChatItem.model_validate_json(line))
+        except ValidationError as e:
+            items.append(ValueError(f"第 {line_no} 行无效: {e.errors()[0]['msg']}"))
+    return items, overrides
+
+
+@app.post("/chat/batch", tags=["Proxy"])
+async def chat_batch(request: Request):
+    """
+    批量聊天 (离线评测 / 标注任务)
+    
+    请求体为 BatchChatRequest JSON，或 Content-Type: application/x-ndjson 的 JSONL (每行一个条目，
+    批量选项 concurrency / per_origin_concurrency / timeout 通过查询参数传入)。
+    各条目可指向不同的 api_format 与上游，按全局 / 每 origin 并发上限执行 (仍受上游限流器与熔断器约束)，
+    每项完成后立即以 NDJSON 一行返回，最后一行为 BatchChatSummary (成功 / 失败数与 token 用量汇总)。
+    """
+    try:
+        items, options = parse_batch_items(await request.body(), request.headers.get("content-type", ""), dict(request.query_params))
+    except ValidationError as e:
+        # 无法解析的 JSON 为 400，字段值不合法 (选项越界、缺少 items 等) 为 422
+        status = 400 if all(err["type"] == "json_invalid" for err in e.errors()) else 422
+        message = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err["loc"] else err["msg"] for err in e.errors())
+        return respond(ChatResponse.model_construct(success=False, message=f"请求无效: {message}"), status_code=status)
+    if not items:
+        return respond(ChatResponse.model_construct(success=False, message="items 不能为空"), status_code=400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return respond(ChatResponse.model_construct(success=False, message=f"items 最多 {BATCH_MAX_ITEMS} 个"), status_code=413)
+    
+    concurrency = min(options.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    per_origin = min(options.per_origin_concurrency or BATCH_PER_ORIGIN_CONCURRENCY, concurrency)
+    item_timeout = options.timeout or TIMEOUT_CHAT
+    
+    async def run_item(index: int, item: Any) -> BatchChatResult:
+        if isinstance(item, Exception):
+            return BatchChatResult.model_construct(index=index, success=False, error_class="invalid_request", message=str(item))
+        start = time.time()
+        with track("/chat/batch", item.api_format, item.base_url) as tracker:
+            try:
+                if not item.messages:
+                    raise ValueError("messages 不能为空")
+                # 截止时间从条目真正开始执行时计算 (不含等待批量并发名额的时间)
+                result, lookup_ms = await cached_chat_request(item, default_timeout=item_timeout)
+                if lookup_ms is None:
+                    tracker.record_usage(result.usage)
+                return BatchChatResult.model_construct(
+                    index=index, id=item.id, provider_id=item.provider_id, model=result.model or item.model, success=True,
+                    content=result.content, usage=result.usage, latency_ms=int((time.time() - start) * 1000),
+                    status_code=200, raw_response=select_raw(result.raw_response, item.include_raw, item.raw_fields), cached=lookup_ms is not None,
+                )
+            except Exception as e:
+                mark_failed(tracker, e)
+                return BatchChatResult.model_construct(
+                    index=index, id=item.id, provider_id=item.provider_id, model=item.model, success=False,
+                    latency_ms=int((time.time() - start) * 1000), status_code=error_status(e), error_class=classify_error(e),
+                    message=format_error(e),
+                )
+    
+    def origin_key(item: Any) -> str:
+        return origin_of(item.base_url) if isinstance(item, BatchChatItem) else ""
+    
+    async def lines():
+        start = time.time()
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        error_classes: Dict[str, int] = {}
+        succeeded = cached = 0
+        async for result in run_bounded(items, run_item, origin_key, concurrency, per_origin):
+            if result.success:
+                succeeded += 1
+                cached += result.cached
+                for k in usage:
+                    usage[k] += (result.usage or {}).get(k, 0)
+            else:
+                error_classes[result.error_class] = error_classes.get(result.error_class, 0) + 1
+            yield dumps(dict(result.__dict__)) + b"\n"
+        yield dumps(dict(BatchChatSummary.model_construct(
+            total=len(items), succeeded=succeeded, failed=len(items) - succeeded, cached=cached, usage=usage,
+            error_classes=error_classes, latency_ms=int((time.time() - start) * 1000),
+        ).__dict__)) + b"\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.websocket("/ws")
+async def websocket_mux(websocket: WebSocket):
+    """
+    WebSocket 多路复用 (协议见 multiplex.py)
+    
+    chat 请求按 /chat/stream 的帧格式流式返回，test 请求返回一个 result 帧。
+    WebSocket 不经过 HTTP 中间件，每个请求在处理时单独做准入控制与 Origin 校验。
+    """
+    origin = websocket.headers.get("origin")
+    if origin and "*" not in _cors_origins and origin not in _cors_origins:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    
+    async def chat(payload: Dict[str, Any], send: Send) -> None:
+        req = ChatRequest.model_validate(payload)
+        if not req.messages:
+            raise ValueError("messages 不能为空")
+        start = time.time()
+        ttft_ms = None
+        with track("/ws", req.api_format, req.base_url) as tracker:
+            try:
+                async with admission.admitted("chat"):
+                    async for frame in stream_chat_request(req.api_format, req.base_url, req.api_key, req.model, req.messages, req.max_tokens,
+                                                           deadline=Deadline.from_request(req.timeout, TIMEOUT_CHAT)):
+                        if frame["type"] == "delta" and ttft_ms is None:
+                            ttft_ms = int((time.time() - start) * 1000)
+                        if frame["type"] == "usage":
+                            tracker.record_usage(frame["usage"])
+                            frame = {**frame, "latency_ms": int((time.time() - start) * 1000), "ttft_ms": ttft_ms}
+                        # 客户端读得慢时在此等待，上游流随之暂停读取
+                        await send(frame)
+            except Exception as e:
+                mark_failed(tracker, e)
+                raise
+    
+    async def test(payload: Dict[str, Any], send: Send) -> None:
+        req = ChatRequest.model_validate(payload)
+        start = time.time()
+        with track("/ws", req.api_format, req.base_url) as tracker:
+            try:
+                async with admission.admitted("test"):
+                    await send_chat_request(
+                        req.api_format, req.base_url, req.api_key, req.model, [{"role": "user", "content": "Hi"}], None,
+                        hedge=HEDGE_ENABLED if req.hedge is None else req.hedge,
+                        deadline=Deadline.from_request(req.timeout, TIMEOUT_CHAT),
+                    )
+                await send({"type": "result", "success": True, "latency_ms": int((time.time() - start) * 1000), "message": "连接成功"})
+            except Exception as e:
+                mark_failed(tracker, e)
+                await send({"type": "result", "success": False, "latency_ms": 0, "message": format_error(e), "error_class": classify_error(e)})
+    
+    def describe_error(e: Exception) -> Dict[str, Any]:
+        if isinstance(e, ValidationError):
+            detail = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            return {"message": f"请求参数无效: {detail}", "error_class": "invalid_request"}
+        return {"message": format_error(e), "error_class": classify_error(e)}
+    
+    await Multiplexer(websocket, {"chat": chat, "test": test}, describe_error).serve()
+
+
+@app.post("/sessions", response_model=SessionResponse, tags=["Sessions"])
+async def create_session(req: CreateSessionRequest):
+    """创建会话，之后通过 /sessions/chat 只发送新增消息"""
+    try:
+        get_strategy(req.api_format)
+    except ValueError as e:
+        return respond(SessionResponse.model_construct(success=False, message=str(e)))
+    session = sessions.create(
+        provider_id=req.provider_id, api_key=req.api_key, model=req.model, base_url=req.base_url,
+        api_format=req.api_format, max_tokens=req.max_tokens,
+        token_budget=SESSION_TOKEN_BUDGET if req.token_budget is None else req.token_budget,
+    )
+    if req.messages:
+        sessions.append(session, req.messages)
+    return respond(SessionResponse.model_construct(success=True, session_id=session.id, message_count=len(session.messages)))
+
+
+@app.delete("/sessions/{session_id}", response_model=SessionResponse, tags=["Sessions"])
+async def delete_session(session_id: str):
+    """删除会话"""
+    if not sessions.delete(session_id):
+        return respond(SessionResponse.model_construct(success=False, session_id=session_id, message="会话不存在或已过期"))
+    return respond(SessionResponse.model_construct(success=True, session_id=session_id))
+
+
+@app.post("/sessions/chat", response_model=ChatResponse, tags=["Sessions"])
+async def session_chat(req: SessionChatRequest, request: Request):
+    """
+    会话聊天
+    
+    历史由服务端保存: 本轮消息追加到历史后 (按 token 预算截断) 发往上游，
+    成功时本轮消息与助手回复写入历史；失败时历史不变，客户端可直接重试。
+    """
+    if not req.messages:
+        return respond(ChatResponse.model_construct(success=False, message="messages 不能为空"))
+    session = sessions.get(req.session_id)
+    if session is None:
+        return respond(ChatResponse.model_construct(success=False, message="会话不存在或已过期"))
+    
+    start = time.time()
+    deadline = Deadline.from_request(req.timeout, TIMEOUT_CHAT)
+    with track("/sessions/chat", session.api_format, session.base_url) as tracker:
+        try:
+            # 等锁 (同一会话的上一轮) 与上游请求共用同一个截止时间
+            async with session.locked(deadline):
+                messages, truncated = session.history(req.messages)
+                result = await cancel_on_disconnect(request, send_chat_request(
+                    session.api_format, session.base_url, session.api_key, session.model, messages,
+                    req.max_tokens or session.max_tokens, deadline=deadline,
+                ))
+                sessions.append(session, req.messages + [{"role": "assistant", "content": result.content}])
+            tracker.record_usage(result.usage)
+        except Exception as e:
+            mark_failed(tracker, e)
+            return respond(ChatResponse.model_construct(success=False, latency_ms=int((time.time() - start) * 1000), message=format_error(e)))
+    return respond(ChatResponse.model_construct(
+        success=True, content=result.content, model=result.model, usage=result.usage,
+        latency_ms=int((time.time() - start) * 1000),
+        raw_response=select_raw(result.raw_response, req.include_raw, req.raw_fields),
+        session={"id": session.id, "messages": len(session.messages), "truncated": truncated},
+    ))
+
+
+@app.post("/models", response_model=FetchModelsResponse, tags=["Proxy"])
+async def fetch_models(req: FetchModelsRequest, request: Request):
+    """获取模型列表 (支持 If-None-Match -> 304)"""
+    with track("/models", req.api_format, req.base_url) as tracker:
+        try:
+            strategy = get_strategy(req.api_format)
+            if not strategy.supports_models_api:
+                return respond(FetchModelsResponse.model_construct(success=False, models=[], message=f"{req.api_format} 不支持动态获取模型列表"))
             
-            # 按创建时间倒序排列（新的在前）
-            models_sorted = sorted(
-                models,
-                key=lambda m: (m.get('created', 0) if isinstance(m, dict) else 0, m.get('id', '')),
-                reverse=True
-            )
+            deadline = Deadline.from_request(req.timeout, TIMEOUT_MODELS)
             
-            return FetchModelsResponse(success=True, models=models_sorted)
-    except Exception as e:
-        return FetchModelsResponse(success=False, models=[], message=format_error(e))
+            async def load():
+                with client_pool.borrow(req.base_url) as client:
+                    
+                    async def attempt():
+                        async with breakers.guard(req.api_format, req.base_url, deadline.at):
+                            return await limiters.call(
+                                req.base_url,
+                                lambda: strategy.fetch_models(client, req.base_url, req.api_key or "", timeout=deadline.httpx_timeout()),
+                                deadline=deadline.at,
+                                key=key_scope(req.api_key or ""),
+                            )
+                    
+                    hedge = HEDGE_ENABLED if req.hedge is None else req.hedge
+                    models = await with_deadline(hedger.run("models", req.base_url, attempt) if hedge else attempt(), deadline)
+                
+                # 按创建时间倒序排列（新的在前），排序结果直接进入缓存
+                models_sorted = sorted(
+                    models,
+                    key=lambda m: (m.get('created', 0) if isinstance(m, dict) else 0, m.get('id', '')),
+                    reverse=True
+                )
+                return models_sorted
+            
+            # 共享的拉取任务被 shield 保护: 单个客户端断开只取消它自己的等待，结果仍写入缓存
+            key = cache_key(req.api_format, req.base_url, req.api_key)
+            models_sorted = await cancel_on_disconnect(request, models_cache.get_or_fetch(key, load, deadline.total))
+            # 缓存命中 (含其他 worker 写入的共享缓存) 同样写入索引，索引淘汰的分区在下次 /models 时恢复
+            model_index.update(index_scope(req.base_url, req.api_key or ""), req.provider_id, models_sorted)
+            # ETag 覆盖整个响应体；客户端按服务端缓存的剩余新鲜期缓存，过期后带 If-None-Match 重新验证
+            return conditional_response(
+                request,
+                dict(FetchModelsResponse.model_construct(success=True, models=models_sorted).__dict__),
+                cache_control(models_cache.fresh_for(key), models_cache.stale_ttl),
+            )
+        except Exception as e:
+            mark_failed(tracker, e)
+            return respond(FetchModelsResponse.model_construct(success=False, models=[], message=format_error(e)))
+
+
+@app.post("/models/search", response_model=ModelSearchResponse, tags=["Proxy"])
+async def search_models(req: ModelSearchRequest):
+    """
+    跨 provider 搜索模型
+    
+    只搜索 sources 中各凭据通过 /models 拉取过的列表 (其他 API Key 拉取的列表不可见)；
+    按匹配程度 (精确 > 前缀 > 子串 > 模糊) 与创建时间排序，用返回的 next_cursor 翻页。
+    """
+    catalogs = [(index_scope(s.base_url, s.api_key or ""), s.provider_id) for s in req.sources]
+    try:
+        models, next_cursor, total = model_index.search(
+            catalogs, req.query, req.providers, req.created_after, req.created_before,
+            limit=max(1, min(req.limit, 500)), cursor=req.cursor,
+        )
+    except ValueError as e:
+        return respond(ModelSearchResponse.model_construct(success=False, models=[], total=0, next_cursor=None, message=str(e)))
+    return respond(ModelSearchResponse.model_construct(success=True, models=models, total=total, next_cursor=next_cursor))
 
 
 # ============================================================================
@@ -0,0 +1,228 @@
+"""
+服务端会话
+
+客户端先用完整配置 (provider / model / 凭据) 创建会话，之后每轮只发送新增的消息，
+历史由代理保存，避免长对话中请求体与校验开销随轮数线性增长。
+
+存储为进程内 LRU:
+- 会话数上限、空闲过期
+- 按消息内容估算内存占用，超出总字节数上限时淘汰最久未使用的会话
+- 单个会话保留的消息条数上限 (超出时丢弃最早的非 system 消息)
+
+发往上游的历史可按 token 预算截断 (按字符数粗略估算，不依赖 tokenizer)。
+
+环境变量:
+    SESSION_MAX_SESSIONS  - 会话数上限 (默认 1000)
+    SESSION_IDLE_TTL      - 空闲过期时间，秒 (默认 1800)
+    SESSION_MAX_BYTES     - 所有会话历史的总字节数上限 (默认 64MB)
+    SESSION_MAX_MESSAGES  - 单个会话保留的消息条数上限 (默认 500)
+    SESSION_TOKEN_BUDGET  - 发往上游的历史 token 预算 (默认 0，不截断；创建会话时可单独指定)
+"""
+
+import asyncio
+import math
+import os
+import secrets
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from deadline import Deadline, DeadlineExceeded
+from metrics import registry
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "500"))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "0"))
+
+CHARS_PER_TOKEN = 4          # token 估算: 约 4 个字符 1 个 token
+MESSAGE_TOKEN_OVERHEAD = 4   # 每条消息的角色 / 分隔符开销
+
+SESSIONS_ACTIVE = registry.gauge("proxy_sessions_active", "当前会话数")
+SESSIONS_BYTES = registry.gauge("proxy_sessions_bytes", "会话历史占用的估算字节数")
+SESSION_EVICTIONS = registry.counter("proxy_session_evictions_total", "会话淘汰次数 (reason: idle / capacity / bytes)", ("reason",))
+
+
+def message_bytes(message: Dict[str, str]) -> int:
+    """单条消息的估算内存占用"""
+    return sum(len(k) + len(v.encode("utf-8")) for k, v in message.items())
+
+
+def estimate_tokens(message: Dict[str, str]) -> int:
+    return math.ceil(len(message.get("content", "")) / CHARS_PER_TOKEN) + MESSAGE_TOKEN_OVERHEAD
+
+
+def truncate_to_budget(messages: List[Dict[str, str]], budget: int) -> Tuple[List[Dict[str, str]], int]:
+    """
+    按 token 预算截断历史，返回 (截断后的消息, 丢弃条数)
+
+    system 消息始终保留；其余消息从最早的开始丢弃，但最后一条消息 (本轮输入) 始终保留，
+    且截断后的历史从 user 消息开始。
+    """
+    if budget <= 0:
+        return messages, 0
+    system = [m for m in messages if m.get("role") == "system"]
+    rest = [m for m in messages if m.get("role") != "system"]
+    used = sum(estimate_tokens(m) for m in system)
+    kept: List[Dict[str, str]] = []
+    for m in reversed(rest):
+        cost = estimate_tokens(m)
+        if kept and used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+    # 部分上游要求 system 之后的第一条消息来自 user
+    while len(kept) > 1 and kept[0].get("role") != "user":
+        kept.pop(0)
+    return system + kept, len(rest) - len(kept)
+
+
+# ============================================================================
+# 会话存储
+# ============================================================================
+
+@dataclass
+class Session:
+    """一个会话: 上游配置 + 消息历史"""
+    id: str
+    provider_id: str
+    api_key: str
+    model: str
+    base_url: str
+    api_format: str
+    max_tokens: Optional[int] = None
+    token_budget: int = SESSION_TOKEN_BUDGET
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    bytes: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # 同一会话的多轮请求串行执行
+
+    def history(self, new_messages: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], int]:
+        """本轮发往上游的消息 (历史 + 新消息，按 token 预算截断)"""
+        return truncate_to_budget(self.messages + new_messages, self.token_budget)
+
+    @asynccontextmanager
+    async def locked(self, deadline: Deadline) -> AsyncIterator[None]:
+        """在请求截止时间内获取会话锁 (前一轮卡住时本轮抛出 DeadlineExceeded，而不是无限排队)"""
+        waiter = asyncio.ensure_future(self.lock.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(0.0, deadline.remaining()))
+        except BaseException as e:
+            waiter.cancel()
+            # 超时 / 取消的同时已拿到锁: 归还，避免会话被永久锁住
+            if waiter.done() and not waiter.cancelled():
+                self.lock.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded(f"等待会话上一轮请求完成超过截止时间 ({deadline.total:g}秒)") from None
+            raise
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+
+class SessionStore:
+    """会话 LRU 存储 (会话数 / 总字节数上限 + 空闲过期)"""
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_bytes: int = SESSION_MAX_BYTES,
+        max_messages: int = SESSION_MAX_MESSAGES,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.bytes = 0
+        self.created = 0
+        self.evictions: Dict[str, int] = {}
+
+    def create(self, **config: Any) -> Session:
+        self._evict_idle()
+        session = Session(id=secrets.token_urlsafe(16), **config)
+        self._sessions[session.id] = session
+        self.created += 1
+        while len(self._sessions) > self.max_sessions:
+            self._evict_oldest("capacity")
+        self._update_gauges()
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        self._evict_idle()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.bytes -= session.bytes
+        self._update_gauges()
+        return True
+
+    def append(self, session: Session, messages: List[Dict[str, str]]) -> None:
+        """追加消息并更新内存占用；会话已被淘汰时忽略"""
+        if self._sessions.get(session.id) is not session:
+            return
+        for m in messages:
+            session.messages.append(m)
+            size = message_bytes(m)
+            session.bytes += size
+            self.bytes += size
+        # 超出条数上限时丢弃最早的非 system 消息
+        while len(session.messages) > self.max_messages:
+            index = next((i for i, m in enumerate(session.messages) if m.get("role") != "system"), None)
+            if index is None:
+                break
+            size = message_bytes(session.messages.pop(index))
+            session.bytes -= size
+            self.bytes -= size
+        while self.bytes > self.max_bytes and len(self._sessions) > 1:
+            # 当前会话刚被使用，位于 LRU 末尾，最后才会被淘汰
+            self._evict_oldest("bytes")
+        self._update_gauges()
+
+    def _evict_idle(self) -> None:
+        # OrderedDict 按最近使用排序，只需从头部检查
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= cutoff:
+                break
+            self._evict_oldest("idle")
+        self._update_gauges()
+
+    def _evict_oldest(self, reason: str) -> None:
+        _, session = self._sessions.popitem(last=False)
+        self.bytes -= session.bytes
+        self.evictions[reason] = self.evictions.get(reason, 0) + 1
+        SESSION_EVICTIONS.inc(reason=reason)
+
+    def _update_gauges(self) -> None:
+        SESSIONS_ACTIVE.set(len(self._sessions))
+        SESSIONS_BYTES.set(self.bytes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "idle_ttl": self.idle_ttl,
+            "created": self.created,
+            "evictions": dict(self.evictions),
+        }
@@ -0,0 +1,422 @@
+"""
+跨 worker 进程的共享状态
+
+以 uvicorn --workers N 运行时，每个进程各自持有模型列表缓存、上游限流状态和指标，
+导致上游 /models 被重复拉取 N 次、限流预算偏大 N 倍、各 worker 的 /metrics 互不一致。
+这里提供可插拔的共享状态后端，由各组件在内部使用，端点代码无需改动:
+
+- 模型列表缓存: 本进程未命中时先读共享缓存，拉取后写回；跨进程的并发未命中通过短期锁键合并为一次上游请求
+- 上游限流: Retry-After 暂停在 worker 之间传播；各 worker 发布自己学到的并发上限，取最小值作为该 origin 的总预算，按存活 worker 数均分
+- 指标: 每个 worker 定期发布指标快照，/metrics 汇总所有存活 worker (counter / histogram 相加，gauge 按 worker 标签区分)；
+  退出的 worker 的最后快照保留在退役记录中继续计入 (正常停止时自己写入，崩溃时由其他 worker 用最后看到的快照代写)，
+  汇总的 counter 不会因 worker 退出而回退
+
+除模型列表缓存在未命中时直接读写后端外，其余状态由后台任务每 STATE_SYNC_INTERVAL 秒同步一次，
+请求路径上不访问后端。聊天响应缓存的 SQLite 层本身即为多进程共享，不经过这里。
+
+后端 (STATE_BACKEND):
+    memory                 - 进程内 (默认，与单 worker 行为相同)
+    sqlite:///path/to/file - 同一主机上的 worker 共享一个 SQLite 文件 (WAL 模式)
+    redis://host:port/db   - Redis 协议兼容服务 (Redis / Valkey / KeyDB 或本地替代实现，需安装 redis 包)
+
+环境变量:
+    STATE_BACKEND        - 共享状态后端 (默认 memory)
+    STATE_SYNC_INTERVAL  - 后台同步间隔，秒 (默认 1)
+    STATE_KEY_PREFIX     - 键前缀 (默认 proxy:)，多个部署共用一个 Redis 时用于区分
+    STATE_MAX_TOMBSTONES - 退役记录单独保留的 worker 数 (默认 64)，更早退出的 worker 合并为一份累计值
+"""
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import Registry, registry
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis 为可选依赖，只有 STATE_BACKEND=redis://... 时需要
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "1"))
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "proxy:")
+STATE_MAX_TOMBSTONES = int(os.getenv("STATE_MAX_TOMBSTONES", "64"))
+
+RETIRED_KEY = "metrics_retired"          # 不在 metrics: 前缀下，扫描存活 worker 时不会读到
+RETIRED_TTL = 10 * 365 * 86400.0         # 退役记录不应过期 (后端接口要求 ttl)
+RETIRE_LOCK_TTL = 5.0
+RETIRE_ATTEMPTS = 20                     # 停止时获取退役记录锁的尝试次数 (间隔 50ms)
+
+SyncHook = Callable[[], Awaitable[None]]
+
+
+# ============================================================================
+# 后端
+# ============================================================================
+
+class StateBackend(ABC):
+    """键值存储接口 (Redis 命令的最小子集)，过期时间 ttl 单位为秒"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def set_nx(self, key: str, value: bytes, ttl: float) -> bool:
+        """键不存在 (或已过期) 时写入并返回 True"""
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        """值仍为 value 时删除 (原子的 compare-and-delete)，删除了返回 True"""
+        pass
+
+    @abstractmethod
+    async def scan(self, prefix: str) -> Dict[str, bytes]:
+        """返回所有以 prefix 开头的未过期键值"""
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """进程内存储 (单 worker 或测试用)"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, float]] = {}
+
+    def _live(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] <= time.time():
+            del self._data[key]
+            return None
+        return item[0]
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data[key] = (value, time.time() + ttl)
+
+    async def set_nx(self, key: str, value: bytes, ttl: float) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._data[key] = (value, time.time() + ttl)
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        if self._live(key) != value:
+            return False
+        del self._data[key]
+        return True
+
+    async def scan(self, prefix: str) -> Dict[str, bytes]:
+        result = {}
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            value = self._live(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+
+class SQLiteBackend(StateBackend):
+    """
+    同一主机上多个进程共享的 SQLite 文件 (所有操作在线程池中执行)
+
+    server 在导入时创建 SharedState，连接推迟到第一次访问 (在线程池中) 才建立，
+    导入模块不会打开文件或在事件循环中执行建表等同步 IO。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # 调用方持有 self._lock
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS state_expires ON state (expires_at)")
+            self._db = db
+        return self._db
+
+    def _fetch(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def _write(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            return self._connection().execute(sql, params).rowcount
+
+    async def get(self, key: str) -> Optional[bytes]:
+        rows = await asyncio.to_thread(self._fetch, "SELECT value FROM state WHERE key = ? AND expires_at > ?", (key, time.time()))
+        return rows[0][0] if rows else None
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await asyncio.to_thread(self._write, "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+
+    async def set_nx(self, key: str, value: bytes, ttl: float) -> bool:
+        now = time.time()
+        # 单条 UPSERT 语句是原子的: 键不存在时插入，已过期时覆盖，否则不变
+        changed = await asyncio.to_thread(
+            self._write,
+            "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at WHERE state.expires_at <= ?",
+            (key, value, now + ttl, now),
+        )
+        return changed > 0
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._write, "DELETE FROM state WHERE key = ?", (key,))
+
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        return await asyncio.to_thread(self._write, "DELETE FROM state WHERE key = ? AND value = ?", (key, value)) > 0
+
+    async def scan(self, prefix: str) -> Dict[str, bytes]:
+        def query() -> List[tuple]:
+            now = time.time()
+            self._write("DELETE FROM state WHERE expires_at <= ?", (now,))
+            # 按字典序范围查询以利用主键索引
+            return self._fetch("SELECT key, value FROM state WHERE key >= ? AND key < ? AND expires_at > ?", (prefix, prefix + "\uffff", now))
+        return dict(await asyncio.to_thread(query))
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class RedisBackend(StateBackend):
+    """Redis 协议兼容服务"""
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise RuntimeError("STATE_BACKEND 使用 redis 需要安装 redis 包 (pip install redis)")
+        self._client = aioredis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def set_nx(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self._client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        return bool(await self._client.eval(_DELETE_IF_SCRIPT, 1, key, value))
+
+    async def scan(self, prefix: str) -> Dict[str, bytes]:
+        keys = [key async for key in self._client.scan_iter(match=_glob_escape(prefix) + "*", count=500)]
+        if not keys:
+            return {}
+        values = await self._client.mget(keys)
+        return {(k.decode() if isinstance(k, bytes) else k): v for k, v in zip(keys, values) if v is not None}
+
+    async def close(self) -> None:
+        # redis>=5 提供 aclose()，旧版本为 close()
+        close = getattr(self._client, "aclose", None) or self._client.close
+        await close()
+
+
+# GET 与 DEL 在服务端一次执行，期间不会有其他客户端修改该键
+_DELETE_IF_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def _glob_escape(text: str) -> str:
+    return "".join("\\" + ch if ch in "*?[]\\" else ch for ch in text)
+
+
+def create_backend(url: str) -> StateBackend:
+    """按 STATE_BACKEND 创建后端"""
+    if not url or url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite://"):
+        return SQLiteBackend(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url[len("sqlite://"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"不支持的 STATE_BACKEND: {url}")
+
+
+# ============================================================================
+# 共享状态
+# ============================================================================
+
+class SharedState:
+    """带键前缀的后端访问 + worker 心跳 + 后台同步任务"""
+
+    def __init__(self, backend: Optional[StateBackend] = None, prefix: str = STATE_KEY_PREFIX, sync_interval: float = STATE_SYNC_INTERVAL,
+                 metrics: Optional[Registry] = None):
+        self.backend = backend or create_backend(STATE_BACKEND)
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self.metrics = metrics or registry
+        # 容器重启后 pid 可能复用，加随机后缀，避免新进程被当作已退役的旧进程
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self.workers = 1
+        self.sync_errors = 0
+        self._hooks: List[SyncHook] = []
+        self._task: Optional[asyncio.Task] = None
+        self._peer_snapshots: Dict[str, Dict[str, Any]] = {}   # 上次同步看到的其他 worker 快照 {"at", "metrics"}
+        self._retiring: Dict[str, Dict[str, Any]] = {}         # 待写入退役记录的快照 (未拿到锁时下次同步重试)
+
+    @property
+    def enabled(self) -> bool:
+        """是否跨进程共享 (进程内后端时各组件保持原有行为)"""
+        return not isinstance(self.backend, MemoryBackend)
+
+    async def get_json(self, key: str) -> Any:
+        value = await self.backend.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: float) -> None:
+        await self.backend.set(self.prefix + key, json.dumps(value, separators=(",", ":")).encode("utf-8"), ttl)
+
+    async def try_lock(self, key: str, ttl: float) -> Optional[str]:
+        """获取锁键，成功时返回本次持有的令牌 (释放时凭令牌确认锁仍归自己)，失败返回 None"""
+        token = f"{self.worker_id}:{secrets.token_hex(4)}"
+        if await self.backend.set_nx(self.prefix + key, token.encode("utf-8"), ttl):
+            return token
+        return None
+
+    async def unlock(self, key: str, token: str) -> None:
+        """释放锁键；锁已过期并被其他 worker 重新获取时不删除 (compare-and-delete)"""
+        await self.backend.delete_if(self.prefix + key, token.encode("utf-8"))
+
+    async def scan_json(self, prefix: str) -> Dict[str, Any]:
+        """返回 prefix 下的 {去掉前缀后的键: 值}"""
+        full = self.prefix + prefix
+        return {key[len(full):]: json.loads(value) for key, value in (await self.backend.scan(full)).items()}
+
+    def on_sync(self, hook: SyncHook) -> None:
+        """注册在每次后台同步时执行的回调"""
+        self._hooks.append(hook)
+
+    def start(self) -> None:
+        if self.enabled:
+            self.metrics.worker = self.worker_id
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            try:
+                # 最后的指标写入退役记录；拿不到锁时由其他 worker 用上次同步的快照代写
+                self._retiring[self.worker_id] = {"at": time.time(), "metrics": self.metrics.snapshot()}
+                for _ in range(RETIRE_ATTEMPTS):
+                    await self._retire(set(self._peer_snapshots))
+                    if not self._retiring:
+                        break
+                    await asyncio.sleep(0.05)
+                # 立即注销，其他 worker 无需等心跳过期就能收回并发预算
+                await self.backend.delete(self.prefix + "workers:" + self.worker_id)
+                await self.backend.delete(self.prefix + "metrics:" + self.worker_id)
+            except Exception as e:
+                logger.warning("注销共享状态 worker 失败: %s", e)
+        await self.backend.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                # 后端暂时不可用时各组件继续使用本进程状态
+                self.sync_errors += 1
+                logger.warning("共享状态同步失败: %s", e)
+            await asyncio.sleep(self.sync_interval)
+
+    async def sync(self) -> None:
+        ttl = self.sync_interval * 3
+        await self.set_json("workers:" + self.worker_id, time.time(), ttl)
+        self.workers = max(1, len(await self.scan_json("workers:")))
+        await self.set_json("metrics:" + self.worker_id, {"at": time.time(), "metrics": self.metrics.snapshot()}, ttl)
+        peers = {w: s for w, s in (await self.scan_json("metrics:")).items() if w != self.worker_id}
+        # 心跳过期的 worker (崩溃 / 被杀) 不会自己写退役记录，用上次看到的快照代写
+        for worker, published in self._peer_snapshots.items():
+            if worker not in peers:
+                self._retiring[worker] = published
+        self._peer_snapshots = peers
+        live = set(peers) | {self.worker_id}
+        record = await self._retire(live)
+        retired = self.metrics.merge_snapshots({}, record["folded"])
+        for worker, published in record["workers"].items():
+            if worker not in live:
+                retired = self.metrics.merge_snapshots(retired, published["metrics"])
+        self.metrics.peers = {w: s["metrics"] for w, s in peers.items()}
+        self.metrics.retired = retired
+        for hook in self._hooks:
+            await hook()
+
+    async def _retire(self, live: Set[str]) -> Dict[str, Any]:
+        """
+        把待退役的快照写入共享的退役记录，返回当前记录
+
+        记录为 {"workers": {worker id: {"at", "metrics"}}, "folded": 快照}；同一 worker 只保留最新的快照
+        (正常停止时自己写入的最终快照比其他 worker 代写的新)。超出 STATE_MAX_TOMBSTONES 时最早的
+        非存活 worker 合并进 folded。读-改-写在锁内进行，拿不到锁时保留待写内容，下次同步重试。
+        """
+        token = await self.try_lock(RETIRED_KEY + ":lock", RETIRE_LOCK_TTL) if self._retiring else None
+        if token is None:
+            return await self.get_json(RETIRED_KEY) or {"workers": {}, "folded": {}}
+        try:
+            record = await self.get_json(RETIRED_KEY) or {"workers": {}, "folded": {}}
+            for worker, published in self._retiring.items():
+                current = record["workers"].get(worker)
+                if current is None or published["at"] >= current["at"]:
+                    record["workers"][worker] = published
+            for worker in [w for w in record["workers"] if w not in live][:max(0, len(record["workers"]) - STATE_MAX_TOMBSTONES)]:
+                record["folded"] = self.metrics.merge_snapshots(record["folded"], record["workers"].pop(worker)["metrics"])
+            await self.set_json(RETIRED_KEY, record, RETIRED_TTL)
+            self._retiring.clear()
+            return record
+        finally:
+            await self.unlock(RETIRED_KEY + ":lock", token)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "worker_id": self.worker_id,
+            "workers": self.workers,
+            "sync_interval": self.sync_interval,
+            "sync_errors": self.sync_errors,
+        }
@@ -2,13 +2,64 @@
 聊天策略模式实现
 
 每个 API 格式对应一个策略类，负责构建请求和解析响应。
+
+上游响应体:
+- 边接收边累计字节数，超过 UPSTREAM_MAX_BODY_BYTES 时立即中止 (Content-Length 已超限时不读取响应体)
+- 不小于 UPSTREAM_DECODE_THREAD_BYTES 的响应体在线程池中解码并解析，
+  避免数 MB 的模型列表 / 带大 raw_response 的回复长时间占用事件循环
+
+环境变量:
+    UPSTREAM_MAX_BODY_BYTES       - 上游响应体大小上限，字节 (默认 32 MiB，流式响应按累计字节数计)
+    UPSTREAM_DECODE_THREAD_BYTES  - 在线程池中解码的响应体大小阈值，字节 (默认 256 KiB)
 """
 
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Type, Optional, Tuple
+from typing import Dict, Any, List, Type, Optional, Tuple, AsyncIterator, Callable, TypeVar
+import asyncio
+import json
+import os
+import time
 import httpx
 
-from models import ChatResult
+from models import ChatResult, StreamState
+from model_lists import (
+    MODELS_MAX_PAGES, openai_models_request, parse_openai_models, anthropic_models_request, anthropic_next_models_request,
+    gemini_models_request, parse_gemini_models, gemini_next_models_request,
+)
+from metrics import record_phase
+from timing import record_span, trace_extensions
+
+UPSTREAM_MAX_BODY_BYTES = int(os.getenv("UPSTREAM_MAX_BODY_BYTES", str(32 * 1024 * 1024)))
+UPSTREAM_DECODE_THREAD_BYTES = int(os.getenv("UPSTREAM_DECODE_THREAD_BYTES", str(256 * 1024)))
+
+T = TypeVar("T")
+
+
+class BodyTooLarge(Exception):
+    """上游响应体超过 UPSTREAM_MAX_BODY_BYTES"""
+
+    error_class = "body_too_large"
+
+    def __init__(self, limit: int):
+        super().__init__(f"上游响应体超过 {limit} 字节上限")
+        self.limit = limit
+
+
+def _check_content_length(response: httpx.Response) -> None:
+    """Content-Length 已超出上限时不再读取响应体"""
+    try:
+        length = int(response.headers.get("content-length", ""))
+    except ValueError:
+        return
+    if length > UPSTREAM_MAX_BODY_BYTES:
+        raise BodyTooLarge(UPSTREAM_MAX_BODY_BYTES)
+
+
+def _stream_error_message(error: Any) -> str:
+    """流中途的错误帧 ({"error": {"message": ...}}，OpenAI 兼容与 Gemini 格式相同)"""
+    if isinstance(error, dict):
+        return str(error.get("message") or "stream error")
+    return str(error)
 
 
 # ============================================================================
@@ -41,6 +92,26 @@ class ChatStrategy(ABC):
         """解析聊天响应"""
         pass
     
+    @abstractmethod
+    def parse_stream_event(self, data: Dict[str, Any], state: StreamState) -> str:
+        """
+        解析一个流式事件 (SSE data 中的 JSON)
+        
+        Returns:
+            本事件新增的文本 (无文本时返回空字符串)；用量与模型名写入 state
+        """
+        pass
+    
+    def build_stream_endpoint(self, base_url: str, model: str, api_key: str) -> str:
+        """构建流式聊天请求 URL (默认与非流式相同)"""
+        return self.build_endpoint(base_url, model, api_key)
+    
+    def build_stream_payload(self, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> Dict[str, Any]:
+        """构建流式聊天请求体 (默认在非流式请求体上加 stream 标记)"""
+        payload = self.build_payload(model, messages, max_tokens)
+        payload["stream"] = True
+        return payload
+    
     def build_models_request(self, base_url: str, api_key: str) -> Tuple[str, Dict[str, str]]:
         """
         构建获取模型列表的请求
@@ -49,10 +120,7 @@ class ChatStrategy(ABC):
             (endpoint, headers) 元组
         """
         # 默认实现：OpenAI 兼容格式
-        return (
-            f"{base_url}/models",
-            {"Authorization": f"Bearer {api_key}"} if api_key else {}
-        )
+        return openai_models_request(base_url, api_key)
     
     def parse_models_response(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
@@ -61,18 +129,16 @@ class ChatStrategy(ABC):
         Returns:
             [{"id": "...", "name": "...", "created": ...}, ...]
         """
-        models = []
-        for m in data.get("data", []):
-            model_id = m.get("id")
-            if model_id:
-                # 优先取 name，取不到则将 id 格式化作为 name
-                name = m.get("name") or m.get("display_name") or model_id.split("/")[-1].replace("-", " ").replace("_", " ").title()
-                models.append({
-                    "id": model_id,
-                    "name": name,
-                    "created": m.get("created", 0)  # 保留创建时间用于排序
-                })
-        return models
+        return parse_openai_models(data)
+    
+    def next_models_request(self, base_url: str, api_key: str, data: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        分页的模型列表: 根据当前页响应构建下一页的请求
+        
+        Returns:
+            (endpoint, headers) 元组；没有下一页时返回 None (默认不分页)
+        """
+        return None
     
     async def execute(
         self,
@@ -82,30 +148,140 @@ class ChatStrategy(ABC):
         model: str,
         messages: List[Dict[str, str]],
         max_tokens: Optional[int],
+        timeout: Optional[httpx.Timeout] = None,
     ) -> ChatResult:
         """执行聊天请求 (模板方法)"""
         headers = self.build_headers(api_key)
         endpoint = self.build_endpoint(base_url, model, api_key)
         payload = self.build_payload(model, messages, max_tokens)
         
-        response = await client.post(endpoint, headers=headers, json=payload)
-        response.raise_for_status()
-        return self.parse_response(response.json(), model)
+        body = await self._send(client, "POST", endpoint, headers, payload, timeout)
+        return await self._decode(body, lambda data: self.parse_response(data, model))
+    
+    async def stream(
+        self,
+        client: httpx.AsyncClient,
+        base_url: str,
+        api_key: str,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int],
+        timeout: Optional[httpx.Timeout] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        执行流式聊天请求 (模板方法)
+        
+        Yields:
+            {"type": "delta", "content": "..."}  - 增量文本
+            {"type": "usage", "model": "...", "usage": {...}}  - 结束时的用量帧
+        """
+        headers = self.build_headers(api_key)
+        endpoint = self.build_stream_endpoint(base_url, model, api_key)
+        payload = self.build_stream_payload(model, messages, max_tokens)
+        state = StreamState(model=model)
+        
+        start = time.perf_counter()
+        async with client.stream("POST", endpoint, headers=headers, json=payload, timeout=timeout or httpx.USE_CLIENT_DEFAULT,
+                                 extensions=trace_extensions()) as response:
+            record_phase("upstream_ttfb", time.perf_counter() - start)
+            body_start = time.perf_counter()
+            _check_content_length(response)
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                if response.num_bytes_downloaded > UPSTREAM_MAX_BODY_BYTES:
+                    raise BodyTooLarge(UPSTREAM_MAX_BODY_BYTES)
+                # 只关心 SSE 的 data 行，event/id/注释行由各格式的 JSON type 字段区分
+                if not line.startswith("data:"):
+                    continue
+                raw = line[5:].strip()
+                if not raw or raw == "[DONE]":
+                    continue
+                text = self.parse_stream_event(json.loads(raw), state)
+                if text:
+                    yield {"type": "delta", "content": text}
+            record_phase("upstream_bytes", response.num_bytes_downloaded)
+            record_span("download", body_start, bytes=response.num_bytes_downloaded)
+        
+        usage = state.usage
+        if not usage["total_tokens"]:
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        yield {"type": "usage", "model": state.model, "usage": usage}
     
     async def fetch_models(
         self,
         client: httpx.AsyncClient,
         base_url: str,
         api_key: str,
+        timeout: Optional[httpx.Timeout] = None,
     ) -> List[Dict[str, str]]:
         """获取模型列表"""
         if not self.supports_models_api:
             return []
         
-        endpoint, headers = self.build_models_request(base_url, api_key)
-        response = await client.get(endpoint, headers=headers)
-        response.raise_for_status()
-        return self.parse_models_response(response.json())
+        request: Optional[Tuple[str, Dict[str, str]]] = self.build_models_request(base_url, api_key)
+        models: List[Dict[str, str]] = []
+        for _ in range(MODELS_MAX_PAGES):
+            if request is None:
+                break
+            body = await self._send(client, "GET", *request, None, timeout)
+            page, request = await self._decode(
+                body, lambda data: (self.parse_models_response(data), self.next_models_request(base_url, api_key, data)))
+            models.extend(page)
+        return models
+    
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        method: str,
+        endpoint: str,
+        headers: Dict[str, str],
+        payload: Optional[Dict[str, Any]],
+        timeout: Optional[httpx.Timeout],
+    ) -> bytes:
+        """发送请求并读取响应体 (超过大小上限时中止)，上报 TTFB 与响应字节数"""
+        start = time.perf_counter()
+        request = client.build_request(method, endpoint, headers=headers, json=payload, timeout=timeout or httpx.USE_CLIENT_DEFAULT,
+                                       extensions=trace_extensions())
+        response = await client.send(request, stream=True)
+        try:
+            record_phase("upstream_ttfb", time.perf_counter() - start)
+            _check_content_length(response)
+            body_start = time.perf_counter()
+            if response.is_error:
+                # 错误响应体需要保留在 response 上供 format_error 读取
+                await response.aread()
+                response.raise_for_status()
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                # 按解压后的字节数计，压缩率极高的响应同样受限
+                size += len(chunk)
+                if size > UPSTREAM_MAX_BODY_BYTES:
+                    raise BodyTooLarge(UPSTREAM_MAX_BODY_BYTES)
+                chunks.append(chunk)
+        finally:
+            await response.aclose()
+        body = b"".join(chunks)
+        record_phase("upstream_bytes", len(body))
+        record_span("download", body_start, bytes=len(body))
+        return body
+
+    async def _decode(self, body: bytes, parse: Callable[[Any], T]) -> T:
+        """解码 JSON 并交给 parse 解析；大响应体在线程池中处理，事件循环只等待结果"""
+        if len(body) >= UPSTREAM_DECODE_THREAD_BYTES:
+            # to_thread 复制当前 context，线程中记录的 span / 阶段仍归属本请求
+            return await asyncio.to_thread(self._decode_sync, body, parse)
+        return self._decode_sync(body, parse)
+
+    def _decode_sync(self, body: bytes, parse: Callable[[Any], T]) -> T:
+        start = time.perf_counter()
+        data = json.loads(body)
+        record_span("decode", start)
+        start = time.perf_counter()
+        result = parse(data)
+        record_phase("parse", record_span("parse", start))
+        return result
 
 
 # ============================================================================
@@ -134,6 +310,22 @@ class OpenAIStrategy(ChatStrategy):
             raw_response=data, content=content, model=data.get("model", model),
             usage={"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0), "total_tokens": usage.get("total_tokens", 0)}
         )
+    
+    def build_stream_payload(self, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> Dict[str, Any]:
+        payload = super().build_stream_payload(model, messages, max_tokens)
+        # 要求在最后一个 chunk 中返回用量
+        payload["stream_options"] = {"include_usage": True}
+        return payload
+    
+    def parse_stream_event(self, data: Dict[str, Any], state: StreamState) -> str:
+        if data.get("error"):
+            raise RuntimeError(_stream_error_message(data["error"]))
+        state.model = data.get("model") or state.model
+        usage = data.get("usage")
+        if usage:
+            state.usage.update(prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0), total_tokens=usage.get("total_tokens", 0))
+        choices = data.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content") or ""
 
 
 class AnthropicStrategy(ChatStrategy):
@@ -161,8 +353,27 @@ class AnthropicStrategy(ChatStrategy):
             usage={"prompt_tokens": inp, "completion_tokens": out, "total_tokens": inp + out}
         )
     
+    def parse_stream_event(self, data: Dict[str, Any], state: StreamState) -> str:
+        event = data.get("type")
+        if event == "message_start":
+            message = data.get("message", {})
+            state.model = message.get("model") or state.model
+            state.usage["prompt_tokens"] = message.get("usage", {}).get("input_tokens", 0)
+        elif event == "content_block_delta":
+            delta = data.get("delta", {})
+            if delta.get("type") == "text_delta":
+                return delta.get("text", "")
+        elif event == "message_delta":
+            state.usage["completion_tokens"] = data.get("usage", {}).get("output_tokens", 0)
+        elif event == "error":
+            raise RuntimeError(data.get("error", {}).get("message", "stream error"))
+        return ""
+    
     def build_models_request(self, base_url: str, api_key: str) -> Tuple[str, Dict[str, str]]:
-        return (f"{base_url}/models", self.build_headers(api_key))
+        return anthropic_models_request(base_url, api_key)
+    
+    def next_models_request(self, base_url: str, api_key: str, data: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, str]]]:
+        return anthropic_next_models_request(base_url, api_key, data)
     
    
 
@@ -191,9 +402,31 @@ class GeminiStrategy(ChatStrategy):
             usage={"prompt_tokens": meta.get("promptTokenCount", 0), "completion_tokens": meta.get("candidatesTokenCount", 0), "total_tokens": meta.get("totalTokenCount", 0)}
         )
     
+    def build_stream_endpoint(self, base_url: str, model: str, api_key: str) -> str:
+        return f"{base_url}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+    
+    def build_stream_payload(self, model: str, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> Dict[str, Any]:
+        # Gemini 通过端点区分流式，请求体不变
+        return self.build_payload(model, messages, max_tokens)
+    
+    def parse_stream_event(self, data: Dict[str, Any], state: StreamState) -> str:
+        if data.get("error"):
+            raise RuntimeError(_stream_error_message(data["error"]))
+        # usageMetadata 为累计值，以最后一次为准
+        meta = data.get("usageMetadata")
+        if meta:
+            state.usage.update(prompt_tokens=meta.get("promptTokenCount", 0), completion_tokens=meta.get("candidatesTokenCount", 0), total_tokens=meta.get("totalTokenCount", 0))
+        candidates = data.get("candidates") or [{}]
+        return "".join(p.get("text", "") for p in candidates[0].get("content", {}).get("parts", []))
+    
     def build_models_request(self, base_url: str, api_key: str) -> Tuple[str, Dict[str, str]]:
-        # Gemini 使用 URL 参数鉴权
-        return (f"{base_url}/models?key={api_key}", {})
+        return gemini_models_request(base_url, api_key)
+    
+    def parse_models_response(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return parse_gemini_models(data)
+    
+    def next_models_request(self, base_url: str, api_key: str, data: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, str]]]:
+        return gemini_next_models_request(base_url, api_key, data)
     
 
 
@@ -221,6 +454,15 @@ class CohereStrategy(ChatStrategy):
             usage={"prompt_tokens": inp, "completion_tokens": out, "total_tokens": inp + out}
         )
     
+    def parse_stream_event(self, data: Dict[str, Any], state: StreamState) -> str:
+        event = data.get("type")
+        if event == "content-delta":
+            return data.get("delta", {}).get("message", {}).get("content", {}).get("text", "")
+        if event == "message-end":
+            usage = data.get("delta", {}).get("usage", {}).get("billed_units", {})
+            state.usage.update(prompt_tokens=usage.get("input_tokens", 0), completion_tokens=usage.get("output_tokens", 0))
+        return ""
+    
 
 
 # ============================================================================
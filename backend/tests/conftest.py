@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+# 后端模块以顶层模块方式互相导入 (from pool import ...)，与 python server.py 的运行方式一致
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """把 server 发往上游的请求交给测试提供的处理函数 (httpx.MockTransport)"""
+    import server
+
+    def install(handler):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(server.client_pool, "get", lambda url: client)
+        return client
+
+    return install
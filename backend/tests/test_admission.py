@@ -0,0 +1,204 @@
+import asyncio
+
+import httpx
+import pytest
+
+import admission
+from admission import AdmissionController, Shed
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def total_decisions(controller: AdmissionController) -> int:
+    return sum(controller.decisions.values())
+
+
+def test_admits_until_capacity_then_sheds_when_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_bytes=0, queue_timeout=1, max_queue=0)
+        await controller.acquire("chat")
+        with pytest.raises(Shed) as info:
+            await controller.acquire("chat")
+        return info.value.reason, controller.decisions
+
+    reason, decisions = run(scenario())
+    assert reason == "queue_full"
+    assert decisions == {"admitted": 1, "shed_queue_full": 1}
+
+
+def test_queue_timeout_sheds():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_bytes=0, queue_timeout=0.02, max_queue=4)
+        await controller.acquire("chat")
+        with pytest.raises(Shed) as info:
+            await controller.acquire("chat")
+        return info.value.reason, controller.decisions
+
+    reason, decisions = run(scenario())
+    assert reason == "timeout" and decisions == {"admitted": 1, "shed_timeout": 1}
+
+
+def test_lower_priorities_only_use_their_share():
+    async def scenario():
+        controller = AdmissionController(max_inflight=4, max_bytes=0, queue_timeout=0.02, max_queue=4,
+                                         shares={"chat": 1.0, "test": 1.0, "models": 0.5, "batch": 0.25})
+        await controller.acquire("models")
+        await controller.acquire("models")
+        with pytest.raises(Shed):
+            await controller.acquire("models")
+        await controller.acquire("chat")
+        return controller.inflight
+
+    assert run(scenario()) == {"chat": 1, "test": 0, "models": 2, "batch": 0}
+
+
+def test_freed_slot_goes_to_highest_priority_waiter():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_bytes=0, queue_timeout=1, max_queue=4,
+                                         shares={p: 1.0 for p in admission.PRIORITIES})
+        order = []
+
+        async def request(priority):
+            ticket = await controller.acquire(priority)
+            order.append(priority)
+            await asyncio.sleep(0.01)
+            controller.release(ticket)
+
+        ticket = await controller.acquire("chat")
+        models = asyncio.ensure_future(request("models"))
+        await asyncio.sleep(0)
+        chat = asyncio.ensure_future(request("chat"))
+        await asyncio.sleep(0)
+        controller.release(ticket)
+        await asyncio.gather(models, chat)
+        return order
+
+    assert run(scenario()) == ["chat", "models"]
+
+
+def test_preempted_waiter_counts_one_decision():
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_bytes=0, queue_timeout=1, max_queue=1,
+                                         shares={p: 1.0 for p in admission.PRIORITIES})
+        ticket = await controller.acquire("chat")
+        victim = asyncio.ensure_future(controller.acquire("batch"))
+        await asyncio.sleep(0)
+        chat = asyncio.ensure_future(controller.acquire("chat"))
+        await asyncio.sleep(0)
+        with pytest.raises(Shed) as info:
+            await victim
+        controller.release(ticket)
+        await chat
+        return info.value.reason, controller.decisions
+
+    reason, decisions = run(scenario())
+    assert reason == "preempted"
+    assert decisions == {"admitted": 1, "shed_preempted": 1, "queued": 1}
+
+
+def test_preemption_racing_queue_timeout_counts_one_decision(monkeypatch):
+    async def wait_then_time_out(aw, timeout):
+        # 模拟等待者的超时与抢占 / 分配名额发生在同一轮事件循环
+        try:
+            await aw
+        except Shed:
+            pass
+        raise asyncio.TimeoutError
+
+    async def scenario():
+        controller = AdmissionController(max_inflight=1, max_bytes=0, queue_timeout=1, max_queue=1,
+                                         shares={p: 1.0 for p in admission.PRIORITIES})
+        ticket = await controller.acquire("chat")
+        victim = asyncio.ensure_future(controller.acquire("batch"))
+        await asyncio.sleep(0)
+        chat = asyncio.ensure_future(controller.acquire("chat"))
+        await asyncio.sleep(0)
+        with pytest.raises(Shed) as info:
+            await victim
+        controller.release(ticket)
+        await chat
+        return info.value.reason, controller.decisions
+
+    monkeypatch.setattr(asyncio, "wait_for", wait_then_time_out)
+    reason, decisions = run(scenario())
+    assert reason == "preempted"
+    assert decisions == {"admitted": 1, "shed_preempted": 1, "queued": 1}
+
+
+def test_counts_bytes_actually_read_including_chunked_bodies():
+    async def scenario():
+        controller = AdmissionController(max_inflight=4, max_bytes=1024)
+
+        async def chunks():
+            for _ in range(3):
+                yield b"x" * 100
+
+        def handler(request):
+            return httpx.Response(200, content=chunks())
+
+        async with controller.admitted("chat") as ticket:
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                                         event_hooks={"response": [controller.on_response]}) as client:
+                async with client.stream("GET", "https://up.example/") as response:
+                    during = [controller.bytes async for _ in response.aiter_raw()]
+                # 响应体读完关闭后归还，名额本身仍被占用
+                closed = (ticket.bytes, controller.bytes)
+        return during, closed, controller.bytes
+
+    during, closed, after = run(scenario())
+    assert during == [100, 200, 300]
+    assert closed == (0, 0)
+    assert after == 0
+
+
+def test_finished_batch_bodies_do_not_shed_chat():
+    async def scenario():
+        controller = AdmissionController(max_inflight=8, max_bytes=1000, queue_timeout=0.02)
+
+        async def body():
+            yield b"x" * 400
+
+        def handler(request):
+            return httpx.Response(200, content=body())
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), event_hooks={"response": [controller.on_response]})
+        async with controller.admitted("batch") as ticket:
+            # 与 run_bounded 一样，条目任务复制请求上下文，共用批量请求的名额；合计 2000 字节超过上限
+            items = [asyncio.ensure_future(client.get("https://up.example/")) for _ in range(5)]
+            await asyncio.gather(*items)
+            held = (ticket.bytes, controller.bytes)
+            chat = await controller.acquire("chat")
+            controller.release(chat)
+        await client.aclose()
+        return held, controller.decisions
+
+    held, decisions = run(scenario())
+    assert held == (0, 0)
+    assert decisions == {"admitted": 2}
+
+
+def test_background_fetch_after_release_does_not_leak_bytes():
+    async def scenario():
+        controller = AdmissionController(max_inflight=4, max_bytes=1024)
+
+        def handler(request):
+            return httpx.Response(200, content=b"x" * 500)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), event_hooks={"response": [controller.on_response]})
+        release_first = asyncio.Event()
+
+        async def background():
+            # 复制了请求上下文 (含准入名额) 的后台任务，在请求结束后才收到上游响应
+            await release_first.wait()
+            await client.get("https://up.example/")
+
+        async with controller.admitted("models"):
+            task = asyncio.ensure_future(background())
+        release_first.set()
+        await task
+        await client.aclose()
+        return controller.bytes
+
+    assert run(scenario()) == 0
@@ -0,0 +1,72 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import server
+
+client = TestClient(server.app)
+
+PROBE = {"provider_id": "p", "api_format": "openai", "base_url": "http://127.0.0.1:9", "api_key": "k", "model": "m"}
+
+
+def test_too_many_probes_is_rejected_with_4xx():
+    response = client.post("/test/batch", json={"probes": [PROBE] * (server.BATCH_MAX_PROBES + 1)})
+    assert response.status_code == 413
+    assert response.headers["content-type"].startswith("application/json")
+    assert response.json()["success"] is False
+
+
+def test_probe_results_are_ndjson():
+    response = client.post("/test/batch", json={"probes": [PROBE], "timeout": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 1 and lines[0]["index"] == 0 and lines[0]["success"] is False
+
+
+def test_probe_options_are_validated():
+    for options in ({"timeout": -1}, {"timeout": 0}, {"concurrency": 0}, {"per_origin_concurrency": -1}, {"concurrency": 5000}):
+        assert client.post("/test/batch", json={"probes": [PROBE], **options}).status_code == 422, options
+    for timeout in ({"total": -1}, {"connect": 0}, {"read": 1e9}):
+        assert client.post("/test/batch", json={"probes": [{**PROBE, "timeout": timeout}]}).status_code == 422, timeout
+        assert client.post("/test", json={**PROBE, "timeout": timeout}).status_code == 422, timeout
+
+
+def test_chat_batch_rejections_use_4xx():
+    assert client.post("/chat/batch", json={"items": []}).status_code == 400
+    assert client.post("/chat/batch", content=b"{", headers={"content-type": "application/json"}).status_code == 400
+    item = {**PROBE, "messages": [{"role": "user", "content": "hi"}]}
+    response = client.post("/chat/batch", json={"items": [item] * (server.BATCH_MAX_ITEMS + 1)})
+    assert response.status_code == 413
+
+
+def test_chat_batch_streams_results_then_summary():
+    items = [{**PROBE, "id": "a", "messages": []}, {**PROBE, "id": "b", "messages": [{"role": "user", "content": "hi"}]}]
+    response = client.post("/chat/batch", json={"items": items, "timeout": 2})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["type"] for line in lines] == ["result", "result", "summary"]
+    assert sorted(line["id"] for line in lines[:2]) == ["a", "b"]
+    assert lines[-1]["total"] == 2 and lines[-1]["failed"] == 2
+    assert lines[-1]["error_classes"]["invalid_request"] == 1
+
+
+def test_chat_batch_rejects_invalid_options_with_422():
+    item = {**PROBE, "messages": [{"role": "user", "content": "hi"}]}
+    jsonl = {"content": json.dumps(item).encode(), "headers": {"content-type": "application/x-ndjson"}}
+    for query in ("concurrency=nan", "concurrency=inf", "concurrency=0", "per_origin_concurrency=-1", "timeout=nan",
+                  "timeout=inf", "timeout=0", "concurrency=2.5"):
+        response = client.post(f"/chat/batch?{query}", **jsonl)
+        assert response.status_code == 422, query
+        assert response.json()["success"] is False
+    assert client.post("/chat/batch", json={"items": [item], "concurrency": 0}).status_code == 422
+    assert client.post("/chat/batch", json={"items": [item], "timeout": -1}).status_code == 422
+    # 查询参数同样适用于 JSON 请求体
+    assert client.post("/chat/batch?timeout=nan", json={"items": [item]}).status_code == 422
+
+
+def test_chat_batch_accepts_valid_query_options():
+    item = {**PROBE, "messages": [{"role": "user", "content": "hi"}]}
+    response = client.post("/chat/batch?concurrency=2&per_origin_concurrency=1&timeout=2", content=json.dumps(item).encode(),
+                           headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["total"] == 1
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import breaker
+from breaker import CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitOpenError
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(breaker, "BREAKER_SLOW_CALL", 0.2)
+    monkeypatch.setattr(breaker, "BREAKER_MIN_CALLS", 2)
+    monkeypatch.setattr(breaker, "BREAKER_OPEN_SECONDS", 0.05)
+    return BreakerRegistry()
+
+
+def make_client(registry, handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler),
+                             event_hooks={"request": [registry.on_request], "response": [registry.on_response]})
+
+
+async def _slow_body(seconds):
+    yield b"data: 1\n\n"
+    await asyncio.sleep(seconds)
+    yield b"data: 2\n\n"
+
+
+def test_long_stream_with_fast_first_byte_is_not_slow(registry):
+    async def handler(request):
+        return httpx.Response(200, content=_slow_body(0.3))
+
+    async def main():
+        async with make_client(registry, handler) as client:
+            async with registry.guard("openai", "http://stream.test"):
+                async with client.stream("POST", "http://stream.test/v1/chat") as response:
+                    async for _ in response.aiter_bytes():
+                        pass
+
+    asyncio.run(main())
+    assert registry.get("openai", "http://stream.test").error_rate() == 0
+
+
+def test_slow_first_byte_counts_as_failure(registry):
+    async def handler(request):
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, json={})
+
+    async def main():
+        async with make_client(registry, handler) as client:
+            async with registry.guard("openai", "http://slow.test"):
+                await client.post("http://slow.test/v1/chat")
+
+    asyncio.run(main())
+    assert registry.get("openai", "http://slow.test").error_rate() == 1
+
+
+def test_deadline_cancellation_counts_as_failure(registry):
+    async def handler(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200, json={})
+
+    async def call(client):
+        async with registry.guard("openai", "http://hang.test", time.monotonic() + 0.05):
+            await client.post("http://hang.test/v1/chat")
+
+    async def main():
+        async with make_client(registry, handler) as client:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(call(client), timeout=0.05)
+
+    asyncio.run(main())
+    assert registry.get("openai", "http://hang.test").error_rate() == 1
+
+
+def test_early_cancellation_is_not_counted(registry):
+    # 对冲落败等在截止时间前的取消不说明上游状态
+    async def handler(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200, json={})
+
+    async def call(client):
+        async with registry.guard("openai", "http://hedge.test", time.monotonic() + 10):
+            await client.post("http://hedge.test/v1/chat")
+
+    async def main():
+        async with make_client(registry, handler) as client:
+            task = asyncio.ensure_future(call(client))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    cb = registry.get("openai", "http://hedge.test")
+    assert cb.error_rate() == 0 and not cb._outcomes
+
+
+def test_opens_on_errors_and_closes_after_successful_probe(registry):
+    cb = registry.get("openai", "http://flaky.test")
+    for _ in range(2):
+        cb.before_call()
+        cb.after_call(0.01, True)
+    assert cb.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        cb.before_call()
+
+    time.sleep(0.06)
+    cb.before_call()
+    assert cb.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        cb.before_call()   # 半开状态只放行一个试探请求
+    cb.after_call(0.01, False)
+    assert cb.state == CLOSED
+
+
+def test_client_errors_count_as_success(registry):
+    async def handler(request):
+        return httpx.Response(401, json={})
+
+    async def main():
+        async with make_client(registry, handler) as client:
+            for _ in range(3):
+                with pytest.raises(httpx.HTTPStatusError):
+                    async with registry.guard("openai", "http://auth.test"):
+                        (await client.post("http://auth.test/v1/chat")).raise_for_status()
+
+    asyncio.run(main())
+    cb = registry.get("openai", "http://auth.test")
+    assert cb.state == CLOSED and cb.error_rate() == 0
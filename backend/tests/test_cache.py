@@ -0,0 +1,123 @@
+import asyncio
+
+from cache import ModelListCache, cache_key
+from shared_state import SharedState, SQLiteBackend
+
+KEY = cache_key("openai", "https://api.example/v1", "k")
+
+
+def counting_fetch(values, gate=None):
+    calls = []
+
+    async def fetch():
+        calls.append(len(calls))
+        if gate is not None:
+            await gate.wait()
+        value = values[min(len(calls), len(values)) - 1]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    return fetch, calls
+
+
+def test_concurrent_misses_share_one_fetch():
+    async def main():
+        cache, gate = ModelListCache(), asyncio.Event()
+        fetch, calls = counting_fetch([[{"id": "m"}]], gate)
+        waiters = [asyncio.ensure_future(cache.get_or_fetch(KEY, fetch)) for _ in range(10)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*waiters)
+        return cache, calls, results
+
+    cache, calls, results = asyncio.run(main())
+    assert len(calls) == 1 and all(r == [{"id": "m"}] for r in results)
+    assert cache.stats()["coalesced"] == 9
+
+
+def test_cancelled_caller_does_not_cancel_shared_fetch():
+    async def main():
+        cache, gate = ModelListCache(), asyncio.Event()
+        fetch, calls = counting_fetch([["v1"]], gate)
+        first = asyncio.ensure_future(cache.get_or_fetch(KEY, fetch))
+        second = asyncio.ensure_future(cache.get_or_fetch(KEY, fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        gate.set()
+        return await second, calls
+
+    value, calls = asyncio.run(main())
+    assert value == ["v1"] and len(calls) == 1
+
+
+def test_stale_entry_is_served_while_refreshing_in_background():
+    async def main():
+        cache, gate = ModelListCache(ttl=0, stale_ttl=60), asyncio.Event()
+        fetch, calls = counting_fetch([["v1"], ["v2"]])
+        assert await cache.get_or_fetch(KEY, fetch) == ["v1"]
+
+        gate_fetch, _ = counting_fetch([["v2"]], gate)
+
+        async def slow_refresh():
+            calls.append("refresh")
+            return await gate_fetch()
+
+        # 刷新尚未完成时立即返回旧值
+        assert await cache.get_or_fetch(KEY, slow_refresh) == ["v1"]
+        assert cache.stats()["inflight"] == 1
+        gate.set()
+        await asyncio.sleep(0.01)
+        return cache, calls, await cache.get_or_fetch(KEY, fetch)
+
+    cache, calls, value = asyncio.run(main())
+    assert value == ["v2"] and calls[:2] == [0, "refresh"]
+    assert cache.stats()["stale_hits"] >= 2
+
+
+def test_failed_refresh_keeps_stale_value():
+    async def main():
+        cache = ModelListCache(ttl=0, stale_ttl=60)
+        fetch, _ = counting_fetch([["v1"], RuntimeError("upstream down")])
+        assert await cache.get_or_fetch(KEY, fetch) == ["v1"]
+        assert await cache.get_or_fetch(KEY, fetch) == ["v1"]
+        await asyncio.sleep(0.01)
+        assert cache.stats()["refresh_errors"] == 1
+        return await cache.get_or_fetch(KEY, fetch)
+
+    assert asyncio.run(main()) == ["v1"]
+
+
+def test_expired_entry_is_refetched_and_failures_are_not_cached():
+    async def main():
+        cache = ModelListCache(ttl=0, stale_ttl=0)
+        fetch, calls = counting_fetch([RuntimeError("boom"), ["v2"]])
+        try:
+            await cache.get_or_fetch(KEY, fetch)
+        except RuntimeError:
+            pass
+        return await cache.get_or_fetch(KEY, fetch), calls
+
+    value, calls = asyncio.run(main())
+    assert value == ["v2"] and len(calls) == 2
+
+
+def test_workers_sharing_state_fetch_once(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        a = ModelListCache(shared=SharedState(SQLiteBackend(path), prefix="test:"))
+        b = ModelListCache(shared=SharedState(SQLiteBackend(path), prefix="test:"))
+        gate = asyncio.Event()
+        fetch, calls = counting_fetch([["shared"]], gate)
+        first = asyncio.ensure_future(a.get_or_fetch(KEY, fetch))
+        await asyncio.sleep(0.05)
+        # b 拿不到锁，轮询等待 a 写入的结果
+        second = asyncio.ensure_future(b.get_or_fetch(KEY, fetch))
+        await asyncio.sleep(0.15)
+        gate.set()
+        return await first, await second, calls, b
+
+    first, second, calls, b = asyncio.run(main())
+    assert first == second == ["shared"] and len(calls) == 1
+    assert b.stats()["shared_hits"] == 1
@@ -0,0 +1,86 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware
+
+
+def make_client(size):
+    async def endpoint(request):
+        return Response(b"x" * size, media_type="application/json", headers={"ETag": '"v1"'})
+
+    app = Starlette(routes=[Route("/", endpoint)])
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_large_body_is_compressed_in_a_thread(monkeypatch):
+    calls = []
+    real = asyncio.to_thread
+
+    async def to_thread(fn, *args):
+        calls.append(fn)
+        return await real(fn, *args)
+
+    monkeypatch.setattr(compression.asyncio, "to_thread", to_thread)
+    size = compression.UPSTREAM_DECODE_THREAD_BYTES
+    response = make_client(size).get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == '"v1-gzip"'
+    assert response.content == b"x" * size
+    assert calls == [compression.compress]
+
+
+def test_small_body_is_compressed_inline(monkeypatch):
+    def fail(*args):
+        raise AssertionError("to_thread should not be used")
+
+    monkeypatch.setattr(compression.asyncio, "to_thread", fail)
+    response = make_client(4096).get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.content) == 4096
+
+
+def test_below_minimum_size_is_passed_through():
+    response = make_client(10).get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.content == b"x" * 10
+
+
+def test_etag_round_trips_through_gzip_on_304(upstream):
+    import httpx
+    from fastapi.testclient import TestClient
+
+    import server
+
+    models = [{"id": f"model-{i}", "created": i} for i in range(100)]
+    upstream(lambda request: httpx.Response(200, json={"data": models}))
+    client = TestClient(server.app)
+    body = {"provider_id": "p", "base_url": "https://etag-gzip.example/v1", "api_key": "k"}
+
+    first = client.post("/models", json=body, headers={"Accept-Encoding": "gzip"})
+    assert first.headers["content-encoding"] == "gzip"
+    etag = first.headers["etag"]
+    assert etag.endswith('-gzip"')
+
+    again = client.post("/models", json=body, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert again.status_code == 304 and again.headers["etag"] == etag
+    # 不接受压缩的客户端得到不带后缀的 ETag，与其 200 响应一致
+    plain = client.post("/models", json=body, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert plain.status_code == 304 and plain.headers["etag"] == etag.replace("-gzip", "")
+
+
+def test_304_etag_matches_the_200_it_validates():
+    from fastapi.testclient import TestClient
+
+    import server
+
+    # / 的响应体可能低于压缩阈值 (不加后缀) 也可能超过 (加后缀)，两种情况下 304 都与 200 一致
+    client = TestClient(server.app)
+    first = client.get("/", headers={"Accept-Encoding": "gzip"})
+    again = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304 and again.headers["etag"] == first.headers["etag"]
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from breaker import BreakerRegistry
+from hedging import Hedger
+
+URL = "https://hedge.example/v1"
+KEY = "test https://hedge.example:443"
+
+
+def primed(**kwargs) -> Hedger:
+    hedger = Hedger(min_samples=1, min_delay=0.01, **kwargs)
+    for _ in range(100):
+        hedger._record(KEY, 0.001)
+    return hedger
+
+
+def test_delay_uses_percentile_with_floor_and_min_samples():
+    hedger = Hedger(percentile=95, min_samples=20, min_delay=0.005)
+    for i in range(1, 20):
+        hedger._record(KEY, i / 1000)
+    assert hedger.delay(KEY) is None
+    for i in range(20, 101):
+        hedger._record(KEY, i / 1000)
+    assert hedger.delay(KEY) == pytest.approx(0.096)
+    fast = Hedger(min_samples=1, min_delay=0.05)
+    fast._record(KEY, 0.001)
+    assert fast.delay(KEY) == 0.05
+
+
+def test_hedges_only_while_budget_lasts():
+    hedger = primed(budget=0.5)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def main():
+        for _ in range(3):
+            assert await hedger.run("test", URL, slow) == "ok"
+
+    asyncio.run(main())
+    # 令牌: 0.5 (不足) -> 1.0 (对冲一次) -> 0.5 (不足)
+    assert hedger.hedged == 1 and hedger.budget_exhausted == 2
+
+
+def test_loser_is_cancelled_and_awaited_without_breaker_failure():
+    hedger, breakers = primed(budget=1.0), BreakerRegistry()
+    calls, finished = [], []
+
+    async def attempt():
+        attempt_no = len(calls)
+        calls.append(attempt_no)
+        async with breakers.guard("openai", URL, deadline=None):
+            await breakers.on_request(None)
+            try:
+                # 第一次请求卡住，对冲请求立即返回
+                await asyncio.sleep(10 if attempt_no == 0 else 0)
+                return f"attempt {attempt_no}"
+            finally:
+                finished.append(attempt_no)
+
+    async def main():
+        result = await hedger.run("test", URL, attempt)
+        # 返回前落败方已结束 (finally 与 guard 都已执行)
+        assert sorted(finished) == [0, 1]
+        return result
+
+    assert asyncio.run(main()) == "attempt 1"
+    assert hedger.hedge_wins == 1
+    breaker = breakers.get("openai", URL)
+    assert list(breaker._outcomes) == [False]
+
+
+def test_cancelling_the_caller_cancels_the_primary():
+    hedger, finished = Hedger(), []
+
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            finished.append(True)
+
+    async def main():
+        task = asyncio.ensure_future(hedger.run("test", URL, hang))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert finished == [True]
+
+    asyncio.run(main())
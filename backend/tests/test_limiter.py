@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import limiter as limiter_module
+from limiter import LimiterError, LimiterRegistry, OriginLimiter, key_scope, request_key_scope, retry_after_seconds
+from strategies import get_strategy
+
+URL = "https://api.example.com/v1"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def status_error(status: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", f"{URL}/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+@pytest.mark.parametrize("headers,expected", [
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m30s"}, 90.0),
+    ({"x-ratelimit-remaining-requests": "5", "x-ratelimit-reset-requests": "1m30s"}, None),
+    ({}, None),
+])
+def test_retry_after_seconds(headers, expected):
+    assert retry_after_seconds(httpx.Headers(headers)) == expected
+
+
+def test_aimd_increases_on_fast_success_and_halves_on_overload():
+    limiter = OriginLimiter("o")
+    start = limiter.limit
+    limiter.inflight = 1
+    limiter.release(0.1)
+    assert limiter.limit > start
+    limiter.inflight = 1
+    limiter.release(None, overload=True)
+    assert limiter.limit == pytest.approx((start + 1 / start) / 2)
+
+
+def test_waiters_are_served_fifo_when_slots_free_up():
+    async def scenario():
+        limiter = OriginLimiter("o")
+        limiter.limit = 1
+        await limiter.acquire(time.monotonic() + 1)
+        order = []
+
+        async def waiter(name):
+            await limiter.acquire(time.monotonic() + 1)
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(waiter(n)) for n in ("a", "b")]
+        await asyncio.sleep(0)
+        assert limiter.stats()["queue_depth"] == 2
+        limiter.release(None)
+        await asyncio.sleep(0)
+        limiter.release(None)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario()) == ["a", "b"]
+
+
+def test_queue_timeout_raises_limiter_error():
+    async def scenario():
+        limiter = OriginLimiter("o")
+        limiter.limit = 1
+        await limiter.acquire(time.monotonic() + 1)
+        with pytest.raises(LimiterError) as info:
+            await limiter.acquire(time.monotonic() + 0.02)
+        return info.value.error_class
+
+    assert run(scenario()) == "queue_timeout"
+
+
+def test_retry_after_only_pauses_the_same_key():
+    async def scenario():
+        limiter = OriginLimiter("o")
+        limiter.block_for(0.2, key_scope("tenant-a"))
+        start = time.monotonic()
+        await limiter.acquire(start + 1, key_scope("tenant-b"))
+        other_key_wait = time.monotonic() - start
+        await limiter.acquire(start + 1, key_scope("tenant-a"))
+        same_key_wait = time.monotonic() - start
+        return other_key_wait, same_key_wait
+
+    other_key_wait, same_key_wait = run(scenario())
+    assert other_key_wait < 0.05
+    assert same_key_wait >= 0.15
+
+
+def test_blocked_waiter_does_not_hold_up_other_keys():
+    async def scenario():
+        limiter = OriginLimiter("o")
+        limiter.block_for(1, "a")
+        blocked = asyncio.ensure_future(limiter.acquire(time.monotonic() + 2, "a"))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(limiter.acquire(time.monotonic() + 2, "b"), 0.1)
+        blocked.cancel()
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("api_format", ["openai", "anthropic", "gemini"])
+def test_request_key_scope_matches_strategy_credentials(api_format):
+    strategy = get_strategy(api_format)
+    request = httpx.Request("POST", strategy.build_endpoint(URL, "m", "sk-secret"), headers=strategy.build_headers("sk-secret"))
+    assert request_key_scope(request) == key_scope("sk-secret")
+
+
+def test_response_hook_blocks_only_the_responding_key():
+    async def scenario():
+        registry = LimiterRegistry()
+        request = httpx.Request("POST", f"{URL}/chat/completions", headers={"Authorization": "Bearer sk-a"})
+        await registry.on_response(httpx.Response(200, headers={"retry-after": "5"}, request=request))
+        limiter = registry.get(URL)
+        return limiter.is_blocked(key_scope("sk-a")), limiter.is_blocked(key_scope("sk-b"))
+
+    assert run(scenario()) == (True, False)
+
+
+def test_429_pauses_key_without_halving_origin_limit(monkeypatch):
+    monkeypatch.setattr(limiter_module, "LIMITER_MAX_RETRIES", 0)
+
+    async def scenario():
+        registry = LimiterRegistry()
+        limit = registry.get(URL).limit
+
+        async def fn():
+            raise status_error(429, {"retry-after": "5"})
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await registry.call(URL, fn, key="a")
+        limiter = registry.get(URL)
+        return limit, limiter.limit, limiter.is_blocked("a"), limiter.is_blocked("b")
+
+    limit, after, blocked_a, blocked_b = run(scenario())
+    assert after == limit and blocked_a and not blocked_b
+
+
+def test_503_halves_origin_limit(monkeypatch):
+    monkeypatch.setattr(limiter_module, "LIMITER_MAX_RETRIES", 0)
+
+    async def scenario():
+        registry = LimiterRegistry()
+        limit = registry.get(URL).limit
+
+        async def fn():
+            raise status_error(503, {"retry-after": "0.01"})
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await registry.call(URL, fn)
+        return limit, registry.get(URL).limit
+
+    limit, after = run(scenario())
+    assert after == limit / 2
+
+
+def test_429_is_retried_after_pause():
+    async def scenario():
+        registry = LimiterRegistry()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise status_error(429, {"retry-after-ms": "20"})
+            return "ok"
+
+        return await registry.call(URL, fn, deadline=time.monotonic() + 2, key="a"), calls
+
+    assert run(scenario()) == ("ok", 2)
+
+
+def test_short_client_timeout_is_not_treated_as_overload():
+    async def scenario(min_latency):
+        registry = LimiterRegistry()
+        limiter = registry.get(URL)
+        limiter.min_latency = min_latency
+        limit = limiter.limit
+
+        async def fn():
+            await asyncio.sleep(0.02)
+            raise httpx.ReadTimeout("timeout")
+
+        with pytest.raises(httpx.ReadTimeout):
+            await registry.call(URL, fn)
+        return limit, limiter.limit
+
+    limit, after = run(scenario(min_latency=1.0))
+    assert after == limit
+    limit, after = run(scenario(min_latency=0.001))
+    assert after == limit / 2
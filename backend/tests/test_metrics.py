@@ -0,0 +1,72 @@
+import pytest
+
+import metrics
+from metrics import Registry, RequestTracker
+
+
+def test_counter_and_histogram_render():
+    registry = Registry()
+    counter = registry.counter("c_total", "c", ("k",))
+    histogram = registry.histogram("h_seconds", "h", buckets=(0.1, 1.0))
+    counter.inc(k="a")
+    counter.inc(2, k="a")
+    histogram.observe(0.5)
+    text = registry.render()
+    assert 'c_total{k="a"} 3' in text
+    assert 'h_seconds_bucket{le="0.1"} 0' in text
+    assert 'h_seconds_bucket{le="1"} 1' in text
+    assert "h_seconds_count 1" in text
+
+
+def test_peers_are_summed_and_gauges_split_by_worker():
+    registry = Registry()
+    counter = registry.counter("c_total", "c")
+    gauge = registry.gauge("g", "g")
+    counter.inc(2)
+    gauge.set(5)
+    registry.worker = "w1"
+    registry.peers = {"w2": {"c_total": [[[], 3.0]], "g": [[[], 7.0]]}}
+    text = registry.render()
+    assert "c_total 5" in text
+    assert 'g{worker="w1"} 5' in text and 'g{worker="w2"} 7' in text
+
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        metrics._Metric("x", "x")
+
+
+def test_unknown_api_format_is_bucketed():
+    assert RequestTracker("/chat", "not-a-format", "https://a.example").labels["api_format"] == "other"
+    assert RequestTracker("/chat", "openai", "https://a.example").labels["api_format"] == "openai"
+
+
+def test_origin_labels_are_bounded(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MAX_ORIGINS", 2)
+    monkeypatch.setattr(metrics, "_seen_origins", set())
+    labels = [metrics.origin_label(f"https://h{i}.example/v1") for i in range(4)]
+    assert labels == ["https://h0.example:443", "https://h1.example:443", "other", "other"]
+    assert metrics.origin_label("https://h0.example/other") == "https://h0.example:443"
+    assert metrics.origin_label("http://h:notaport") == "invalid"
+
+
+def test_series_per_metric_are_bounded(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MAX_SERIES", 3)
+    counter = Registry().counter("c_total", "c", ("k",))
+    for i in range(10):
+        counter.inc(k=str(i))
+    assert sorted(key for key, _ in counter.snapshot()) == [["0"], ["1"], ["2"], ["other"]]
+
+
+def test_ttfb_keeps_first_attempt_while_bytes_accumulate():
+    with metrics.track("/test", "openai", "https://ttfb.example/v1") as tracker:
+        metrics.record_phase("upstream_ttfb", 0.2)
+        metrics.record_phase("upstream_bytes", 100)
+        # 对冲 / 429 重试的后续尝试
+        metrics.record_phase("upstream_ttfb", 0.3)
+        metrics.record_phase("upstream_bytes", 50)
+        metrics.record_phase("queue_wait", 0.1)
+        metrics.record_phase("queue_wait", 0.1)
+    assert tracker.phases["upstream_ttfb"] == 0.2
+    assert tracker.phases["upstream_bytes"] == 150
+    assert tracker.phases["queue_wait"] == pytest.approx(0.2)
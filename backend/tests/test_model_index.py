@@ -0,0 +1,123 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+import server
+from cache import ModelListCache, cache_key
+from model_index import ModelIndex, index_scope
+from shared_state import SharedState, SQLiteBackend
+
+A = index_scope("https://api.example/v1", "key-a")
+B = index_scope("https://api.example/v1", "key-b")
+
+
+def test_catalogs_are_isolated_by_scope():
+    index = ModelIndex()
+    index.update(A, "openai", [{"id": "gpt-4o", "created": 2}, {"id": "ft:gpt-4o:acme", "created": 3}])
+    index.update(B, "openai", [{"id": "gpt-4o", "created": 2}])
+
+    models, _, total = index.search([(B, "openai")], "gpt")
+    assert total == 1 and models[0]["id"] == "gpt-4o"
+    assert index.search([], "gpt")[2] == 0
+    # 同名 provider 的另一个 Key 不会覆盖 A 的列表
+    assert index.search([(A, "openai")], "acme")[2] == 1
+
+
+def test_cursor_pages_through_results():
+    index = ModelIndex()
+    index.update(A, "p", [{"id": f"m{i}", "created": i} for i in range(5)])
+    seen, cursor = [], None
+    while True:
+        models, cursor, total = index.search([(A, "p")], limit=2, cursor=cursor)
+        seen += [m["id"] for m in models]
+        if cursor is None:
+            break
+    assert seen == ["m4", "m3", "m2", "m1", "m0"] and total == 5
+
+
+def test_catalogs_are_capped_least_recently_used_first():
+    index = ModelIndex(max_catalogs=3)
+    scopes = [index_scope("https://public.example/v1", f"made-up-{i}") for i in range(5)]
+    for scope in scopes[:3]:
+        index.update(scope, "p", [{"id": "m"}])
+    # 搜索同样算作使用
+    assert index.search([(scopes[0], "p")])[2] == 1
+    for scope in scopes[3:]:
+        index.update(scope, "p", [{"id": "m"}])
+
+    stats = index.stats()
+    assert stats["catalogs"] == 3 and stats["models"] == 3 and stats["evictions"] == 2
+    assert [index.search([(scope, "p")])[2] for scope in scopes] == [1, 0, 0, 1, 1]
+
+
+def test_models_endpoint_indexes_only_for_the_fetching_key(upstream, monkeypatch):
+    monkeypatch.setattr(server, "model_index", ModelIndex())
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        private = [{"id": "ft:private", "created": 2}] if request.headers.get("authorization") == "Bearer key-a" else []
+        return httpx.Response(200, json={"data": [{"id": "public", "created": 1}] + private})
+
+    upstream(handler)
+    client = TestClient(server.app)
+    base_url = "https://index-tenants.example/v1"
+    for key in ("key-a", "key-b"):
+        response = client.post("/models", json={"provider_id": "shared", "base_url": base_url, "api_key": key})
+        assert response.json()["success"] is True
+
+    def search(key):
+        source = {"provider_id": "shared", "base_url": base_url, "api_key": key}
+        return [m["id"] for m in client.post("/models/search", json={"sources": [source]}).json()["models"]]
+
+    assert search("key-a") == ["ft:private", "public"]
+    assert search("key-b") == ["public"]
+    assert search("key-c") == []
+    assert client.post("/models/search", json={"query": "private"}).json()["models"] == []
+
+
+def test_unchanged_list_only_refreshes_lru_order():
+    index = ModelIndex(max_catalogs=2)
+    models = [{"id": "m"}]
+    index.update(A, "p", models)
+    index.update(B, "p", [{"id": "m"}])
+    assert index.update(A, "p", models) == {"added": 0, "removed": 0, "changed": 0}
+    index.update(index_scope("https://other.example/v1", "k"), "p", [{"id": "m"}])
+    # A 因再次写入而保留，B 被淘汰
+    assert [index.search([(scope, "p")])[2] for scope in (A, B)] == [1, 0]
+    assert index.stats()["updates"] == 3
+
+
+def test_models_served_from_another_workers_shared_cache_are_searchable(upstream, monkeypatch, tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    base_url = "https://index-shared.example/v1"
+    key = cache_key("openai", base_url, "k")
+
+    async def other_worker_fetch():
+        other = ModelListCache(shared=SharedState(SQLiteBackend(path), prefix="test:"))
+
+        async def fetch():
+            return [{"id": "from-other-worker", "name": "From Other Worker", "created": 1}]
+
+        await other.get_or_fetch(key, fetch)
+
+    asyncio.run(other_worker_fetch())
+    this_worker = ModelListCache(shared=SharedState(SQLiteBackend(path), prefix="test:"))
+    monkeypatch.setattr(server, "models_cache", this_worker)
+    monkeypatch.setattr(server, "model_index", ModelIndex())
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("共享缓存命中时不应请求上游")
+
+    upstream(handler)
+    client = TestClient(server.app)
+    request = {"provider_id": "shared", "base_url": base_url, "api_key": "k"}
+    search = {"sources": [request], "query": "other"}
+    assert client.post("/models", json=request).json()["success"] is True
+    assert this_worker.stats()["shared_hits"] == 1
+    assert [m["id"] for m in client.post("/models/search", json=search).json()["models"]] == ["from-other-worker"]
+
+    # 分区被索引淘汰后，本进程缓存命中时重新写入
+    monkeypatch.setattr(server, "model_index", ModelIndex())
+    assert client.post("/models", json=request).json()["success"] is True
+    assert this_worker.stats()["hits"] == 1
+    assert [m["id"] for m in client.post("/models/search", json=search).json()["models"]] == ["from-other-worker"]
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import server
+from multiplex import Multiplexer
+
+
+class FakeSocket:
+    """按 ASGI 消息收发的 WebSocket 替身，记录同时进行的 send 数"""
+
+    def __init__(self):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.sent = []
+        self.active = 0
+        self.max_active = 0
+
+    def push(self, text=None, data=None):
+        message = {"type": "websocket.receive", "text": text} if data is None else {"type": "websocket.receive", "bytes": data}
+        self.incoming.put_nowait(message)
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.001)
+        self.sent.append(json.loads(text))
+        self.active -= 1
+
+    async def wait_for(self, predicate, timeout=2.0):
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while not any(predicate(f) for f in self.sent):
+            assert loop.time() < end, self.sent
+            await asyncio.sleep(0.005)
+
+
+def describe_error(e):
+    return {"message": str(e), "error_class": "test"}
+
+
+def run_session(handlers, script, queue_size=1):
+    socket = FakeSocket()
+
+    async def main():
+        mux = Multiplexer(socket, handlers, describe_error, queue_size=queue_size)
+        serving = asyncio.ensure_future(mux.serve())
+        await script(socket)
+        socket.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await serving
+
+    asyncio.run(main())
+    return socket
+
+
+def test_terminal_error_frame_follows_queued_deltas():
+    async def failing(payload, send):
+        for i in range(5):
+            await send({"type": "delta", "content": str(i)})
+        raise RuntimeError("boom")
+
+    async def script(socket):
+        socket.push(json.dumps({"id": "r1", "type": "chat"}))
+        socket.push(json.dumps({"id": "r2", "type": "chat"}))
+        await socket.wait_for(lambda f: f["id"] == "r1" and f["type"] == "error")
+        await socket.wait_for(lambda f: f["id"] == "r2" and f["type"] == "error")
+
+    socket = run_session({"chat": failing}, script)
+    for request_id in ("r1", "r2"):
+        frames = [f for f in socket.sent if f["id"] == request_id]
+        assert [f["type"] for f in frames] == ["delta"] * 5 + ["error"]
+        assert [f["content"] for f in frames[:5]] == ["0", "1", "2", "3", "4"]
+    assert socket.max_active == 1
+
+
+def test_cancelled_frame_is_last_for_the_request():
+    async def endless(payload, send):
+        i = 0
+        while True:
+            await send({"type": "delta", "content": str(i)})
+            i += 1
+
+    async def script(socket):
+        socket.push(json.dumps({"id": "r1", "type": "chat"}))
+        await socket.wait_for(lambda f: f["type"] == "delta")
+        socket.push(json.dumps({"id": "r1", "type": "cancel"}))
+        await socket.wait_for(lambda f: f["type"] == "cancelled")
+        await asyncio.sleep(0.05)
+
+    socket = run_session({"chat": endless}, script)
+    assert socket.sent[-1] == {"id": "r1", "type": "cancelled"}
+    assert sum(f["type"] == "cancelled" for f in socket.sent) == 1
+    assert socket.max_active == 1
+
+
+def test_protocol_errors_do_not_close_the_connection():
+    async def ok(payload, send):
+        await send({"type": "result", "success": True})
+
+    async def script(socket):
+        socket.push(data=b"\x00\x01")
+        socket.push("not json")
+        socket.push(json.dumps({"id": "r1", "type": "test"}))
+        await socket.wait_for(lambda f: f["type"] == "result")
+
+    socket = run_session({"test": ok}, script, queue_size=4)
+    assert [f["type"] for f in socket.sent] == ["error", "error", "result"]
+    assert socket.sent[0]["id"] is None
+
+
+def test_binary_frame_gets_error_reply_over_real_websocket():
+    with TestClient(server.app).websocket_connect("/ws") as ws:
+        ws.send_bytes(b"\x00")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_text(json.dumps({"id": "x", "type": "unknown"}))
+        reply = ws.receive_json()
+        assert reply["id"] == "x" and reply["type"] == "error"
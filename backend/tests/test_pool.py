@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+
+from pool import ClientPool, origin_of
+
+
+def test_origin_of_normalizes_default_ports():
+    assert origin_of("https://API.example.com/v1") == "https://api.example.com:443"
+    assert origin_of("http://localhost:11434/v1") == "http://localhost:11434"
+
+
+def test_clients_are_shared_per_origin():
+    pool = ClientPool()
+    assert pool.get("https://a.example/v1") is pool.get("https://a.example/v2/models")
+    assert pool.get("https://a.example/v1") is not pool.get("https://b.example/v1")
+
+
+def test_clients_do_not_persist_cookies():
+    client = ClientPool().get("https://a.example/v1")
+    request = httpx.Request("POST", "https://a.example/v1/chat/completions")
+    client.cookies.extract_cookies(httpx.Response(200, headers={"set-cookie": "session=user-a; Path=/"}, request=request))
+    assert len(client.cookies) == 0
+
+
+def test_pool_evicts_least_recently_used_origin_past_cap():
+    pool = ClientPool(max_origins=2)
+    evicted = []
+    pool.on_evict(evicted.append)
+    a = pool.get("https://a.example/v1")
+    pool.get("https://b.example/v1")
+    pool.get("https://a.example/v1")
+    pool.get("https://c.example/v1")
+    assert evicted == ["https://b.example:443"]
+    assert pool.get("https://a.example/v1") is a
+    assert pool.stats()["evicted"] == 1 and len(pool.stats()["origins"]) == 2
+
+
+def test_pool_closes_idle_clients_after_ttl():
+    async def main():
+        pool = ClientPool(idle_ttl=0)
+        a = pool.get("https://a.example/v1")
+        pool.get("https://b.example/v1")
+        await pool.aclose()
+        return a
+
+    assert asyncio.run(main()).is_closed
+
+
+def test_eviction_drops_breaker_and_idle_limiter_state():
+    from breaker import BreakerRegistry
+    from limiter import LimiterRegistry
+
+    breakers, limiters = BreakerRegistry(), LimiterRegistry()
+    pool = ClientPool(max_origins=1)
+    pool.on_evict(breakers.forget)
+    pool.on_evict(limiters.forget)
+    breakers.get("openai", "https://a.example/v1")
+    limiters.get("https://a.example/v1")
+    busy = limiters.get("https://b.example/v1")
+    busy.inflight = 1
+    breakers.get("openai", "https://b.example/v1")
+
+    pool.get("https://a.example/v1")
+    pool.get("https://b.example/v1")
+    pool.get("https://c.example/v1")
+    assert breakers.states() == {}
+    # 仍有进行中请求的限制器保留
+    assert list(limiters.stats()) == ["https://b.example:443"]
+
+
+def test_borrowed_client_is_not_evicted_while_in_use():
+    async def main():
+        pool = ClientPool(max_origins=1, idle_ttl=0)
+        with pool.borrow("https://a.example/v1") as a:
+            # 请求仍在排队 / 等待对冲延迟时，其他 origin 的请求不会关闭它
+            pool.get("https://b.example/v1")
+            pool.get("https://c.example/v1")
+            await asyncio.sleep(0)
+            assert not a.is_closed
+        pool.get("https://d.example/v1")
+        await asyncio.sleep(0)
+        closed = a.is_closed
+        await pool.aclose()
+        return closed
+
+    assert asyncio.run(main())
+
+
+def test_eviction_drops_hedging_and_routing_state():
+    from hedging import Hedger
+    from models import ChatCandidate
+    from routing import CandidateRouter
+
+    hedger, router = Hedger(), CandidateRouter()
+    pool = ClientPool(max_origins=1)
+    pool.on_evict(hedger.forget)
+    pool.on_evict(router.forget)
+    for url in ("https://a.example/v1", "https://b.example/v1"):
+        hedger._record(f"test {origin_of(url)}", 0.1)
+        router.record(ChatCandidate(provider_id="p", api_key="k", model="m", base_url=url), 0.1, ok=True)
+        pool.get(url)
+
+    assert list(hedger._samples) == ["test https://b.example:443"]
+    assert [s["base_url"] for s in router.stats()] == ["https://b.example/v1"]
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import server
+from builtin_providers import PROVIDERS_TS, load_builtin_providers, parse_providers_ts
+from pool import ClientPool
+from prewarm import BUILTIN_BASE_URLS, Prewarmer, load_provider_config
+
+
+def test_builtin_providers_match_providers_ts():
+    # builtin_providers.json 由 providers.ts 生成；修改后需重新运行 python backend/builtin_providers.py
+    assert parse_providers_ts(PROVIDERS_TS.read_text(encoding="utf-8")) == load_builtin_providers()
+    assert BUILTIN_BASE_URLS["openai"] == load_builtin_providers()["openai"]["baseUrl"]
+
+
+def test_load_provider_config_include_exclude_custom(tmp_path):
+    path = tmp_path / "ai-providers.json"
+    path.write_text(json.dumps({
+        "mode": "default",
+        "include": ["openai", "anthropic", "deepseek"],
+        "exclude": ["anthropic"],
+        "custom": {"deepseek": {"baseUrl": "https://proxy.example/v1"}, "local": {"baseUrl": "http://127.0.0.1:9/v1"}},
+    }))
+    assert load_provider_config(str(path)) == {
+        "openai": BUILTIN_BASE_URLS["openai"],
+        "deepseek": "https://proxy.example/v1",
+        "local": "http://127.0.0.1:9/v1",
+    }
+
+
+def test_readyz_waits_for_prewarm_and_ignores_unreachable_providers(tmp_path, monkeypatch):
+    path = tmp_path / "ai-providers.json"
+    path.write_text(json.dumps({
+        "mode": "custom",
+        "custom": {
+            "refused": {"baseUrl": "http://127.0.0.1:9/v1"},
+            "unresolvable": {"baseUrl": "https://prewarm-test.invalid/v1"},
+        },
+    }))
+    pool = ClientPool()
+    prewarmer = Prewarmer(pool, config_path=str(path), timeout=1)
+    monkeypatch.setattr(server, "prewarmer", prewarmer)
+    client = TestClient(server.app)
+
+    warming = client.get("/readyz")
+    assert warming.status_code == 503 and warming.json()["status"] == "warming"
+
+    async def warm():
+        await prewarmer._run()
+        await pool.aclose()
+
+    asyncio.run(warm())
+    ready = client.get("/readyz")
+    assert ready.status_code == 200 and ready.json()["status"] == "ready"
+    origins = ready.json()["prewarm"]["origins"]
+    assert set(origins) == {"http://127.0.0.1:9", "https://prewarm-test.invalid:443"}
+    assert all("error" in status for status in origins.values())
@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from models import ChatResult
+from response_cache import ResponseCache, response_key
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "hi"}]}]}
+
+
+def test_key_includes_model_for_formats_without_model_in_payload():
+    pro = response_key("gemini", "https://g.example/v1beta", "k", "gemini-1.5-pro", PAYLOAD)
+    flash = response_key("gemini", "https://g.example/v1beta", "k", "gemini-1.5-flash", PAYLOAD)
+    assert pro != flash
+
+
+def test_key_distinguishes_path_prefixed_gateways_and_keys():
+    a = response_key("openai", "https://host/a/v1", "k", "m", PAYLOAD)
+    assert a != response_key("openai", "https://host/b/v1", "k", "m", PAYLOAD)
+    assert a != response_key("openai", "https://host/a/v1", "other-key", "m", PAYLOAD)
+
+
+def test_key_normalizes_equivalent_base_urls():
+    assert response_key("openai", "https://HOST/a/v1/", "k", "m", PAYLOAD) == response_key("openai", "https://host:443/a/v1", "k", "m", PAYLOAD)
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "cache.sqlite3")
+        cache = ResponseCache(path=path)
+        await cache.put("k", ChatResult(raw_response={"x": 1}, content="hello", model="m", usage={"total_tokens": 3}))
+        assert (await cache.get("k")).content == "hello"
+        cache.close()
+        reopened = ResponseCache(path=path)
+        result = await reopened.get("k")
+        stats = reopened.stats()
+        reopened.close()
+        return result, stats
+
+    result, stats = asyncio.run(scenario())
+    assert result.content == "hello" and result.raw_response == {"x": 1}
+    assert stats["disk_hits"] == 1
+
+
+def test_expired_entries_miss():
+    async def scenario():
+        cache = ResponseCache(ttl=0.01, path=None)
+        await cache.put("k", ChatResult(raw_response={}, content="x", model="m", usage={}))
+        await asyncio.sleep(0.02)
+        return await cache.get("k")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_chat_cache_does_not_mix_gemini_models(upstream, monkeypatch):
+    monkeypatch.setattr(server, "response_cache", ResponseCache(path=None))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        model = request.url.path.rsplit("/", 1)[-1].split(":")[0]
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": f"from {model}"}]}}]})
+
+    upstream(handler)
+    client = TestClient(server.app)
+    base = {"provider_id": "gemini", "api_format": "gemini", "base_url": "https://gemini-cache.example/v1beta", "api_key": "k",
+            "messages": [{"role": "user", "content": "hi"}]}
+    first = client.post("/chat", json={**base, "model": "gemini-1.5-pro"}).json()
+    second = client.post("/chat", json={**base, "model": "gemini-1.5-flash"}).json()
+    repeat = client.post("/chat", json={**base, "model": "gemini-1.5-pro"}).json()
+    assert first["content"] == "from gemini-1.5-pro" and "cached" not in first
+    assert second["content"] == "from gemini-1.5-flash" and "cached" not in second
+    assert repeat["content"] == "from gemini-1.5-pro" and repeat["cached"]
+
+
+def test_disk_size_is_shared_between_workers(tmp_path):
+    from response_cache import _DiskTier
+
+    path = str(tmp_path / "shared.sqlite3")
+    a, b = _DiskTier(path, max_bytes=250), _DiskTier(path, max_bytes=250)
+    a.put("a1", b"x" * 100)
+    a.put("a2", b"x" * 100)
+    assert b.bytes == 200
+    # b 写入后超出上限: 按访问时间淘汰 a 最早写入的条目
+    b.put("b1", b"y" * 100)
+    assert a.bytes == b.bytes == 200
+    assert a.get("a1", ttl=60) is None and b.get("b1", ttl=60) is not None
+    # 覆盖同一 key 时按新旧大小之差计
+    a.put("b1", b"z" * 10)
+    assert b.bytes == 110
+    b.purge_expired(ttl=-1)
+    assert a.bytes == 0
+    a.close()
+    b.close()
+
+
+def test_disk_tier_opens_on_first_use_and_stats_do_not_query_it(tmp_path, monkeypatch):
+    import response_cache
+
+    path = tmp_path / "lazy.sqlite3"
+    cache = ResponseCache(path=str(path))
+    assert not path.exists()
+    assert cache.stats()["disk_bytes"] is None
+
+    async def scenario():
+        await cache.put("k", ChatResult(raw_response={}, content="hello", model="m", usage={}))
+        # stats() 在事件循环中调用，只读取上次写入时得到的总字节数
+        monkeypatch.setattr(response_cache._DiskTier, "bytes", property(lambda self: pytest.fail("stats() queried SQLite")))
+        return cache.stats()
+
+    stats = asyncio.run(scenario())
+    assert path.exists() and stats["disk_bytes"] > 0
+    cache.close()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+import server
+from deadline import Deadline
+from models import ChatCandidate
+from routing import CandidateRouter
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def candidate(host: str, **extra):
+    return {"provider_id": host, "api_key": "k", "model": "m", "base_url": f"https://{host}/v1", "api_format": "openai", **extra}
+
+
+def ok(text: str) -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}], "usage": {"total_tokens": 1}})
+
+
+def test_child_deadline_is_capped_by_parent():
+    parent = Deadline(at=time.monotonic() + 1, total=1)
+    assert 0.4 < parent.child(0.5).remaining() <= 0.5
+    assert parent.child(10).at == parent.at
+
+
+def test_router_prefers_lower_latency_and_penalizes_errors():
+    router = CandidateRouter()
+    fast, slow = ChatCandidate(**candidate("fast")), ChatCandidate(**candidate("slow"))
+    router.record(fast, 0.1, ok=True)
+    router.record(slow, 0.5, ok=True)
+    assert router.order([slow, fast], "latency")[0] is fast
+    for _ in range(3):
+        router.record(fast, 0.1, ok=False)
+    assert router.order([slow, fast], "latency")[0] is slow
+
+
+def test_fails_over_on_5xx(upstream):
+    def handler(request):
+        if request.url.host == "down-5xx.example":
+            return httpx.Response(502, text="bad gateway")
+        return ok("fallback")
+
+    upstream(handler)
+    body = TestClient(server.app).post("/chat/route", json={
+        "candidates": [candidate("down-5xx.example"), candidate("up-5xx.example")], "messages": MESSAGES, "routing": "ordered",
+    }).json()
+    assert body["success"] and body["content"] == "fallback"
+    assert body["served_by"]["provider_id"] == "up-5xx.example" and body["served_by"]["attempts"] == 2
+
+
+def test_does_not_fail_over_on_client_error(upstream):
+    def handler(request):
+        return httpx.Response(400, text="bad request") if request.url.host == "bad-4xx.example" else ok("unexpected")
+
+    upstream(handler)
+    body = TestClient(server.app).post("/chat/route", json={
+        "candidates": [candidate("bad-4xx.example"), candidate("up-4xx.example")], "messages": MESSAGES, "routing": "ordered",
+    }).json()
+    assert body["success"] is False and "HTTP 400" in body["message"]
+
+
+def test_hanging_candidate_does_not_consume_whole_budget(upstream):
+    async def handler(request):
+        if request.url.host == "hang.example":
+            await asyncio.sleep(30)
+        return ok("fallback")
+
+    upstream(handler)
+    start = time.monotonic()
+    body = TestClient(server.app).post("/chat/route", json={
+        "candidates": [candidate("hang.example"), candidate("up-hang.example")], "messages": MESSAGES, "routing": "ordered",
+        "timeout": {"total": 2},
+    }).json()
+    assert body["success"] and body["served_by"]["provider_id"] == "up-hang.example"
+    assert time.monotonic() - start < 1.8
+
+
+def test_attempt_timeout_caps_each_candidate(upstream):
+    async def handler(request):
+        if request.url.host == "slow-cap.example":
+            await asyncio.sleep(30)
+        return ok("fallback")
+
+    upstream(handler)
+    start = time.monotonic()
+    body = TestClient(server.app).post("/chat/route", json={
+        "candidates": [candidate("slow-cap.example"), candidate("up-cap.example")], "messages": MESSAGES, "routing": "ordered",
+        "timeout": {"total": 20}, "attempt_timeout": 0.3,
+    }).json()
+    assert body["success"] and time.monotonic() - start < 2
+
+
+def test_stops_when_total_budget_is_gone(upstream):
+    async def handler(request):
+        await asyncio.sleep(30)
+
+    upstream(handler)
+    start = time.monotonic()
+    body = TestClient(server.app).post("/chat/route", json={
+        "candidates": [candidate(f"hang{i}-total.example") for i in range(4)], "messages": MESSAGES, "routing": "ordered",
+        "timeout": {"total": 0.6},
+    }).json()
+    assert body["success"] is False
+    assert time.monotonic() - start < 1.5
+
+
+def test_unknown_routing_mode_is_rejected_by_schema():
+    response = TestClient(server.app).post("/chat/route", json={
+        "candidates": [candidate("mode.example")], "messages": MESSAGES, "routing": "fastest",
+    })
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "routing"]
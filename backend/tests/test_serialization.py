@@ -0,0 +1,34 @@
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import server
+from models import ChatResponse
+from serialization import respond
+
+CHAT = {"provider_id": "openai", "api_format": "openai", "base_url": "https://serialize.example/v1", "api_key": "k", "model": "m",
+        "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_respond_omits_unset_optional_fields():
+    body = json.loads(respond(ChatResponse.model_construct(success=False, message="x")).body)
+    assert body["content"] is None and body["message"] == "x"
+    assert not {"served_by", "cached", "cache_lookup_ms", "session"} & set(body)
+    routed = json.loads(respond(ChatResponse.model_construct(success=True, served_by={"attempts": 1})).body)
+    assert routed["served_by"] == {"attempts": 1}
+
+
+def test_chat_response_has_only_core_fields(upstream):
+    upstream(lambda request: httpx.Response(200, json={"model": "m", "choices": [{"message": {"content": "ok"}}], "usage": {}}))
+    body = TestClient(server.app).post("/chat", json={**CHAT, "include_raw": False}).json()
+    assert body["success"] is True and body["content"] == "ok"
+    assert set(body) == {"success", "content", "model", "usage", "latency_ms", "raw_response", "message"}
+
+
+def test_invalid_cache_mode_is_rejected_by_schema():
+    client = TestClient(server.app)
+    response = client.post("/chat", json={**CHAT, "cache": "sometimes"})
+    assert response.status_code == 422
+    schema = client.get("/openapi.json").json()["components"]["schemas"]["ChatRequest"]["properties"]["cache"]
+    assert schema["enum"] == ["use", "bypass", "refresh"]
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from sessions import SessionStore
+
+
+def make_session():
+    return SessionStore().create(provider_id="p", api_key="k", model="m", base_url="http://session.test", api_format="openai")
+
+
+def deadline_in(seconds):
+    return Deadline(at=time.monotonic() + seconds, total=seconds)
+
+
+def test_lock_wait_respects_deadline():
+    session = make_session()
+
+    async def main():
+        async with session.locked(deadline_in(1)):
+            start = time.monotonic()
+            with pytest.raises(DeadlineExceeded):
+                async with session.locked(deadline_in(0.05)):
+                    pass
+            assert time.monotonic() - start < 0.5
+        # 超时的等待者不会占住锁
+        async with session.locked(deadline_in(0.05)):
+            pass
+        assert not session.lock.locked()
+
+    asyncio.run(main())
+
+
+def test_turns_run_in_order():
+    session = make_session()
+    order = []
+
+    async def turn(name, hold):
+        async with session.locked(deadline_in(1)):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def main():
+        first = asyncio.ensure_future(turn("first", 0.05))
+        await asyncio.sleep(0)
+        await asyncio.gather(first, turn("second", 0))
+
+    asyncio.run(main())
+    assert order == ["first", "second"]
+    assert not session.lock.locked()
+
+
+def test_cancelled_waiter_releases_lock():
+    session = make_session()
+
+    async def main():
+        async with session.locked(deadline_in(1)):
+            waiter = asyncio.ensure_future(session.locked(deadline_in(1)).__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        assert not session.lock.locked()
+
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+import pytest
+
+from limiter import LimiterRegistry
+from metrics import Registry
+from shared_state import RETIRED_KEY, MemoryBackend, SharedState, SQLiteBackend, StateBackend
+
+
+def make_worker(path, name):
+    metrics = Registry()
+    counter = metrics.counter("requests_total", "requests")
+    metrics.gauge("inflight", "inflight")
+    state = SharedState(SQLiteBackend(path), prefix="test:", sync_interval=60, metrics=metrics)
+    state.worker_id = name
+    metrics.worker = name
+    return state, counter
+
+
+def total(state):
+    line = next(l for l in state.metrics.render().splitlines() if l.startswith("requests_total"))
+    return float(line.split()[-1])
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_sqlite_backend_connects_on_first_use(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    backend = SQLiteBackend(str(path))
+    assert not path.exists()
+
+    async def main():
+        await backend.set("k", b"v", ttl=60)
+        value = await backend.get("k")
+        await backend.close()
+        return value
+
+    assert asyncio.run(main()) == b"v" and path.exists()
+
+
+def test_unlock_only_releases_own_lock(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        a = SharedState(SQLiteBackend(path), prefix="test:")
+        b = SharedState(SQLiteBackend(path), prefix="test:")
+        stale = await a.try_lock("fetch:lock", 0.01)
+        await asyncio.sleep(0.02)
+        # a 的锁已过期，b 重新获取；a 拉取结束后释放不能删掉 b 的锁
+        current = await b.try_lock("fetch:lock", 60)
+        await a.unlock("fetch:lock", stale)
+        held = await a.try_lock("fetch:lock", 60)
+        await b.unlock("fetch:lock", current)
+        released = await a.try_lock("fetch:lock", 60)
+        await a.backend.close()
+        await b.backend.close()
+        return stale, current, held, released
+
+    stale, current, held, released = asyncio.run(main())
+    assert stale and current and stale != current
+    assert held is None and released is not None
+
+
+def test_models_lock_outlives_the_fetch_deadline():
+    from cache import ModelListCache, cache_key
+
+    class Recording(SharedState):
+        ttls = []
+
+        @property
+        def enabled(self):
+            return True
+
+        async def try_lock(self, key, ttl):
+            self.ttls.append(ttl)
+            return await super().try_lock(key, ttl)
+
+    async def main():
+        cache = ModelListCache(shared=Recording(MemoryBackend(), prefix="test:"))
+
+        async def fetch():
+            return [{"id": "m"}]
+
+        return await cache.get_or_fetch(cache_key("openai", "https://slow.example/v1", "k"), fetch, fetch_timeout=90)
+
+    assert asyncio.run(main()) == [{"id": "m"}]
+    assert Recording.ttls == [90]
+
+
+def test_merged_counters_survive_graceful_stop(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        (a, a_count), (b, b_count) = make_worker(path, "a"), make_worker(path, "b")
+        a_count.inc(2)
+        b_count.inc(3)
+        await b.sync()
+        await a.sync()
+        assert total(a) == 5
+        b.start()
+        await asyncio.sleep(0.05)
+        b_count.inc(1)          # 最后一次同步之后的增量随停止一起写入退役记录
+        await b.stop()
+        await a.sync()
+        assert total(a) == 6
+        # 退出的 worker 不再以 gauge 的 worker 标签出现
+        assert 'worker="b"' not in a.metrics.render()
+        await a.backend.close()
+
+    asyncio.run(main())
+
+
+def test_merged_counters_survive_crashed_worker(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        (a, a_count), (b, b_count) = make_worker(path, "a"), make_worker(path, "b")
+        a_count.inc(2)
+        b_count.inc(3)
+        await b.sync()
+        await a.sync()
+        # 模拟崩溃: 心跳与指标键过期，b 没有机会写退役记录
+        await b.backend.delete("test:workers:b")
+        await b.backend.delete("test:metrics:b")
+        await a.sync()
+        assert total(a) == 5
+        record = await a.get_json(RETIRED_KEY)
+        assert set(record["workers"]) == {"b"}
+        # 后来加入的 worker 也能看到退役的计数
+        c, c_count = make_worker(path, "c")
+        await c.sync()
+        assert total(c) == 2 + 3
+        for state in (a, b, c):
+            await state.backend.close()
+
+    asyncio.run(main())
+
+
+def test_combined_concurrency_uses_smallest_learned_limit(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        (a, _), (b, _) = make_worker(path, "a"), make_worker(path, "b")
+        limiters_a, limiters_b = LimiterRegistry(shared=a), LimiterRegistry(shared=b)
+        url = "https://shared-limit.example/v1"
+        limiters_a.get(url).limit = 10
+        limiters_b.get(url).limit = 4
+        for _ in range(2):
+            await a.sync()
+            await b.sync()
+        for registry in (limiters_a, limiters_b):
+            limiter = registry.get(url)
+            assert limiter.shared_limit == 4 and limiter.share == 0.5
+            assert limiter.stats()["shared_limit"] == 4
+        # 每个 worker 最多 2 个并发，总和不超过最小的上限 4
+        limiter = limiters_a.get(url)
+        for _ in range(2):
+            await limiter.acquire(time.monotonic() + 1)
+        assert not limiter._has_capacity()
+        for state in (a, b):
+            await state.backend.close()
+
+    asyncio.run(main())
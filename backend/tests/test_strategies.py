@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from models import StreamState
+import strategies
+from strategies import BodyTooLarge, get_strategy
+
+
+def test_gemini_models_follow_next_page_token():
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.params.get("pageToken"))
+        if request.url.params.get("pageToken") == "page/2":
+            return httpx.Response(200, json={"models": [{"name": "models/gemini-pro", "displayName": "Gemini Pro"}]})
+        return httpx.Response(200, json={
+            "models": [{"name": "models/gemini-flash"}],
+            "nextPageToken": "page/2",
+        })
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await get_strategy("gemini").fetch_models(client, "http://gemini.test/v1beta", "k")
+
+    models = asyncio.run(main())
+    assert seen == [None, "page/2"]
+    assert models == [
+        {"id": "gemini-flash", "name": "gemini-flash", "created": 0},
+        {"id": "gemini-pro", "name": "Gemini Pro", "created": 0},
+    ]
+
+
+def test_openai_models_are_single_page():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        return httpx.Response(200, json={"data": [{"id": "gpt-x", "created": 1}], "nextPageToken": "ignored"})
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await get_strategy("openai").fetch_models(client, "http://openai.test/v1", "k")
+
+    assert asyncio.run(main()) == [{"id": "gpt-x", "name": "Gpt X", "created": 1}]
+    assert len(calls) == 1
+
+
+def test_anthropic_models_follow_has_more():
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.params.get("after_id"))
+        if request.url.params.get("after_id") == "claude-b":
+            return httpx.Response(200, json={"data": [{"id": "claude-c", "display_name": "Claude C"}], "has_more": False, "last_id": "claude-c"})
+        return httpx.Response(200, json={
+            "data": [{"id": "claude-a", "display_name": "Claude A"}, {"id": "claude-b", "display_name": "Claude B"}],
+            "has_more": True, "last_id": "claude-b",
+        })
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await get_strategy("anthropic").fetch_models(client, "http://anthropic.test/v1", "k")
+
+    models = asyncio.run(main())
+    assert seen == [None, "claude-b"]
+    assert [m["id"] for m in models] == ["claude-a", "claude-b", "claude-c"]
+    assert models[0]["name"] == "Claude A"
+
+
+def parse_all(api_format, events):
+    strategy, state = get_strategy(api_format), StreamState(model="requested")
+    text = "".join(strategy.parse_stream_event(event, state) for event in events)
+    return text, state
+
+
+def test_openai_stream_events():
+    text, state = parse_all("openai", [
+        {"model": "gpt-4o-2024", "choices": [{"delta": {"role": "assistant"}}]},
+        {"choices": [{"delta": {"content": "Hel"}}]},
+        {"choices": [{"delta": {"content": "lo"}, "finish_reason": "stop"}]},
+        {"choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}},
+    ])
+    assert text == "Hello" and state.model == "gpt-4o-2024"
+    assert state.usage == {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}
+    with pytest.raises(RuntimeError, match="overloaded"):
+        parse_all("openai", [{"error": {"message": "overloaded", "type": "server_error"}}])
+
+
+def test_anthropic_stream_events():
+    text, state = parse_all("anthropic", [
+        {"type": "message_start", "message": {"model": "claude-x", "usage": {"input_tokens": 7}}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Hi"}},
+        {"type": "content_block_delta", "delta": {"type": "input_json_delta", "partial_json": "{}"}},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 4}},
+        {"type": "message_stop"},
+    ])
+    assert text == "Hi" and state.model == "claude-x"
+    assert state.usage["prompt_tokens"] == 7 and state.usage["completion_tokens"] == 4
+    with pytest.raises(RuntimeError, match="Overloaded"):
+        parse_all("anthropic", [{"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}])
+
+
+def test_gemini_stream_events():
+    text, state = parse_all("gemini", [
+        {"candidates": [{"content": {"parts": [{"text": "Bon"}]}}], "usageMetadata": {"promptTokenCount": 2}},
+        {"candidates": [{"content": {"parts": [{"text": "jour"}]}, "finishReason": "STOP"}],
+         "usageMetadata": {"promptTokenCount": 2, "candidatesTokenCount": 3, "totalTokenCount": 5}},
+    ])
+    assert text == "Bonjour" and state.model == "requested"
+    assert state.usage == {"prompt_tokens": 2, "completion_tokens": 3, "total_tokens": 5}
+    with pytest.raises(RuntimeError, match="quota"):
+        parse_all("gemini", [{"error": {"code": 429, "message": "quota exceeded"}}])
+
+
+def sse_frames(body: str):
+    return [json.loads(line[5:]) for line in body.splitlines() if line.startswith("data:")]
+
+
+def test_chat_stream_relays_deltas_and_usage(upstream):
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        chunks = [
+            {"model": "gpt-4o", "choices": [{"delta": {"content": "Hel"}}]},
+            {"choices": [{"delta": {"content": "lo"}}]},
+            {"choices": [], "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}},
+        ]
+        body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    upstream(handler)
+    response = TestClient(server.app).post("/chat/stream", json={
+        "provider_id": "openai", "api_format": "openai", "base_url": "https://stream.example/v1", "api_key": "k", "model": "gpt-4o",
+        "messages": [{"role": "user", "content": "hi"}],
+    })
+    frames = sse_frames(response.text)
+    assert [f["content"] for f in frames if f["type"] == "delta"] == ["Hel", "lo"]
+    assert frames[-1]["type"] == "usage" and frames[-1]["model"] == "gpt-4o"
+    assert frames[-1]["usage"] == {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}
+
+
+def test_chat_stream_reports_mid_stream_error(upstream):
+    def handler(request):
+        body = 'data: {"choices": [{"delta": {"content": "a"}}]}\n\ndata: {"error": {"message": "upstream broke"}}\n\n'
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    upstream(handler)
+    response = TestClient(server.app).post("/chat/stream", json={
+        "provider_id": "openai", "api_format": "openai", "base_url": "https://stream-error.example/v1", "api_key": "k", "model": "m",
+        "messages": [{"role": "user", "content": "hi"}],
+    })
+    frames = sse_frames(response.text)
+    assert frames[0] == {"type": "delta", "content": "a"}
+    assert frames[-1]["type"] == "error" and "upstream broke" in frames[-1]["message"]
+
+
+def test_model_lists_module_needs_no_backend_dependencies():
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    code = ("import sys, model_lists; "
+            "assert not {'fastapi', 'starlette', 'pydantic', 'httpx'} & set(sys.modules), sorted(sys.modules)")
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parent.parent, check=True)
+    # 单 provider 模式的脚本同样只依赖标准库 (httpx 只在 --all 时导入)
+    code = ("import sys, runpy; runpy.run_path('fetch_models.py'); "
+            "assert not {'fastapi', 'starlette', 'pydantic', 'httpx'} & set(sys.modules), sorted(sys.modules)")
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[2] / "scripts", check=True)
+
+
+class CountingStream(httpx.AsyncByteStream):
+    """记录上游响应体被读取了多少块"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def run_chat(handler):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await get_strategy("openai").execute(client, "http://openai.test/v1", "k", "gpt-x", [{"role": "user", "content": "hi"}], None)
+    return asyncio.run(main())
+
+
+def test_oversized_content_length_is_rejected_before_reading_body(monkeypatch):
+    monkeypatch.setattr(strategies, "UPSTREAM_MAX_BODY_BYTES", 100)
+    body = CountingStream([b"x" * 200])
+    with pytest.raises(BodyTooLarge):
+        run_chat(lambda request: httpx.Response(200, headers={"content-length": "200"}, stream=body))
+    assert body.read == 0
+
+
+def test_chunked_body_is_cut_off_at_limit(monkeypatch):
+    monkeypatch.setattr(strategies, "UPSTREAM_MAX_BODY_BYTES", 100)
+    body = CountingStream([b"x" * 40] * 10)
+    with pytest.raises(BodyTooLarge) as excinfo:
+        run_chat(lambda request: httpx.Response(200, stream=body))
+    # 第 3 块使累计字节数超过上限，之后的块不再读取
+    assert body.read == 3
+    assert server.classify_error(excinfo.value) == "body_too_large"
+
+
+def test_large_body_is_decoded_off_the_event_loop(monkeypatch):
+    decoded_in = []
+    decode_sync = strategies.ChatStrategy._decode_sync
+
+    def spy(self, body, parse):
+        decoded_in.append(threading.current_thread() is threading.main_thread())
+        return decode_sync(self, body, parse)
+
+    monkeypatch.setattr(strategies.ChatStrategy, "_decode_sync", spy)
+    monkeypatch.setattr(strategies, "UPSTREAM_DECODE_THREAD_BYTES", 1024)
+    small = {"model": "gpt-x", "choices": [{"message": {"content": "hi"}}]}
+    large = {"model": "gpt-x", "choices": [{"message": {"content": "x" * 2048}}]}
+    assert run_chat(lambda request: httpx.Response(200, json=small)).content == "hi"
+    assert len(run_chat(lambda request: httpx.Response(200, json=large)).content) == 2048
+    # 小响应体在事件循环线程中解码，超过阈值的在线程池中解码
+    assert decoded_in == [True, False]
@@ -0,0 +1,82 @@
+import json
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+from timing import TimingMiddleware, TraceSink, record_span
+
+TRACE_ID, PARENT_ID = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def phases(header: str):
+    return {part.split(";")[0].strip(): float(part.split("dur=")[1]) for part in header.split(",")}
+
+
+def test_chat_returns_server_timing_breakdown(upstream):
+    upstream(lambda request: httpx.Response(200, json={"model": "m", "choices": [{"message": {"content": "ok"}}], "usage": {}}))
+    response = TestClient(server.app).post("/chat", headers={"Origin": "http://localhost:5173"}, json={
+        "provider_id": "openai", "api_format": "openai", "base_url": "https://timing.example/v1", "api_key": "k", "model": "m",
+        "messages": [{"role": "user", "content": "hi"}],
+    })
+    timings = phases(response.headers["server-timing"])
+    assert {"admission", "download", "decode", "parse", "serialize", "total"} <= set(timings)
+    assert all(value >= 0 for value in timings.values())
+    assert timings["total"] >= timings["parse"]
+    assert response.headers["timing-allow-origin"] == "http://localhost:5173"
+
+
+def test_spans_are_exported_as_otlp_under_the_request_span():
+    inner = FastAPI()
+
+    @inner.get("/work")
+    async def work():
+        record_span("parse", time.perf_counter(), bytes=3)
+        return {"ok": True}
+
+    middleware = TimingMiddleware(inner)
+    middleware.sink = sink = ListSink()
+    response = TestClient(middleware).get("/work", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+    assert "parse;dur=" in response.headers["server-timing"]
+
+    (record,) = sink.records
+    resource = record["resourceSpans"][0]
+    assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "ai-provider-proxy"}}]
+    root, *children = resource["scopeSpans"][0]["spans"]
+    assert root["name"] == "GET /work" and root["kind"] == 2
+    assert root["traceId"] == TRACE_ID and root["parentSpanId"] == PARENT_ID
+    assert {"key": "http.status_code", "value": {"intValue": "200"}} in root["attributes"]
+    parse = next(span for span in children if span["name"] == "parse")
+    assert parse["kind"] == 1 and parse["traceId"] == TRACE_ID and parse["parentSpanId"] == root["spanId"]
+    assert parse["attributes"] == [{"key": "bytes", "value": {"intValue": "3"}}]
+    assert int(root["startTimeUnixNano"]) <= int(parse["startTimeUnixNano"]) <= int(parse["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+
+
+def test_invalid_traceparent_starts_a_new_trace():
+    middleware = TimingMiddleware(FastAPI())
+    middleware.sink = sink = ListSink()
+    TestClient(middleware).get("/missing", headers={"traceparent": "garbage"})
+    root = sink.records[0]["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert len(root["traceId"]) == 32 and root["traceId"] != TRACE_ID and "parentSpanId" not in root
+
+
+def test_trace_sink_appends_json_lines(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    sink = TraceSink(str(path))
+    sink.emit({"resourceSpans": [1]})
+    sink.emit({"resourceSpans": [2]})
+    for _ in range(100):
+        if path.exists() and len(path.read_text().splitlines()) == 2:
+            break
+        time.sleep(0.01)
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [{"resourceSpans": [1]}, {"resourceSpans": [2]}]
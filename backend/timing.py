@@ -0,0 +1,254 @@
+"""
+单请求耗时分解: Server-Timing 响应头 + 追踪 span
+
+每个 HTTP 请求持有一个 Timeline，各阶段在发生处记录 span:
+    admission  - 全局准入排队 (admission.py)
+    queue      - 按 origin 的限流排队 (limiter.py)
+    acquire    - 从连接池取得连接 (含等待空闲连接)
+    connect    - DNS 解析 + TCP 建连 (httpcore 在 connect_tcp 内解析域名，无法再细分)
+    tls        - TLS 握手
+    ttfb       - 发出请求头到收到上游响应头
+    download   - 接收上游响应体
+    decode     - JSON 解码
+    parse      - 策略的 parse_response / parse_models_response
+    serialize  - 响应序列化
+连接相关阶段来自 httpx 的 trace 扩展 (extensions={"trace": ...})，复用的 keep-alive 连接没有 connect / tls。
+
+Server-Timing 在响应头发出时生成 (同名阶段累加，如对冲的两次上游请求)，流式响应只包含首字节之前的阶段；
+追踪 span 在响应发送完毕后以 OTLP/JSON 格式 (每个请求一行 resourceSpans) 追加写入文件，
+可直接导入 OpenTelemetry Collector 等兼容后端。请求带 W3C traceparent 头时沿用其 trace id。
+
+环境变量:
+    SERVER_TIMING      - 是否返回 Server-Timing 头 (默认 1)
+    TRACE_FILE         - 追踪 span 输出文件 (默认为空，不写入)
+    TRACE_SAMPLE_RATE  - 写入追踪文件的请求比例 (默认 1.0)
+"""
+
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# ============================================================================
+# 配置常量
+# ============================================================================
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") not in ("0", "false", "no")
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+SERVICE_NAME = "ai-provider-proxy"
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER = 1, 2   # OTLP SpanKind
+
+# httpcore trace 事件 -> 阶段名 (started / complete 之间的耗时)
+_TRACE_STEPS = {"connect_tcp": "connect", "start_tls": "tls"}
+
+Span = Tuple[str, float, float, Dict[str, Any]]   # (name, start, end, attributes)，时间为 perf_counter
+
+
+# ============================================================================
+# Timeline
+# ============================================================================
+
+class Timeline:
+    """单个请求的阶段 span 集合"""
+
+    def __init__(self, name: str, traceparent: Optional[str] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_start_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.attributes: Dict[str, Any] = {}
+        self.trace_id, self.parent_span_id = _parse_traceparent(traceparent)
+
+    def add(self, name: str, start: float, end: float, **attributes: Any) -> None:
+        self.spans.append((name, start, end, attributes))
+
+    def durations(self) -> Dict[str, float]:
+        """各阶段累计耗时 (秒)，按首次出现的顺序"""
+        totals: Dict[str, float] = {}
+        for name, start, end, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + (end - start)
+        return totals
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations().items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def httpx_trace(self) -> Callable[[str, Dict[str, Any]], Awaitable[None]]:
+        """生成一次上游请求的 httpx trace 回调 (在发送请求前调用)"""
+        sent = time.perf_counter()
+        started: Dict[str, float] = {}
+        first_event = True
+        request_sent: Optional[float] = None
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            nonlocal first_event, request_sent
+            now = time.perf_counter()
+            if first_event:
+                # 第一个事件出现之前的时间都花在从连接池取得连接上
+                first_event = False
+                self.add("acquire", sent, now)
+            step, _, status = event_name.rpartition(".")
+            step = step.split(".", 1)[-1]
+            if status == "started":
+                started[step] = now
+                if step == "send_request_headers":
+                    request_sent = now
+            elif status in ("complete", "failed"):
+                begin = started.pop(step, None)
+                if step in _TRACE_STEPS and begin is not None:
+                    self.add(_TRACE_STEPS[step], begin, now)
+                elif step == "receive_response_headers" and request_sent is not None:
+                    self.add("ttfb", request_sent, now)
+
+        return trace
+
+    def to_otlp(self, end: float) -> Dict[str, Any]:
+        """转换为 OTLP/JSON 的 resourceSpans 结构"""
+        root_id = secrets.token_hex(8)
+        root = self._otlp_span(self.name, root_id, self.parent_span_id, SPAN_KIND_SERVER, self.start, end, self.attributes)
+        spans = [root] + [self._otlp_span(name, secrets.token_hex(8), root_id, SPAN_KIND_INTERNAL, s, e, attrs)
+                          for name, s, e, attrs in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "proxy.timing"}, "spans": spans}],
+        }]}
+
+    def _otlp_span(self, name: str, span_id: str, parent_id: Optional[str], kind: int, start: float, end: float,
+                   attributes: Dict[str, Any]) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": span_id,
+            "name": name,
+            "kind": kind,
+            "startTimeUnixNano": str(self._unix_ns(start)),
+            "endTimeUnixNano": str(self._unix_ns(end)),
+            "attributes": _otlp_attributes(attributes),
+        }
+        if parent_id:
+            span["parentSpanId"] = parent_id
+        return span
+
+    def _unix_ns(self, t: float) -> int:
+        return self.wall_start_ns + int((t - self.start) * 1e9)
+
+
+def _parse_traceparent(value: Optional[str]) -> Tuple[str, Optional[str]]:
+    """解析 W3C traceparent (version-traceid-spanid-flags)，无效时生成新的 trace id"""
+    parts = (value or "").strip().split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16 and parts[1] != "0" * 32:
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+            return parts[1], parts[2]
+        except ValueError:
+            pass
+    return secrets.token_hex(16), None
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+_current: ContextVar[Optional[Timeline]] = ContextVar("timeline", default=None)
+
+
+def record_span(name: str, start: float, **attributes: Any) -> float:
+    """记录从 start (perf_counter) 到现在的阶段，返回耗时；不在请求上下文中时只计算耗时"""
+    end = time.perf_counter()
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.add(name, start, end, **attributes)
+    return end - start
+
+
+def trace_extensions() -> Dict[str, Any]:
+    """传给 httpx 请求的 extensions (当前请求的连接阶段 trace 回调)"""
+    timeline = _current.get()
+    return {"trace": timeline.httpx_trace()} if timeline is not None else {}
+
+
+# ============================================================================
+# 追踪文件
+# ============================================================================
+
+class TraceSink:
+    """后台线程追加写入 OTLP/JSON 行，避免在事件循环中做文件 IO"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-sink", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        self._queue.put(record)
+
+    def _run(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                f.write(json.dumps(self._queue.get(), ensure_ascii=False, separators=(",", ":")) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+
+# ============================================================================
+# ASGI 中间件
+# ============================================================================
+
+class TimingMiddleware:
+    """为每个 HTTP 请求建立 Timeline，添加 Server-Timing 头并按采样写入追踪文件"""
+
+    def __init__(self, app: ASGIApp, allow_origins: Sequence[str] = (), trace_file: str = TRACE_FILE,
+                 sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.allow_origins = set(allow_origins)
+        self.sink = TraceSink(trace_file) if trace_file else None
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        timeline = Timeline(f"{scope['method']} {scope['path']}", headers.get(b"traceparent", b"").decode("latin-1"))
+        timeline.attributes.update({"http.method": scope["method"], "http.route": scope["path"]})
+        origin = headers.get(b"origin", b"").decode("latin-1")
+        token = _current.set(timeline)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                timeline.attributes["http.status_code"] = message["status"]
+                if SERVER_TIMING:
+                    extra = [(b"server-timing", timeline.server_timing().encode("latin-1"))]
+                    # 跨域页面需要 Timing-Allow-Origin 才能通过 Resource Timing API 读取 Server-Timing
+                    if origin and ("*" in self.allow_origins or origin in self.allow_origins):
+                        extra.append((b"timing-allow-origin", origin.encode("latin-1")))
+                    message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if self.sink is not None and random.random() < self.sample_rate:
+                self.sink.emit(timeline.to_otlp(time.perf_counter()))
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 通用 AI Provider 模型获取脚本
-支持 OpenAI 兼容格式的 API，按创建时间倒序排列
+复用 backend/model_lists.py (与后端策略共用，只依赖标准库) 构建请求、解析响应 (OpenAI 兼容 / Anthropic / Gemini)，按创建时间倒序排列
 
 使用方法: python fetch_models.py <provider> <API_KEY>
 示例:
@@ -9,124 +9,158 @@
   python fetch_models.py openrouter sk-or-xxx
   python fetch_models.py siliconflow sk-xxx
   python fetch_models.py doubao xxx
+
+批量增量刷新: python fetch_models.py --all [--config custom-providers.json] [--concurrency 8]
+  - 并发刷新 PROVIDERS 与自定义 provider (ai-providers.json 的 custom 或 custom-providers.json)
+  - API Key 从环境变量 <PROVIDER>_API_KEY 读取 (如 OPENAI_API_KEY、OLLAMA_LOCAL_API_KEY)，未设置且需要鉴权的跳过
+  - 使用 ETag / Last-Modified 条件请求，结果缓存在 --cache-dir，未变化的 provider 不重新下载
+  - 只输出与上次运行相比新增 / 移除的模型；有变化时重写 <provider>_models.json
+
+输出格式与单 provider 模式一致: OpenAI 兼容格式的 name 为上游返回的 name (没有则为 id)，created 原样保留；
+Anthropic / Gemini 由 backend/model_lists.py 解析 (Gemini 的 id 去掉 "models/" 前缀，name 取 displayName)。
+分页的模型列表 (Anthropic 的 has_more / last_id、Gemini 的 nextPageToken) 会取完所有页。
+
+单 provider 模式只依赖标准库 (urllib)；--all 需要安装 httpx，只在该模式下导入。
 """
 
 import sys
 import json
+import argparse
+import asyncio
+import os
+import re
+import time
 import urllib.request
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
 
-# Provider 配置
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from builtin_providers import load_builtin_providers  # noqa: E402
+from model_lists import MODELS_MAX_PAGES, build_models_request, next_models_request, parse_models_response  # noqa: E402
+
+# 刷新的内置 provider 及显示名；baseUrl 与 api_format 取自 backend/builtin_providers.json (由 providers.ts 生成)
+FETCH_PROVIDERS = {
+    'openai': 'OpenAI',
+    'anthropic': 'Anthropic',
+    'gemini': 'Gemini',
+    'openrouter': 'OpenRouter',
+    'siliconflow': 'SiliconFlow',
+    'doubao': 'Doubao',
+    'deepseek': 'DeepSeek',
+    'moonshot': 'Moonshot',
+    'qwen': 'Qwen',
+    'zhipu': 'Zhipu',
+    'xai': 'xAI',
+    'groq': 'Groq',
+    'together': 'Together',
+    'mistral': 'Mistral',
+    'fireworks': 'Fireworks',
+    'deepinfra': 'DeepInfra',
+    'minimax': 'MiniMax',
+}
+
+BUILTIN_PROVIDERS = load_builtin_providers()
 PROVIDERS = {
-    'openai': {
-        'url': 'https://api.openai.com/v1/models',
-        'name': 'OpenAI',
-    },
-    'openrouter': {
-        'url': 'https://openrouter.ai/api/v1/models',
-        'name': 'OpenRouter',
-    },
-    'siliconflow': {
-        'url': 'https://api.siliconflow.cn/v1/models',
-        'name': 'SiliconFlow',
-    },
-    'doubao': {
-        'url': 'https://ark.cn-beijing.volces.com/api/v3/models',
-        'name': 'Doubao',
-    },
-    'deepseek': {
-        'url': 'https://api.deepseek.com/models',
-        'name': 'DeepSeek',
-    },
-    'groq': {
-        'url': 'https://api.groq.com/openai/v1/models',
-        'name': 'Groq',
-    },
-    'together': {
-        'url': 'https://api.together.xyz/v1/models',
-        'name': 'Together',
-    },
-    'mistral': {
-        'url': 'https://api.mistral.ai/v1/models',
-        'name': 'Mistral',
-    },
-    'minimax': {
-        'url': 'https://api.minimax.chat/v1/models',
-        'name': 'MiniMax',
-    },
+    provider: {
+        'url': f"{BUILTIN_PROVIDERS[provider]['baseUrl']}/models",
+        'name': name,
+        'api_format': BUILTIN_PROVIDERS[provider].get('apiFormat', 'openai'),
+    }
+    for provider, name in FETCH_PROVIDERS.items()
 }
 
+DEFAULT_CACHE_DIR = '.models_cache'
+DEFAULT_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+
+
+def base_url_of(config: dict) -> str:
+    return config['url'].removesuffix('/models')
+
+
+def simplify_models(api_format: str, data: dict) -> list:
+    """提取模型列表 (id / name / created)"""
+    if api_format == 'openai':
+        # 保持原有输出: 不格式化 name，不补 created
+        return [
+            {'id': m.get('id'), 'name': m.get('name', m.get('id')), 'created': m.get('created')}
+            for m in data.get('data', data.get('models', []))
+        ]
+    return parse_models_response(api_format, data)
+
+
+def sort_models(models: list) -> list:
+    # 按 created 时间倒序排列（新的在前）
+    return sorted(models, key=lambda m: m.get('created') or 0, reverse=True)
+
+
+def write_output(provider: str, name: str, simplified: list, output_file: str):
+    """
+    写入 <provider>_models.json (模型列表 + TypeScript 片段)
+
+    PROVIDER_ID 为 provider.upper()；自定义 provider 的 id 可能含 '-' 等字符，替换为 '_' 以保证是合法的标识符
+    (内置 provider 的 id 只含字母数字，结果不变)。
+    """
+    provider_id = re.sub(r'[^A-Z0-9]', '_', provider.upper())
+    ts_lines = []
+    ts_lines.append(f"// {name} 模型列表 - 共 {len(simplified)} 个 (按时间倒序)")
+    ts_lines.append(f"[PROVIDER_ID.{provider_id}]: [")
+    for m in simplified:
+        ts_lines.append(f"    {{ id: '{m['id']}', name: '{m['name']}' }},")
+    ts_lines.append("],")
+
+    output = {
+        'provider': name,
+        'total': len(simplified),
+        'models': simplified,
+        'typescript': '\n'.join(ts_lines),
+    }
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+
+
 def fetch_models(provider: str, api_key: str):
     if provider not in PROVIDERS:
         print(f"❌ 不支持的 provider: {provider}")
         print(f"   支持的: {', '.join(PROVIDERS.keys())}")
         return
-    
+
     config = PROVIDERS[provider]
-    url = config['url']
     name = config['name']
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    req = urllib.request.Request(url, headers=headers)
-    
+    api_format = config.get('api_format', 'openai')
+    base_url = base_url_of(config)
+    request = build_models_request(api_format, base_url, api_key)
+
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            
-            # 提取模型列表
-            models = data.get('data', data.get('models', []))
-            
-            if not models:
-                print("未获取到模型数据")
-                print(json.dumps(data, indent=2, ensure_ascii=False)[:500])
-                return
-            
-            # 按 created 时间倒序排列（新的在前）
-            models_sorted = sorted(
-                models,
-                key=lambda m: m.get('created', 0),
-                reverse=True
-            )
-            
-            # 生成简化列表
-            simplified = []
-            for m in models_sorted:
-                simplified.append({
-                    'id': m.get('id'),
-                    'name': m.get('name', m.get('id')),
-                    'created': m.get('created'),
-                })
-            
-            # 生成 TypeScript 格式
-            provider_id = provider.upper()
-            ts_lines = []
-            ts_lines.append(f"// {name} 模型列表 - 共 {len(simplified)} 个 (按时间倒序)")
-            ts_lines.append(f"[PROVIDER_ID.{provider_id}]: [")
-            for m in simplified:
-                ts_lines.append(f"    {{ id: '{m['id']}', name: '{m['name']}' }},")
-            ts_lines.append("],")
-            
-            output = {
-                'provider': name,
-                'total': len(simplified),
-                'models': simplified,
-                'typescript': '\n'.join(ts_lines),
-            }
-            
-            # 写入文件
-            output_file = f'{provider}_models.json'
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(output, f, indent=2, ensure_ascii=False)
-            
-            print(f"✅ 已保存到 {output_file}")
-            print(f"   模型数: {len(simplified)}")
-            print(f"\n📋 前 10 个模型:\n")
-            for m in simplified[:10]:
-                print(f"   - {m['id']}")
-                
+        models = []
+        for _ in range(MODELS_MAX_PAGES):
+            if request is None:
+                break
+            url, headers = request
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=REQUEST_TIMEOUT) as response:
+                data = json.loads(response.read().decode('utf-8'))
+            models.extend(simplify_models(api_format, data))
+            request = next_models_request(api_format, base_url, api_key, data)
+
+        simplified = sort_models(models)
+        if not simplified:
+            print("未获取到模型数据")
+            print(json.dumps(data, indent=2, ensure_ascii=False)[:500])
+            return
+
+        # 写入文件
+        output_file = f'{provider}_models.json'
+        write_output(provider, name, simplified, output_file)
+
+        print(f"✅ 已保存到 {output_file}")
+        print(f"   模型数: {len(simplified)}")
+        print(f"\n📋 前 10 个模型:\n")
+        for m in simplified[:10]:
+            print(f"   - {m['id']}")
+
     except urllib.error.HTTPError as e:
         print(f"HTTP 错误: {e.code}")
         try:
@@ -136,10 +170,192 @@ def fetch_models(provider: str, api_key: str):
     except Exception as e:
         print(f"错误: {e}")
 
+
+# ============================================================================
+# 批量增量刷新 (--all)
+# ============================================================================
+
+def load_custom_providers(paths: list) -> dict:
+    """
+    读取自定义 provider
+
+    支持 ai-providers.json ({"custom": {...}}) 与 custom-providers.json ({id: {...}}) 两种格式；
+    只保留声明了 baseUrl 且支持 /models 的条目 (只有静态 models 列表的跳过)。
+    """
+    providers = {}
+    for path in paths:
+        text = Path(path).read_text(encoding='utf-8').strip()
+        if not text:
+            continue
+        data = json.loads(text)
+        entries = data.get('custom', {}) if 'custom' in data or '$schema' in data else data
+        for provider_id, entry in entries.items():
+            base_url = (entry.get('baseUrl') or '').rstrip('/')
+            supports = entry.get('supportsModelsApi')
+            if not base_url or supports is False or (supports is None and entry.get('models')):
+                continue
+            providers[provider_id] = {
+                'url': f"{base_url}/models",
+                'name': entry.get('name', provider_id),
+                'api_format': entry.get('apiFormat', 'openai'),
+                'needs_key': entry.get('needsApiKey', entry.get('authType') != 'none'),
+            }
+    return providers
+
+
+def api_key_env(provider: str) -> str:
+    return re.sub(r'[^A-Z0-9]', '_', provider.upper()) + '_API_KEY'
+
+
+def load_cache(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+async def fetch_pages(client: 'httpx.AsyncClient', sem: asyncio.Semaphore, api_format: str, base_url: str,
+                      api_key: str, data: dict) -> list:
+    """从第一页 data 开始取完分页的模型列表 (条件请求只作用于第一页)"""
+    models = simplify_models(api_format, data)
+    for _ in range(MODELS_MAX_PAGES - 1):
+        request = next_models_request(api_format, base_url, api_key, data)
+        if request is None:
+            break
+        async with sem:
+            response = await client.get(request[0], headers=request[1])
+        response.raise_for_status()
+        data = response.json()
+        models.extend(simplify_models(api_format, data))
+    return sort_models(models)
+
+
+async def refresh_provider(client: 'httpx.AsyncClient', sem: asyncio.Semaphore, provider: str, config: dict,
+                           cache_dir: Path, out_dir: Path) -> dict:
+    """刷新一个 provider，返回与上次缓存相比的差异"""
+    import httpx
+
+    result = {'provider': provider, 'name': config['name']}
+    api_key = os.environ.get(api_key_env(provider), '')
+    if not api_key and config.get('needs_key', True):
+        return {**result, 'status': 'skipped', 'error': f"未设置 {api_key_env(provider)}"}
+
+    cache_file = cache_dir / f"{provider}.json"
+    cached = load_cache(cache_file)
+    api_format = config.get('api_format', 'openai')
+    base_url = base_url_of(config)
+    url, headers = build_models_request(api_format, base_url, api_key)
+    headers = dict(headers)
+    if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+
+    start = time.perf_counter()
+    try:
+        async with sem:
+            response = await client.get(url, headers=headers)
+        if response.status_code == 304 and 'models' in cached:
+            models = cached['models']
+            status = 'not_modified'
+        else:
+            response.raise_for_status()
+            models = await fetch_pages(client, sem, api_format, base_url, api_key, response.json())
+            status = 'updated'
+            cache_file.write_text(json.dumps({
+                'etag': response.headers.get('etag'),
+                'last_modified': response.headers.get('last-modified'),
+                'fetched_at': int(time.time()),
+                'models': models,
+            }, ensure_ascii=False), encoding='utf-8')
+    except (httpx.HTTPError, ValueError) as e:
+        detail = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else str(e) or type(e).__name__
+        return {**result, 'status': 'error', 'error': detail, 'elapsed': round(time.perf_counter() - start, 2)}
+
+    old_ids = {m['id'] for m in cached.get('models', [])}
+    new_ids = {m['id'] for m in models}
+    added = sorted(new_ids - old_ids)
+    removed = sorted(old_ids - new_ids)
+    if added or removed:
+        write_output(provider, config['name'], models, str(out_dir / f'{provider}_models.json'))
+    return {
+        **result,
+        'status': status,
+        'first_run': 'models' not in cached,
+        'total': len(models),
+        'added': added,
+        'removed': removed,
+        'elapsed': round(time.perf_counter() - start, 2),
+    }
+
+
+async def refresh_all(providers: dict, concurrency: int, cache_dir: Path, out_dir: Path) -> list:
+    import httpx
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=limits, follow_redirects=True) as client:
+        return await asyncio.gather(*(
+            refresh_provider(client, sem, provider, config, cache_dir, out_dir)
+            for provider, config in providers.items()
+        ))
+
+
+def print_diff(results: list):
+    for r in results:
+        label = f"{r['name']} ({r['provider']})"
+        if r['status'] == 'skipped':
+            print(f"⏭  {label}: {r['error']}")
+        elif r['status'] == 'error':
+            print(f"❌ {label}: {r['error']}")
+        elif r['first_run']:
+            print(f"🆕 {label}: 首次获取 {r['total']} 个模型 ({r['elapsed']}s)")
+        elif not r['added'] and not r['removed']:
+            note = '304' if r['status'] == 'not_modified' else '无变化'
+            print(f"✔  {label}: {note}，共 {r['total']} 个 ({r['elapsed']}s)")
+        else:
+            print(f"✅ {label}: +{len(r['added'])} -{len(r['removed'])}，共 {r['total']} 个 ({r['elapsed']}s)")
+            for model_id in r['added']:
+                print(f"   + {model_id}")
+            for model_id in r['removed']:
+                print(f"   - {model_id}")
+
+
+def refresh_main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="并发增量刷新所有 provider 的模型列表")
+    parser.add_argument('--all', action='store_true', required=True)
+    parser.add_argument('--config', action='append', default=[], help="自定义 provider 配置 (可多次指定)")
+    parser.add_argument('--only', nargs='+', help="只刷新这些 provider")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出差异")
+    args = parser.parse_args(argv)
+
+    providers = {**PROVIDERS, **load_custom_providers(args.config)}
+    if args.only:
+        providers = {k: v for k, v in providers.items() if k in args.only}
+
+    start = time.perf_counter()
+    results = asyncio.run(refresh_all(providers, args.concurrency, Path(args.cache_dir), Path(args.out_dir)))
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        print_diff(results)
+        print(f"\n⏱  {len(results)} 个 provider，耗时 {time.perf_counter() - start:.1f}s")
+    return 1 if any(r['status'] == 'error' for r in results) else 0
+
+
 if __name__ == "__main__":
+    if '--all' in sys.argv[1:]:
+        sys.exit(refresh_main(sys.argv[1:]))
+
     if len(sys.argv) < 3:
         print("用法: python fetch_models.py <provider> <API_KEY>")
+        print("      python fetch_models.py --all [--config FILE] [--only P ...] [--concurrency N]")
         print(f"支持的 provider: {', '.join(PROVIDERS.keys())}")
         sys.exit(1)
-    
+
     fetch_models(sys.argv[1].lower(), sys.argv[2])